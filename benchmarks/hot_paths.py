@@ -0,0 +1,350 @@
+"""
+Repeatable benchmarks of the functions on the path from the TCU socket to the serial port.
+
+Every case is run over a grid of channel counts, block sizes and dtypes. Inputs are built with a fixed seed from
+test_data/raw_data_cocontraction.csv, the serial port and the TCU socket are replaced by in-memory fakes, and
+nothing is plotted, so the suite runs headless. Results are written as JSON, and a previous result file can be
+given with --compare to flag regressions.
+
+Run from the repository root:
+    python -m benchmarks.hot_paths --output results.json
+    python -m benchmarks.hot_paths --quick --compare results.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import config
+from tcu_simulator import load_csv_signals
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INPUT_CSV = os.path.join(REPO_ROOT, 'test_data', 'raw_data_cocontraction.csv')
+
+CHANNELS = [2, 4, 8, 16]
+BLOCK_SIZES = [1, 26, 125, 500, 2000]
+DTYPES = ['float64', 'float32']
+
+
+def load_inputs(channels, block_size, dtype, seed=0):
+    """
+    Block of shape (channels, block_size) from the recording: its channels are repeated to fill the channel count,
+    each copy shifted in time by a seeded random offset so the channels are not identical.
+    The recording is in mV after RAW_SIGNAL_GAIN, so it is scaled back to volts like TrignoEMG.read returns.
+    """
+    recording = load_csv_signals(INPUT_CSV) / config.RAW_SIGNAL_GAIN
+    rng = np.random.default_rng(seed)
+    offsets = rng.integers(0, recording.shape[1], size=channels)
+    idx = (offsets[:, None] + np.arange(block_size)[None, :]) % recording.shape[1]
+    rows = np.arange(channels) % recording.shape[0]
+    return recording[rows[:, None], idx].astype(dtype)
+
+
+class FakeSerial:
+    """ In-memory serial port: writes are counted, every read returns an ack byte. """
+    is_open = True
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        return b'\x00' * size
+
+
+class FakeSocket:
+    """ Data socket that delivers the same payload of TCU frames on every read. """
+    def __init__(self, payload):
+        self.payload = memoryview(payload)
+        self._position = 0
+
+    def recv_into(self, buffer, nbytes=0):
+        nbytes = min(nbytes or len(buffer), len(self.payload) - self._position)
+        buffer[:nbytes] = self.payload[self._position:self._position + nbytes]
+        self._position = (self._position + nbytes) % len(self.payload)
+        return nbytes
+
+    def close(self):
+        pass
+
+
+def _fake_trigno(channels, block_size, dtype):
+    """ TrignoEMG reading from a FakeSocket, without connecting to a TCU. """
+    import pytrigno
+
+    frames = np.zeros((block_size, 16), dtype='<f4')
+    frames[:, :channels] = load_inputs(channels, block_size, dtype).T
+    dev = pytrigno.TrignoEMG.__new__(pytrigno.TrignoEMG)
+    dev.total_channels = 16
+    dev.samples_per_read = block_size
+    dev.scaler = 1.
+    dev._min_recv_size = 16 * dev.BYTES_PER_CHANNEL
+    dev._buffer = bytearray()
+    dev._buffer_view = memoryview(dev._buffer)
+    dev._data_socket = FakeSocket(frames.tobytes())
+    dev._comm_socket = FakeSocket(b'')  # Only closed, by TrignoEMG.__del__
+    dev.set_channel_range((0, channels - 1))
+    return dev
+
+
+# Each case takes (channels, block_size, dtype) and returns the function to time, or raises to be reported as an
+# error. 'params' lists the grid parameters the case depends on, the others are fixed to their first value.
+
+def case_downsample(channels, block_size, dtype):
+    from emg_signal_processing import emg_preprocessing
+    x = np.abs(load_inputs(channels, block_size, dtype))
+    return lambda: emg_preprocessing.downsample(x, config.SENSOR_FREQ, config.PROCESSING_FREQ, axis=1)
+
+
+def case_streaming_resampler(channels, block_size, dtype):
+    from emg_signal_processing import resampler
+    x = np.abs(load_inputs(channels, block_size, dtype))
+    emg_resampler = resampler.StreamingResampler(2000, config.PROCESSING_FREQ, num_channels=channels)
+    return lambda: emg_resampler.process(x)
+
+
+def case_feature_extractor(channels, block_size, dtype):
+    from emg_signal_processing import features
+    x = load_inputs(channels, block_size, dtype)
+    extractor = features.FeatureExtractor(channels, 2000)
+    return lambda: extractor.process(x)
+
+
+def case_filter_signal(channels, block_size, dtype):
+    from emg_signal_processing import emg_preprocessing
+    x = np.abs(load_inputs(channels, block_size, dtype)) * config.RECTIFIED_SIGNAL_GAIN
+    emg_preprocessing.filter_signal(x, lowcut=config.FILTER_LOW_CUTOFF_FREQUENCY, fs=config.PROCESSING_FREQ,
+                                    order=config.FILTER_ORDER, axis=1)
+    return lambda: emg_preprocessing.filter_signal(x, lowcut=config.FILTER_LOW_CUTOFF_FREQUENCY,
+                                                   fs=config.PROCESSING_FREQ, order=config.FILTER_ORDER, axis=1)
+
+
+def case_preprocess_raw_data_directly(channels, block_size, dtype):
+    from emg_signal_processing import emg_preprocessing
+    from classes import ThreadSafeQueue
+    x = load_inputs(channels, block_size, dtype)
+    queue = ThreadSafeQueue(window_size=5)
+    envelope_filter = emg_preprocessing.StreamingFilter(num_channels=channels)
+    return lambda: emg_preprocessing.preprocess_raw_data_directly(x, queue, envelope_filter=envelope_filter)
+
+
+def _processed_inputs(block_size, dtype):
+    # Envelope levels around the hysteresis threshold, so the states switch now and then
+    x = np.abs(load_inputs(2, block_size, dtype)) * config.RAW_SIGNAL_GAIN * config.RECTIFIED_SIGNAL_GAIN / 10
+    return x.astype(dtype)
+
+
+def case_sequential_control(channels, block_size, dtype):
+    from emg_signal_processing import myoprocessor
+    from classes import ThreadSafeState
+    x = _processed_inputs(block_size, dtype)
+    hand_or_wrist, cocontraction = ThreadSafeState(), ThreadSafeState()
+    return lambda: myoprocessor.sequential_control(x, hand_or_wrist, cocontraction)
+
+
+def case_sequential_control_block(channels, block_size, dtype):
+    from emg_signal_processing import myoprocessor
+    from classes import ThreadSafeState
+    x = _processed_inputs(block_size, dtype)
+    hand_or_wrist, cocontraction = ThreadSafeState(), ThreadSafeState()
+    return lambda: myoprocessor.sequential_control_block(x, hand_or_wrist, cocontraction)
+
+
+def case_prosthesis_signals(channels, block_size, dtype):
+    from emg_signal_processing import to_prosthesis
+    hand, wrist = load_inputs(2, block_size, dtype) * config.RAW_SIGNAL_GAIN * 10
+    return lambda: to_prosthesis.prosthesis_signals(hand, wrist)
+
+
+def case_float_to_quantized_byte(channels, block_size, dtype):
+    import pyserial
+    values = (load_inputs(1, block_size, dtype)[0] * config.RAW_SIGNAL_GAIN * 10).tolist()
+    return lambda: [pyserial.float_to_quantized_byte(v) for v in values]
+
+
+def case_write_to_hand(channels, block_size, dtype):
+    import pyserial
+    setpoints = load_inputs(2, block_size, dtype) * config.RAW_SIGNAL_GAIN * 10
+    setpoints[1, setpoints[0] != 0] = 0  # Hand and wrist are never both active
+    ser = FakeSerial()
+    sink = io.StringIO()
+
+    def run():
+        # write_to_hand prints the ack of every packet
+        with contextlib.redirect_stdout(sink):
+            pyserial.write_to_hand(ser, setpoints)
+        sink.seek(0)
+        sink.truncate()
+    return run
+
+
+def case_encode_setpoints(channels, block_size, dtype):
+    import pyserial
+    setpoints = load_inputs(2, block_size, dtype) * config.RAW_SIGNAL_GAIN * 10
+    setpoints[1, setpoints[0] != 0] = 0
+    return lambda: pyserial.encode_setpoints(setpoints)
+
+
+def case_trigno_read(channels, block_size, dtype):
+    dev = _fake_trigno(channels, block_size, dtype)
+    out = np.empty((channels, block_size))
+    return lambda: dev.read(out=out)
+
+
+def case_base_read(channels, block_size, dtype):
+    import pytrigno
+    dev = _fake_trigno(channels, block_size, dtype)
+    return lambda: pytrigno._BaseTrignoDaq.read(dev, block_size)
+
+
+CASES = {
+    'downsample': (case_downsample, ('channels', 'block_size', 'dtype')),
+    'streaming_resampler': (case_streaming_resampler, ('channels', 'block_size', 'dtype')),
+    'feature_extractor': (case_feature_extractor, ('channels', 'block_size', 'dtype')),
+    'filter_signal': (case_filter_signal, ('channels', 'block_size', 'dtype')),
+    'preprocess_raw_data_directly': (case_preprocess_raw_data_directly, ('channels', 'block_size', 'dtype')),
+    'sequential_control': (case_sequential_control, ('block_size', 'dtype')),
+    'sequential_control_block': (case_sequential_control_block, ('block_size', 'dtype')),
+    'prosthesis_signals': (case_prosthesis_signals, ('block_size', 'dtype')),
+    'float_to_quantized_byte': (case_float_to_quantized_byte, ('block_size', 'dtype')),
+    'write_to_hand': (case_write_to_hand, ('block_size',)),
+    'encode_setpoints': (case_encode_setpoints, ('block_size', 'dtype')),
+    'trigno_read': (case_trigno_read, ('channels', 'block_size')),
+    '_BaseTrignoDaq.read': (case_base_read, ('block_size',)),
+}
+
+
+def time_function(func, repeats=5, min_time=0.02):
+    """
+    Calls func in batches long enough to be timed reliably. Returns the time per call of each batch in seconds.
+    """
+    func()  # Warm up
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * number * 1.2) // number)
+    times = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def run(cases, channels, block_sizes, dtypes, repeats, min_time):
+    grid = {'channels': channels, 'block_size': block_sizes, 'dtype': dtypes}
+    results = []
+    for name in cases:
+        make_case, params = CASES[name]
+        combinations = {(c if 'channels' in params else channels[0],
+                         n if 'block_size' in params else block_sizes[0],
+                         d if 'dtype' in params else dtypes[0])
+                        for c in grid['channels'] for n in grid['block_size'] for d in grid['dtype']}
+        for c, n, d in sorted(combinations):
+            result = {'case': name, 'channels': c, 'block_size': n, 'dtype': d}
+            try:
+                times = time_function(make_case(c, n, d), repeats, min_time)
+            except ImportError as e:
+                result['skipped'] = str(e)
+            except Exception as e:
+                result['error'] = "{}: {}".format(type(e).__name__, e)
+            else:
+                median = float(np.median(times))
+                result.update({'median_s': median, 'min_s': float(min(times)),
+                               'samples_per_s': n / median if median > 0 else None})
+            results.append(result)
+            print(_format_result(result), flush=True)
+    return results
+
+
+def _format_result(r):
+    label = "{:<30}{:>4} ch{:>6} samples  {:<8}".format(r['case'], r['channels'], r['block_size'], r['dtype'])
+    if 'skipped' in r:
+        return label + "  skipped ({})".format(r['skipped'])
+    if 'error' in r:
+        return label + "  error ({})".format(r['error'])
+    return label + "{:>12.2f} us{:>14.0f} samples/s".format(r['median_s'] * 1e6, r['samples_per_s'])
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Prints the cases that got slower than the baseline by more than threshold (e.g. 0.2 for 20 %).
+    Returns the number of regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    key = lambda r: (r['case'], r['channels'], r['block_size'], r['dtype'])
+    previous = {key(r): r for r in baseline['results'] if 'median_s' in r}
+    regressions = 0
+    for r in results:
+        old = previous.get(key(r))
+        if old is None or 'median_s' not in r:
+            continue
+        ratio = r['median_s'] / old['median_s']
+        if ratio > 1 + threshold:
+            regressions += 1
+            print("REGRESSION " + _format_result(r) + "  {:.2f} x slower".format(ratio))
+    print("{} regressions against {}".format(regressions, baseline_path))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--channels', nargs='+', type=int, default=CHANNELS)
+    parser.add_argument('--block-sizes', nargs='+', type=int, default=BLOCK_SIZES)
+    parser.add_argument('--dtypes', nargs='+', default=DTYPES)
+    parser.add_argument('--repeats', type=int, default=5, help="Timed batches per case.")
+    parser.add_argument('--min-time', type=float, default=0.02, help="Minimum seconds per timed batch.")
+    parser.add_argument('--quick', action='store_true', help="Small grid and short batches, for a smoke test.")
+    parser.add_argument('--output', help="JSON file to write the results to.")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare with.")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Slowdown counted as a regression.")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.channels, args.block_sizes, args.dtypes = [2, 16], [26, 2000], ['float64']
+        args.repeats, args.min_time = 3, 0.005
+
+    results = run(args.cases, args.channels, args.block_sizes, args.dtypes, args.repeats, args.min_time)
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'input': os.path.relpath(INPUT_CSV, REPO_ROOT),
+        'grid': {'channels': args.channels, 'block_sizes': args.block_sizes, 'dtypes': args.dtypes},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Results written to", args.output)
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare, args.threshold) else 0)
@@ -0,0 +1,75 @@
+"""
+Check of pyserial.SerialOutputEngine against the fake hand on a pseudo terminal (PtyHandSimulator, Linux and
+macOS only): setpoint blocks are submitted at the rate of the control loop, and on a line that keeps up every
+packet has to arrive at the hand, in order, and be acknowledged. Exits with status 1 if not.
+
+Run from the repository root:
+    python -m benchmarks.serial_output
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import serial
+import config
+import pyserial
+
+
+def setpoint_blocks(num_blocks, block_size, seed=0):
+    """
+    Random (2, block_size) setpoint blocks with only the hand or only the wrist active in each sample.
+    """
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for _ in range(num_blocks):
+        setpoints = rng.uniform(-5, 5, size=(2, block_size))
+        setpoints[rng.integers(0, 2, size=block_size), np.arange(block_size)] = 0
+        blocks.append(setpoints)
+    return blocks
+
+
+def check_idle_line(num_blocks, block_size, interval, ack_timeout=1.0):
+    """
+    Submits the blocks every interval seconds and returns the stats of the engine, the packets it should have sent
+    and the packets the hand received.
+    """
+    blocks = setpoint_blocks(num_blocks, block_size)
+    expected = [data[i:i + 4] for data, _ in map(pyserial.encode_setpoints, blocks)
+                for i in range(0, len(data), 4)]
+
+    sim = pyserial.PtyHandSimulator()
+    ser = serial.Serial(sim.port, timeout=0.1)
+    engine = pyserial.SerialOutputEngine(ser, skip_duplicates=False, ack_timeout=ack_timeout)
+    try:
+        for setpoints in blocks:
+            engine.submit(setpoints)
+            time.sleep(interval)
+        deadline = time.monotonic() + ack_timeout
+        while engine.acks + engine.lost < len(expected) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        engine.close()
+        ser.close()
+        sim.close()
+    return engine.stats(), expected, [packet for _, packet in sim.packets]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=50, help="Setpoint blocks submitted.")
+    parser.add_argument('--block-size', type=int, default=20, help="Setpoint samples per block.")
+    parser.add_argument('--interval', type=float, default=config.SENSOR_FREQ / 2000,
+                        help="Seconds between two blocks, the block period of the Trigno by default.")
+    args = parser.parse_args()
+
+    stats, expected, received = check_idle_line(args.blocks, args.block_size, args.interval)
+    print("{} packets expected, {} received by the hand".format(len(expected), len(received)))
+    print("Engine: {submitted} submitted, {sent} sent, {coalesced} coalesced, {acks} acknowledged, "
+          "{lost} lost, {errors} errors".format(**stats))
+    if received != expected or stats['coalesced'] or stats['acks'] != len(expected):
+        print("FAILED: the idle line did not get every packet")
+        sys.exit(1)
+    print("OK")
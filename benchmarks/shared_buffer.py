@@ -0,0 +1,113 @@
+"""
+Throughput of shared_buffer.SharedRingBuffer against the Manager().list() based buffer
+(Multiprocess_Safe_Buffer in main.py), with one writer process and one reader process.
+
+Run from the repository root:
+    python -m benchmarks.shared_buffer
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from shared_buffer import SharedRingBuffer
+
+
+class ManagerBuffer:
+    """ Same push/copy as Multiprocess_Safe_Buffer in main.py, which can't be imported without a GUI backend. """
+    def __init__(self, manager, length):
+        self.length = length
+        self.buf = manager.list([np.zeros(16) for _ in range(length)])
+        self.lock = manager.Lock()
+
+    def push(self, value):
+        with(self.lock):
+            for i in range (self.length-1,0,-1):
+                self.buf[i] = self.buf[i-1]
+            self.buf[0] = value
+
+    def copy(self):
+        with(self.lock):
+            return np.array(self.buf)
+
+
+def _shared_reader(name, total_samples, ready_event, stop_event, result):
+    ring = SharedRingBuffer.attach(name)
+    cursor = ring.cursor(from_start=True)
+    ready_event.set()
+    received = 0
+    while cursor.seq < total_samples and not stop_event.is_set():
+        if cursor.available() == 0:
+            time.sleep(0)
+            continue
+        block = cursor.read()
+        received += block.shape[1]
+    result.value = received
+    ring.close()
+
+
+def bench_shared(total_samples, block_size, num_channels=16):
+    num_blocks = total_samples // block_size
+    ring = SharedRingBuffer(num_channels=num_channels, capacity=max(8 * block_size, 4096))
+    ready_event = multiprocessing.Event()
+    stop_event = multiprocessing.Event()
+    result = multiprocessing.Value('q', 0)
+    reader = multiprocessing.Process(target=_shared_reader,
+                                     args=(ring.name, num_blocks * block_size, ready_event, stop_event, result))
+    reader.start()
+    ready_event.wait()
+
+    block = np.random.default_rng(0).standard_normal((num_channels, block_size))
+    start = time.perf_counter()
+    for _ in range(num_blocks):
+        ring.write(block)
+    elapsed = time.perf_counter() - start
+    reader.join(timeout=60)
+    stop_event.set()
+    ring.close()
+    return num_blocks * block_size / elapsed, result.value
+
+
+def _manager_reader(buffer, stop_event, result):
+    reads = 0
+    while not stop_event.is_set():
+        buffer.copy()
+        reads += 1
+    result.value = reads
+
+
+def bench_manager(total_samples, length=1000):
+    with multiprocessing.Manager() as manager:
+        buffer = ManagerBuffer(manager, length)
+        stop_event = multiprocessing.Event()
+        result = multiprocessing.Value('q', 0)
+        reader = multiprocessing.Process(target=_manager_reader, args=(buffer, stop_event, result))
+        reader.start()
+
+        sample = np.zeros(16)
+        start = time.perf_counter()
+        for _ in range(total_samples):
+            buffer.push(sample)
+        elapsed = time.perf_counter() - start
+        stop_event.set()
+        reader.join(timeout=60)
+    return total_samples / elapsed, result.value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--samples', type=int, default=2_000_000, help="Samples written to the shared ring buffer.")
+    parser.add_argument('--block-size', type=int, default=26, help="Samples per write, 26 is what the TCU delivers.")
+    parser.add_argument('--manager-samples', type=int, default=20,
+                        help="Samples pushed to the Manager buffer, it is very slow.")
+    parser.add_argument('--manager-length', type=int, default=1000, help="Length of the Manager buffer.")
+    args = parser.parse_args()
+
+    rate, received = bench_shared(args.samples, args.block_size)
+    print("SharedRingBuffer: {:12.0f} samples/s written, {} of {} samples received by the reader".format(
+        rate, received, args.samples - args.samples % args.block_size))
+    rate, reads = bench_manager(args.manager_samples, args.manager_length)
+    print("Manager buffer:   {:12.0f} samples/s written, {} copies made by the reader".format(rate, reads))
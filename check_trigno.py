@@ -53,7 +53,7 @@ def check_accel(host):
     dev.start()
     for i in range(4):
         data = dev.read()
-        assert data.shape == (3, 10)
+        assert data.shape == (3, 3, 10)  # (sensors, xyz, samples)
     dev.stop()
 
 '''
@@ -2,6 +2,7 @@ from collections import deque
 import threading
 import config
 import numpy as np
+from emg_signal_processing import filter_bank
 
 
 
@@ -66,6 +67,21 @@ class ThreadSafeState:
         with self._lock:
             return self._prev_state
 
+    def get_states(self):
+        """
+        Returns (state, prev_state) taken under one lock.
+        """
+        with self._lock:
+            return self._state, self._prev_state
+
+    def set_states(self, state: bool, prev_state: bool):
+        """
+        Sets both the state and the previous state under one lock.
+        """
+        with self._lock:
+            self._state = state
+            self._prev_state = prev_state
+
 
 #deque(maxlen=N): A bounded deque that restricts the maximum number of elements (N) it can hold. When new items are added and the deque is full, the oldest items are automatically removed to accommodate the new items.
 class DataWindow:
@@ -92,6 +108,139 @@ class DataWindow:
             return list(self.window)
 
 
+class RingBuffer:
+    """
+    Preallocated ring buffer of shape (num_channels, capacity), written by one producer and read by any number of consumers.
+
+    Every written sample gets a sequence number from a monotonically increasing write counter. Consumers keep their own
+    read position (see RingBufferCursor) and get zero-copy views of the samples written since then, so the plotter,
+    recorder and controller can all read the same stream without copying it and without taking the lock.
+    The views point into the buffer, so a consumer that falls more than capacity samples behind has its data
+    overwritten. This is detected from the sequence numbers and reported as an overrun.
+    """
+    def __init__(self, num_channels, capacity, dtype=np.float64):
+        self.buffer = np.zeros((num_channels, capacity), dtype=dtype)
+        self.num_channels = num_channels
+        self.capacity = capacity
+        self._write_seq = 0  # Total number of samples written
+        self.condition = threading.Condition()
+
+    @property
+    def write_seq(self):
+        return self._write_seq
+
+    def write(self, block):
+        """
+        Appends a block of shape (num_channels, samples). A 1-D array is one sample of every channel.
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(self.num_channels, 1)
+        n = block.shape[1]
+        # Only the last capacity samples of a very large block are kept
+        kept = block[:, -self.capacity:] if n > self.capacity else block
+
+        start = (self._write_seq + n - kept.shape[1]) % self.capacity
+        first = min(kept.shape[1], self.capacity - start)
+        self.buffer[:, start:start + first] = kept[:, :first]
+        self.buffer[:, :kept.shape[1] - first] = kept[:, first:]
+
+        with self.condition:
+            self._write_seq += n
+            self.condition.notify_all()
+
+    def _views(self, start_seq, end_seq):
+        start = start_seq % self.capacity
+        n = end_seq - start_seq
+        if start + n <= self.capacity:
+            return [self.buffer[:, start:start + n]]
+        return [self.buffer[:, start:], self.buffer[:, :start + n - self.capacity]]
+
+    def read_since(self, seq, max_samples=None):
+        """
+        Returns the samples written since sequence number seq as zero-copy views.
+
+        Parameters:
+        - seq: Sequence number of the first sample wanted.
+        - max_samples: Optional limit on the number of samples returned.
+
+        Returns:
+        - views: List of one or two (num_channels, k) views, two if the samples wrap around the end of the buffer.
+        - start_seq: Sequence number of the first returned sample. Larger than seq if samples were overwritten.
+        - end_seq: Sequence number after the last returned sample, the seq to pass in the next call.
+        """
+        end_seq = self._write_seq
+        start_seq = max(seq, end_seq - self.capacity, 0)
+        if max_samples is not None:
+            end_seq = min(end_seq, start_seq + max_samples)
+        return self._views(start_seq, end_seq), start_seq, end_seq
+
+    def overrun(self, seq):
+        """
+        Returns how many samples from sequence number seq on have been overwritten. Check this after using the
+        views from read_since to know if the producer wrote over them while they were in use.
+        """
+        return max(0, self._write_seq - self.capacity - seq)
+
+    def latest(self, num_samples, out=None):
+        """
+        Returns a copy of the last num_samples samples in time order, zero padded at the start if fewer are written.
+        If out is given, of shape (num_channels, num_samples), the samples are copied into it instead.
+        """
+        if out is None:
+            out = np.empty((self.num_channels, num_samples), dtype=self.buffer.dtype)
+        end_seq = self._write_seq
+        start_seq = max(end_seq - min(num_samples, self.capacity), 0)
+        padding = num_samples - (end_seq - start_seq)
+        out[:, :padding] = 0
+        np.concatenate(self._views(start_seq, end_seq), axis=1, out=out[:, padding:])
+        return out
+
+    def wait(self, seq, timeout=None):
+        """
+        Blocks until a sample with sequence number seq or later is written, or the timeout runs out.
+        Returns the current write sequence number.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self._write_seq > seq, timeout)
+            return self._write_seq
+
+    def cursor(self, from_start=False):
+        """
+        Creates a read cursor for a new consumer, starting at the next written sample (or the oldest sample kept).
+        """
+        return RingBufferCursor(self, 0 if from_start else self._write_seq)
+
+
+class RingBufferCursor:
+    """
+    Read position of one consumer of a RingBuffer (or of a shared_buffer.SharedRingBuffer).
+    """
+    def __init__(self, ring, seq=0):
+        self.ring = ring
+        self.seq = seq
+        self.dropped = 0  # Number of samples this consumer lost to overruns
+
+    def read(self, max_samples=None):
+        """
+        Returns the samples written since the last read, as returned by read_since of the buffer, and moves the
+        cursor past them. For a RingBuffer these are zero-copy views.
+        """
+        views, start_seq, end_seq = self.ring.read_since(self.seq, max_samples)
+        self.dropped += start_seq - self.seq
+        self.seq = end_seq
+        return views
+
+    def available(self):
+        return self.ring.write_seq - self.seq
+
+    def wait(self, timeout=None):
+        """
+        Blocks until there is something to read, or the timeout runs out.
+        """
+        return self.ring.wait(self.seq, timeout) > self.seq
+
+
 ''' Class for configuration values, so that it can easily be refressed during runtime. '''
 class Config:
     def __init__(self):
@@ -114,6 +263,9 @@ class Config:
         self.WRIST_GAIN = config.WRIST_GAIN
 
     def refresh(self):
+        # Key of the filter design from the values we had, to drop it from the design cache if it changes
+        old_filter_key = filter_bank.config_filter_key(self)
+
         self.TCU_IP = config.TCU_IP
         self.COMMAND_PORT = config.COMMAND_PORT
         self.EMG_PORT = config.EMG_PORT
@@ -130,4 +282,8 @@ class Config:
         self.HAND_DEADBAND_TRESHOLD = config.HAND_DEADBAND_TRESHOLD
         self.WRIST_DEADBAND_TRESHOLD = config.WRIST_DEADBAND_TRESHOLD
         self.HAND_GAIN = config.HAND_GAIN
-        self.WRIST_GAIN = config.WRIST_GAIN
\ No newline at end of file
+        self.WRIST_GAIN = config.WRIST_GAIN
+
+        # Only the design that changed is invalidated, unchanged designs stay cached
+        if filter_bank.config_filter_key(self) != old_filter_key:
+            filter_bank.invalidate(*old_filter_key)
@@ -0,0 +1,278 @@
+"""
+Control loop parameters compiled into an immutable snapshot, reloaded from config.py while the loop runs.
+
+The hot functions read their parameters from the config module on every call. CompiledPipeline instead resolves
+them once into a PipelineSnapshot (a namedtuple, so it cannot be changed while a block uses it) and passes them to
+preprocess_block, sequential_control_block and prosthesis_signals as arguments.
+
+ConfigWatcher polls config.py, and optionally a JSON sidecar file with overrides, on its own thread. When one of
+them changes it compiles a new snapshot there, designing the filter if needed, and publishes it. The control loop
+picks the newest snapshot up at the start of the next block, so a block is always processed with one set of
+parameters and the loop never waits for the reload. The envelope filter and the resampler, with their state, are
+kept when their design is the same in the new snapshot. When it is not, the new ones are built by publish() on the
+watcher thread.
+
+The channels, ports and other settings that are fixed once the connection is made are not reloaded.
+"""
+import json
+import os
+import runpy
+import threading
+import types
+from collections import namedtuple
+
+import config
+from classes import ThreadSafeState
+from emg_signal_processing import filter_bank, emg_preprocessing, myoprocessor, to_prosthesis, resampler
+
+PipelineSnapshot = namedtuple('PipelineSnapshot', [
+    'version',
+    'sensor_freq', 'processing_freq', 'rectified_gain',
+    'filter_stages', 'filter_fs',
+    'exact_resampling', 'resampler_zero_crossings',
+    'hysteresis_threshold', 'hysteresis_width',
+    'hand_gain', 'wrist_gain', 'hand_deadband', 'wrist_deadband',
+])
+PipelineSnapshot.__doc__ = """
+Parameters of the control loop from sensor block to setpoints. filter_stages is the stage list of the
+envelope FilterBank (the low-pass and the baseline high-pass, like StreamingFilter), and its design is in the
+filter_bank cache once the snapshot is compiled. With exact_resampling the raw blocks are resampled to
+processing_freq by a StreamingResampler instead of averaged.
+"""
+
+
+def read_config_values(path=None, sidecar=None):
+    """
+    The upper case values of a config file, with the values of a JSON sidecar file on top.
+
+    Parameters:
+    - path: Python config file. Defaults to config.py. The file is run, not imported, so the config module is
+      not changed.
+    - sidecar: Optional JSON file with a dict of overrides, e.g. {"HAND_GAIN": 1.5}.
+
+    Returns:
+    - Dict of name to value.
+    """
+    path = config.__file__ if path is None else path
+    values = {key: value for key, value in runpy.run_path(path).items() if key.isupper()}
+    if sidecar is not None and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise ValueError("{} should hold a JSON object of config values.".format(sidecar))
+        values.update(overrides)
+    return values
+
+
+def compile_snapshot(values, version=0):
+    """
+    Resolves config values into a PipelineSnapshot and designs its filter, so using it costs nothing later.
+    Raises ValueError if the values do not give a valid pipeline.
+
+    Parameters:
+    - values: Dict of config values, as returned by read_config_values, or a config module.
+    - version: Number of the snapshot, counted up by the watcher.
+    """
+    cfg = values if not isinstance(values, dict) else types.SimpleNamespace(**values)
+    kind, order, cutoffs, fs = filter_bank.config_filter_key(cfg)
+    if len(cutoffs) == 1:
+        cutoffs = cutoffs[0]
+    elif len(cutoffs) == 0:
+        raise ValueError("No cutoff frequency given for the '{}' filter.".format(kind))
+    filter_stages = [(kind, order, cutoffs)]
+    if cfg.BASELINE_CUTOFF_FREQUENCY:
+        filter_stages.append(('high', 1, cfg.BASELINE_CUTOFF_FREQUENCY))
+
+    # Designs the filters now, and raises if the cutoffs do not fit the sampling frequency
+    for stage_kind, stage_order, stage_cutoffs in filter_stages:
+        filter_bank.design_filter(stage_kind, stage_order, stage_cutoffs, fs, 'sos')
+
+    return PipelineSnapshot(
+        version=version,
+        sensor_freq=cfg.SENSOR_FREQ,
+        processing_freq=cfg.PROCESSING_FREQ,
+        rectified_gain=cfg.RECTIFIED_SIGNAL_GAIN,
+        filter_stages=tuple(filter_stages),
+        filter_fs=fs,
+        exact_resampling=bool(cfg.EXACT_RESAMPLING),
+        resampler_zero_crossings=cfg.RESAMPLER_ZERO_CROSSINGS,
+        hysteresis_threshold=cfg.HYSTERESIS_THRESHOLD,
+        hysteresis_width=cfg.HYSTERESIS_WIDTH,
+        hand_gain=cfg.HAND_GAIN,
+        wrist_gain=cfg.WRIST_GAIN,
+        hand_deadband=cfg.HAND_DEADBAND_TRESHOLD,
+        wrist_deadband=cfg.WRIST_DEADBAND_TRESHOLD,
+    )
+
+
+class CompiledPipeline:
+    """
+    Runs a raw block through preprocessing, sequential control and the setpoint mapping with the parameters of
+    one snapshot. A new snapshot given to publish() is taken into use at the start of the next block.
+
+    Parameters:
+    - num_channels: Number of EMG channels in the blocks.
+    - hand_or_wrist, cocontraction: ThreadSafeState of the sequential control. New ones if not given.
+    - snapshot: First snapshot. Compiled from the config module if not given.
+    - raw_rate: Sampling rate of the raw blocks in Hz, used by the resampler.
+    """
+    def __init__(self, num_channels, hand_or_wrist=None, cocontraction=None, snapshot=None, raw_rate=2000):
+        self.num_channels = num_channels
+        self.raw_rate = raw_rate
+        self.hand_or_wrist = ThreadSafeState() if hand_or_wrist is None else hand_or_wrist
+        self.cocontraction = ThreadSafeState() if cocontraction is None else cocontraction
+        self.snapshot = compile_snapshot(config) if snapshot is None else snapshot
+        self.envelope_filter = self._make_filter(self.snapshot)
+        self.resampler = self._make_resampler(self.snapshot)
+        self.swaps = 0
+        self.filter_changes = 0
+        self.resampler_changes = 0
+        # Newest published snapshot and the filter and resampler built for it, if their design changed. Replacing
+        # the tuple is atomic, so no lock is needed
+        self._latest = (self.snapshot, None, None)
+
+    @staticmethod
+    def _filter_design(snapshot):
+        return snapshot.filter_stages, snapshot.filter_fs
+
+    @staticmethod
+    def _resampler_design(snapshot):
+        if not snapshot.exact_resampling:
+            return None
+        return snapshot.processing_freq, snapshot.resampler_zero_crossings
+
+    def _make_filter(self, snapshot):
+        return filter_bank.FilterBank(snapshot.filter_stages, fs=snapshot.filter_fs, num_channels=self.num_channels)
+
+    def _make_resampler(self, snapshot):
+        if not snapshot.exact_resampling:
+            return None
+        return resampler.StreamingResampler(self.raw_rate, snapshot.processing_freq, num_channels=self.num_channels,
+                                            zero_crossings=snapshot.resampler_zero_crossings)
+
+    @property
+    def latest(self):
+        """ The newest published snapshot, taken into use at the next block. """
+        return self._latest[0]
+
+    def publish(self, snapshot):
+        """
+        Makes snapshot the one used from the next block on. Safe to call from any thread. A new envelope filter or
+        resampler is built here if the snapshot changes its design, so the control loop only has to swap it in.
+        """
+        current = self.snapshot
+        new_filter = None
+        new_resampler = None
+        if self._filter_design(snapshot) != self._filter_design(current):
+            new_filter = self._make_filter(snapshot)
+        if self._resampler_design(snapshot) != self._resampler_design(current):
+            new_resampler = self._make_resampler(snapshot)
+        self._latest = (snapshot, new_filter, new_resampler)
+
+    def _swap(self):
+        latest, new_filter, new_resampler = self._latest
+        if latest is self.snapshot:
+            return
+        # The prepared filter or resampler is missing only if a swap ran while publish() compared the designs
+        if self._filter_design(latest) != self._filter_design(self.snapshot):
+            self.envelope_filter = new_filter if new_filter is not None else self._make_filter(latest)
+            self.filter_changes += 1
+        if self._resampler_design(latest) != self._resampler_design(self.snapshot):
+            self.resampler = new_resampler if new_resampler is not None else self._make_resampler(latest)
+            self.resampler_changes += 1
+        self.snapshot = latest
+        self.swaps += 1
+
+    def process(self, raw_data, return_states=False):
+        """
+        Processes one raw block of shape (channels, samples).
+
+        Returns:
+        - processed: The preprocessed block, shape (channels, downsampled samples).
+        - setpoints: Array of shape (2, downsampled samples) with the hand and wrist setpoints.
+        - wrist_control: Only if return_states. Boolean array, True where the sample is in wrist control.
+        """
+        self._swap()
+        s = self.snapshot
+        processed = emg_preprocessing.preprocess_block(raw_data, envelope_filter=self.envelope_filter, center=False,
+                                                       original_rate=s.sensor_freq, target_rate=s.processing_freq,
+                                                       gain=s.rectified_gain, resampler=self.resampler)
+        hand_controll, wrist_controll, wrist_control = myoprocessor.sequential_control_block(
+            processed, self.hand_or_wrist, self.cocontraction, threshold=s.hysteresis_threshold,
+            width=s.hysteresis_width, return_states=True)
+        setpoints = to_prosthesis.prosthesis_signals(hand_controll, wrist_controll, hand_gain=s.hand_gain,
+                                                     wrist_gain=s.wrist_gain, hand_threshold=s.hand_deadband,
+                                                     wrist_threshold=s.wrist_deadband)
+        if return_states:
+            return processed, setpoints, wrist_control
+        return processed, setpoints
+
+
+class ConfigWatcher:
+    """
+    Polls config.py and an optional JSON sidecar file, and publishes a new snapshot to the pipeline when one of
+    them changes. A file that fails to load or gives invalid values is reported and the old snapshot is kept.
+
+    Parameters:
+    - pipeline: CompiledPipeline to publish to.
+    - path: Python config file. Defaults to config.py.
+    - sidecar: Optional JSON file with overrides, see read_config_values.
+    - interval: Seconds between the checks of the modification times.
+    - stop_event: Optional threading.Event that stops the watcher.
+    """
+    def __init__(self, pipeline, path=None, sidecar=None, interval=0.5, stop_event=None):
+        self.pipeline = pipeline
+        self.path = config.__file__ if path is None else path
+        self.sidecar = sidecar
+        self.interval = interval
+        self.stop_event = threading.Event() if stop_event is None else stop_event
+        self.reloads = 0
+        self.errors = 0
+        self._version = pipeline.snapshot.version
+        self._stamps = self._file_stamps()
+        self._thread = None
+
+    def _file_stamps(self):
+        stamps = []
+        for path in (self.path, self.sidecar):
+            try:
+                stat = os.stat(path) if path is not None else None
+                stamps.append((stat.st_mtime_ns, stat.st_size) if stat is not None else None)
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def check(self):
+        """
+        Reloads and publishes if a file changed since the last check. Returns True if a new snapshot was published.
+        """
+        stamps = self._file_stamps()
+        if stamps == self._stamps:
+            return False
+        self._stamps = stamps
+        try:
+            snapshot = compile_snapshot(read_config_values(self.path, self.sidecar), version=self._version + 1)
+        except Exception as e:
+            print("Error reloading config, keeping the current values:", e)
+            self.errors += 1
+            return False
+        if snapshot[1:] == self.pipeline.latest[1:]:
+            return False  # E.g. only a comment changed
+        self._version = snapshot.version
+        self.pipeline.publish(snapshot)
+        self.reloads += 1
+        return True
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
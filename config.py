@@ -15,11 +15,21 @@ ACTIVE_CHANNELS = [1,2]
 
 ## EMG Preprocessing values
 SENSOR_FREQ = 125
-PROCESSING_FREQ = 33.3
+PROCESSING_FREQ = 33.3 # Without EXACT_RESAMPLING, int(SENSOR_FREQ / PROCESSING_FREQ) samples are averaged, so the envelope really runs at 125 / 3 = 41.7 Hz. The filters are designed for that rate
 RAW_SIGNAL_GAIN = 1000 ## This should be changed in Lab 1, maybe remove to main script
 RECTIFIED_SIGNAL_GAIN = 120
 FILTER_LOW_CUTOFF_FREQUENCY = 10
+FILTER_HIGH_CUTOFF_FREQUENCY = None
 FILTER_ORDER = 4
+FILTER_BTYPE = 'low'
+BASELINE_CUTOFF_FREQUENCY = 0.3 # First-order high-pass after the envelope filter in StreamingFilter, removes the baseline instead of the per-block mean. None to keep the baseline
+EXACT_RESAMPLING = False # Resample the raw EMG to exactly PROCESSING_FREQ with a streaming polyphase filter instead of averaging SENSOR_FREQ/PROCESSING_FREQ samples, see emg_signal_processing/resampler.py
+RESAMPLER_ZERO_CROSSINGS = 3 # Filter half length of the resampler in periods of PROCESSING_FREQ. The resampler delays the envelope by this many periods, 3 gives 90 ms
+
+## Time-domain features (RMS, MAV, WL, ZC, SSC, WAMP) of the raw EMG, see emg_signal_processing/features.py
+FEATURE_EXTRACTION = False # Compute the features in main3 and put them in feature_queue (and the recording)
+FEATURE_WINDOW = 0.2 # Window length in seconds
+FEATURE_HOP = 0.025 # Seconds between two feature matrices
 
 HAND_DEADBAND_TRESHOLD = 0.7
 WRIST_DEADBAND_TRESHOLD = 0.7
@@ -30,6 +40,24 @@ WRIST_GAIN = 1.3
 HYSTERESIS_THRESHOLD = 3
 HYSTERESIS_WIDTH = 1
 
+## Analog output
+DAQ_OUTPUT = False # Also stream the hand and wrist setpoints to the analog outputs of the NI DAQ (niDAQ.DEV_NAME, ao0 and ao1)
+
+## Plotting
+PLOT_MODE = 'thread' # 'thread' plots in the main process, 'process' plots in a separate process fed from shared memory
+PLOT_DISPLAY_RATE = 30 # Plot updates per second in 'process' mode
+PLOT_WINDOW_SECONDS = 5 # Seconds of data shown in the plots in 'process' mode
+
+## Recording
+RECORDING_DIR = None # Directory to record the session to (raw, preprocessed and setpoints), see recorder.py. None to not record
+
+## Live reconfiguration
+CONFIG_WATCH = False # Reload the processing and control values of this file while main3 runs, see compiled_pipeline.py
+CONFIG_SIDECAR = None # Optional JSON file with values that override this file, also watched, e.g. 'config_overrides.json'
+
+## Latency measurement
+LATENCY_TRACKING = False # Record the latency of every block from the TCU socket to the serial write, printed at exit
+
 
 
 
@@ -7,3 +7,6 @@ from . import emg_in
 from . import emg_preprocessing
 from . import myoprocessor
 from . import to_prosthesis
+from . import filter_bank
+from . import resampler
+from . import features
@@ -1,14 +1,15 @@
 import pytrigno
 import time
 import config
+from trigno_sync import TrignoSyncAcquisition
 
 
-def trigno_startup():
+def trigno_startup(stop_event=None):
     try:
         start_conn = time.time()
         print("Connecting to Trigno EMG device...", start_conn)
-        dev = pytrigno.TrignoEMG(active_channels=config.ACTIVE_CHANNELS, samples_per_read=config.SENSOR_FREQ, # Note! Must have samples_per_read at least 1000 for filtfilt to work
-                            host='localhost', cmd_port=config.COMMAND_PORT, data_port=config.EMG_PORT)
+        dev = pytrigno.TrignoEMG(active_channels=config.ACTIVE_CHANNELS, samples_per_read=config.SENSOR_FREQ, # Note! filtfilt needs large blocks, with emg_preprocessing.StreamingFilter any block size works
+                            host='localhost', cmd_port=config.COMMAND_PORT, data_port=config.EMG_PORT, stop_event=stop_event)
         dev.start()
         end_conn = time.time()
         print("Connected to Trigno EMG device.",end_conn)   
@@ -21,12 +22,49 @@ def trigno_startup():
         print("Unknown error:", e)
         return None
     
-def read_raw_data(dev): # Change queue to window
+def trigno_sync_startup(stop_event=None, accel_samples_per_read=2):
+    """
+    Connects to both the EMG and the accelerometer data ports and starts a synchronized acquisition.
+
+    Parameters:
+    - stop_event: threading.Event for handling interrupts while running.
+    - accel_samples_per_read: Accelerometer samples per read. Small blocks keep the motion data fresh.
+
+    Returns:
+    - trigno_sync.TrignoSyncAcquisition, or None if the device could not be started.
+    """
+    try:
+        emg = pytrigno.TrignoEMG(active_channels=config.ACTIVE_CHANNELS, samples_per_read=config.SENSOR_FREQ,
+                                 host='localhost', cmd_port=config.COMMAND_PORT, data_port=config.EMG_PORT, stop_event=stop_event)
+        accel = pytrigno.TrignoAccel(active_channels=config.ACTIVE_CHANNELS, samples_per_read=accel_samples_per_read,
+                                     host='localhost', cmd_port=config.COMMAND_PORT, data_port=config.ACC_PORT, stop_event=stop_event)
+        acquisition = TrignoSyncAcquisition(emg, accel, stop_event=stop_event)
+        acquisition.start()
+        print("Connected to Trigno EMG and accelerometer.")
+        return acquisition
+    except IOError as e:
+        print("Error reading EMG data:", e)
+        return None
+    except Exception as e:
+        print("Unknown error:", e)
+        return None
+
+def read_raw_data(dev, raw_emg_queue=None, clock=None): # Change queue to window
+    """
+    Reads one block from the Trigno and applies RAW_SIGNAL_GAIN. With a clock, e.g. LatencyTracker.stamp, its time
+    right after the read is returned with the block as (stamp, raw_data). Returns None if the read fails.
+    """
     try:
         raw_data = dev.read()
-        raw_data_gained = raw_data*config.RAW_SIGNAL_GAIN
+        if clock is not None:
+            stamp = clock()
+        raw_data *= config.RAW_SIGNAL_GAIN # dev.read returns a new array, so the gain can be applied in place
+        if raw_emg_queue is not None:
+            raw_emg_queue.append(raw_data)
             
-        return raw_data_gained
+        if clock is not None:
+            return stamp, raw_data
+        return raw_data
     
     except IOError as e:
         print("Error reading EMG data:", e)
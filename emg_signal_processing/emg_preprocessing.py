@@ -1,7 +1,9 @@
 import numpy as np
-from scipy.signal import butter, filtfilt
+from scipy.signal import filtfilt
 import config
 import time
+from .filter_bank import FilterBank, design_filter, config_envelope_rate
+from .resampler import StreamingResampler
 
 def butter_filter(lowcut=None, fs=1.0, order=4, btype='low'):
     """
@@ -13,37 +15,140 @@ def butter_filter(lowcut=None, fs=1.0, order=4, btype='low'):
     order: order of the Butterworth filter
     btype: type of filter ('low')
     """
-    nyq = 0.5 * fs  # Nyquist frequency
-    low = None
-
-    if lowcut is not None:
-        low = lowcut / nyq
-
     if btype == 'low':
-        b, a = butter(order, low, btype='low')
+        b, a = design_filter('low', order, lowcut, fs, output='ba')  # Cached, only designed the first time
     else:
         raise ValueError("Invalid filter type. Can only be lowpass.")
 
     return b, a
 
 
-def filter_signal(emg_signal, lowcut=None, fs=1.0, order=4, btype='low'):
+def filter_signal(emg_signal, lowcut=None, fs=1.0, order=4, btype='low', axis=-1):
     b, a = butter_filter(lowcut=lowcut, fs=fs, order=order, btype=btype)
-    filtered_signal = filtfilt(b, a, emg_signal)
+    filtered_signal = filtfilt(b, a, emg_signal, axis=axis)
     return filtered_signal
 
 
-def downsample(signal, original_rate, target_rate):
+class StreamingFilter(FilterBank):
+    """
+    Causal low-pass Butterworth filter that carries its state between blocks, followed by a first-order high-pass
+    that removes the slow baseline of the envelope.
+
+    Unlike filter_signal, which runs filtfilt on every block, the filter state (zi) of each
+    channel is kept, so consecutive blocks are filtered as one continuous signal without edge
+    transients. Blocks can be as small as one sample. The coefficients are designed once, from
+    the config.FILTER_* values unless given.
+
+    The high-pass takes the place of removing the mean of each block, which would put a step in the envelope at
+    every block boundary. Without either, the envelope sits above the hysteresis band of the sequential control.
+
+    Parameters:
+    - num_channels: Number of channels (rows) in the blocks that will be filtered.
+    - lowcut: Cutoff frequency. Defaults to config.FILTER_LOW_CUTOFF_FREQUENCY.
+    - fs: Sampling frequency of the blocks. Defaults to the rate preprocess_block gives with the config, see
+      filter_bank.config_envelope_rate.
+    - order: Order of the Butterworth filter. Defaults to config.FILTER_ORDER.
+    - baseline_cutoff: Cutoff frequency of the baseline high-pass. Defaults to config.BASELINE_CUTOFF_FREQUENCY.
+      0 or None in config leaves the baseline in.
+    """
+    def __init__(self, num_channels, lowcut=None, fs=None, order=None, baseline_cutoff=None):
+        self.lowcut = config.FILTER_LOW_CUTOFF_FREQUENCY if lowcut is None else lowcut
+        self.order = config.FILTER_ORDER if order is None else order
+        self.baseline_cutoff = config.BASELINE_CUTOFF_FREQUENCY if baseline_cutoff is None else baseline_cutoff
+        fs = config_envelope_rate(config) if fs is None else fs
+
+        stages = [('low', self.order, self.lowcut)]
+        if self.baseline_cutoff:
+            stages.append(('high', 1, self.baseline_cutoff))
+        super().__init__(stages=stages, fs=fs, num_channels=num_channels)
+
+
+def make_envelope_chain(num_channels, raw_rate=2000):
+    """
+    The streaming envelope filter and resampler of the control loop as set in config, so main3 and the replay
+    process blocks the same way.
+
+    Parameters:
+    - num_channels: Number of channels (rows) in the blocks.
+    - raw_rate: Sampling rate of the raw blocks in Hz, used by the resampler.
+
+    Returns:
+    - envelope_filter: StreamingFilter for preprocess_raw_data_directly.
+    - resampler: StreamingResampler to PROCESSING_FREQ with EXACT_RESAMPLING, otherwise None.
+    """
+    envelope_filter = StreamingFilter(num_channels=num_channels)
+    resampler = None
+    if config.EXACT_RESAMPLING:
+        resampler = StreamingResampler(raw_rate, config.PROCESSING_FREQ, num_channels=num_channels,
+                                       zero_crossings=config.RESAMPLER_ZERO_CROSSINGS)
+    return envelope_filter, resampler
+
+
+def downsampled_rate(original_rate, target_rate):
+    """
+    The rate downsample gives. It averages int(original_rate / target_rate) samples, so the rate is only
+    target_rate when that ratio is a whole number, e.g. 125 -> 33.3 gives 41.7.
+    """
+    factor = int(original_rate / target_rate)
+    if factor <= 0:
+        raise ValueError("Target rate must be less than the original rate")
+    return original_rate / factor
+
+
+def downsample(signal, original_rate, target_rate, axis=-1):
     factor = int(original_rate / target_rate)
     if factor <= 0:
         raise ValueError("Target rate must be less than the original rate")
     
+    signal = np.moveaxis(np.asarray(signal), axis, -1)
     # Ensure the signal length is a multiple of the downsampling factor
-    trimmed_length = len(signal) - (len(signal) % factor)
-    trimmed_signal = signal[:trimmed_length]
+    trimmed_length = signal.shape[-1] - (signal.shape[-1] % factor)
+    trimmed_signal = signal[..., :trimmed_length]
     # Reshape and average
-    downsampled_signal = trimmed_signal.reshape(-1, factor).mean(axis=1)
-    return downsampled_signal
+    downsampled_signal = trimmed_signal.reshape(signal.shape[:-1] + (-1, factor)).mean(axis=-1)
+    return np.moveaxis(downsampled_signal, -1, axis)
+
+
+def preprocess_block(raw_data, envelope_filter=None, center=True, original_rate=None, target_rate=None, gain=None, resampler=None):
+    """
+    Preprocess all sensors of a block at once: rectify, downsample, gain, filter and remove the mean.
+    Every step works along axis 1 of the whole (channels, samples) array, instead of one sensor at a time.
+
+    Parameters:
+    - raw_data: Array of shape (channels, samples), as returned by TrignoEMG.read.
+    - envelope_filter: Optional StreamingFilter to use instead of filtfilt on the block.
+    - center: If True, the mean of each channel in the block is subtracted.
+    - original_rate, target_rate: Rates of the downsampling. Default to config.SENSOR_FREQ and config.PROCESSING_FREQ.
+    - gain: Gain of the rectified signal. Defaults to config.RECTIFIED_SIGNAL_GAIN.
+    - resampler: Optional StreamingResampler to use instead of downsample. It gives exactly its target rate and
+      carries the samples between blocks, so a block can give a varying number of samples. Use it together with
+      envelope_filter, as filtfilt needs more samples than a block then has.
+
+    Returns:
+    - processed_emg: C-contiguous array of shape (channels, downsampled samples).
+    """
+    original_rate = config.SENSOR_FREQ if original_rate is None else original_rate
+    target_rate = config.PROCESSING_FREQ if target_rate is None else target_rate
+    gain = config.RECTIFIED_SIGNAL_GAIN if gain is None else gain
+
+    rectified = np.abs(raw_data, dtype=np.float64)
+    if resampler is not None:
+        processed = resampler.process(rectified)
+        target_rate = resampler.target_rate
+    else:
+        processed = downsample(rectified, original_rate=original_rate, target_rate=target_rate, axis=1)
+        # The filter is designed for the rate downsample really gives, not the target rate
+        target_rate = downsampled_rate(original_rate, target_rate)
+    processed *= gain
+
+    if envelope_filter is not None:
+        processed = envelope_filter.process(processed)
+    else:
+        processed = filter_signal(processed, lowcut=config.FILTER_LOW_CUTOFF_FREQUENCY, fs=target_rate, order=config.FILTER_ORDER, btype='low', axis=1)
+
+    if center:
+        processed -= np.mean(processed, axis=1, keepdims=True)
+    return np.ascontiguousarray(processed)
 
 
 def preprocess_raw_data(raw_emg_queue, preprocessed_emg_queue): # Change queue to window
@@ -56,16 +161,7 @@ def preprocess_raw_data(raw_emg_queue, preprocessed_emg_queue): # Change queue t
     """
     if not raw_emg_queue.is_empty():
         sample_index, raw_signal = raw_emg_queue.get_last()  # Get the last raw signal from the queue 
-        print('Preprocessing index: ', sample_index)
-        processed_emg = []
-        for sensor in raw_signal:
-            rectified = np.abs(sensor)
-            downsampled = downsample(rectified, original_rate=config.SENSOR_FREQ, target_rate=config.PROCESSING_FREQ)
-            gained = downsampled * config.RECTIFIED_SIGNAL_GAIN
-            filtered = filter_signal(emg_signal=gained, lowcut=config.FILTER_LOW_CUTOFF_FREQUENCY, fs=config.PROCESSING_FREQ, order=config.FILTER_ORDER, btype='low')
-            correct_mean = filtered - np.mean(filtered)
-
-            processed_emg.append(correct_mean) # Filter, rectify, and downsample the raw signal
+        processed_emg = preprocess_block(raw_signal)
 
         preprocessed_emg_queue.append(processed_emg) # Add an array of the preprocessed data to all the sensors to the queue
         return processed_emg
@@ -74,31 +170,24 @@ def preprocess_raw_data(raw_emg_queue, preprocessed_emg_queue): # Change queue t
         print('Waiting for raw data...')
 
 
-def preprocess_raw_data_directly(raw_data, preprocessed_emg_queue): # Change queue to window
+def preprocess_raw_data_directly(raw_data, preprocessed_emg_queue, envelope_filter=None, resampler=None): # Change queue to window
     """
     Preprocess the EMG signal: rectify, downsample, and filter.
     
     Parameters:
     - raw_emg_queue: The queue containing the raw EMG data.
     - preprocessed_emg_queue: The queue to append the preprocessed data to.
+    - envelope_filter: Optional StreamingFilter. If given it is used instead of filtfilt on each block, so the
+      filter state is carried from one block to the next. The per-block mean is then not removed, as that would
+      put a step back in at every block boundary (and zero out blocks of a single sample). The baseline high-pass
+      of the StreamingFilter removes it instead.
+    - resampler: Optional StreamingResampler from the raw rate to the processing rate, see preprocess_block.
+
+    Returns:
+    - processed_emg: Array of shape (channels, downsampled samples).
     """
     if not raw_data is None:
-        processed_emg = []
-        for sensor in raw_data:
-            rectified = np.abs(sensor)
-#            print('Rectified:', rectified)
-
-            downsampled = downsample(rectified, original_rate=config.SENSOR_FREQ, target_rate=config.PROCESSING_FREQ)
-            print('Downsampled:', downsampled)
-            
-            gained = downsampled * config.RECTIFIED_SIGNAL_GAIN
-            print('Gained:', gained)
-            
-            filtered = filter_signal(gained, lowcut=config.FILTER_LOW_CUTOFF_FREQUENCY, fs=config.PROCESSING_FREQ, order=config.FILTER_ORDER, btype='low')
-            correct_mean = filtered - np.mean(filtered)
-            processed_emg.append(correct_mean) # Filter, rectify, and downsample the raw signal
-            #rectified = np.abs(correct_mean)
-#            processed_emg.append(rectified) # Filter, rectify, and downsample the raw signal
+        processed_emg = preprocess_block(raw_data, envelope_filter=envelope_filter, center=envelope_filter is None, resampler=resampler)
 
         preprocessed_emg_queue.append(processed_emg) # Add an array of the preprocessed data to all the sensors to the queue
         return processed_emg
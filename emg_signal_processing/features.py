@@ -0,0 +1,162 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+# Order of the features in the last axis of the feature matrices
+FEATURES = ('rms', 'mav', 'wl', 'zc', 'ssc', 'wamp')
+RMS, MAV, WL, ZC, SSC, WAMP = range(len(FEATURES))
+
+# Default Willison amplitude threshold, in the units of the raw data after RAW_SIGNAL_GAIN (mV)
+WAMP_THRESHOLD = 0.05
+
+# Samples processed at once in batch mode, bounds the memory of long recordings
+_BATCH_CHUNK = 1 << 16
+
+
+class FeatureExtractor:
+    """
+    Time-domain EMG features over sliding windows of a continuous stream of raw blocks, for all channels at once.
+
+    Every feature is a sum over the window of a per-sample term: |x| (MAV), x^2 (RMS), |x[n] - x[n-1]| (WL), a sign
+    change with |x[n] - x[n-1]| >= zc_threshold (ZC), a slope sign change at the previous sample (SSC) and
+    |x[n] - x[n-1]| > wamp_threshold (WAMP). Differences belong to their later sample. The sums come from running
+    prefix sums, kept for the last window of samples, so a window sum is the difference of two prefix values and a
+    sample costs the same for any window length. The prefix sums are rebased once every window to keep their
+    floating point error small.
+
+    A feature matrix of shape (channels, features) is emitted every hop samples, once the first full window is in.
+    Blocks of any size can be given, and the result is the same as for the whole stream at once.
+
+    Parameters:
+    - num_channels: Number of channels (rows) in the blocks.
+    - rate: Sampling rate of the blocks in Hz.
+    - window: Window length in seconds.
+    - hop: Time between two feature matrices in seconds.
+    - zc_threshold: Smallest step across zero counted as a zero crossing.
+    - ssc_threshold: Smallest product of the two slopes counted as a slope sign change.
+    - wamp_threshold: Willison amplitude threshold.
+    """
+    def __init__(self, num_channels, rate, window=0.2, hop=0.025, zc_threshold=0.0, ssc_threshold=0.0,
+                 wamp_threshold=WAMP_THRESHOLD):
+        self.num_channels = num_channels
+        self.rate = rate
+        self.window = int(round(window * rate))
+        self.hop = int(round(hop * rate))
+        if self.window < 1 or self.hop < 1:
+            raise ValueError("The window and the hop must be at least one sample long.")
+        self.zc_threshold = zc_threshold
+        self.ssc_threshold = ssc_threshold
+        self.wamp_threshold = wamp_threshold
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stream, the next block starts it over again.
+        """
+        self._last = None  # Last two samples of the previous block, shape (num_channels, 2)
+        # Prefix sums at the last window sample boundaries, boundary b at index b % window
+        self._prefix = np.zeros((len(FEATURES), self.num_channels, self.window))
+        self._total = np.zeros((len(FEATURES), self.num_channels))  # Prefix sum at the current boundary
+        self.samples = 0
+        self._since_rebase = 0
+
+    def _terms(self, block):
+        """
+        Per-sample terms of the feature sums, shape (features, num_channels, samples).
+        """
+        if self._last is None:
+            # Start as if the signal was constant before, so the first sample adds no differences
+            self._last = np.repeat(block[:, :1], 2, axis=1)
+        extended = np.concatenate((self._last, block), axis=1)
+        self._last = extended[:, -2:].copy()
+        diff = np.diff(extended, axis=1)
+        step = diff[:, 1:]  # x[n] - x[n-1] of each sample of the block
+        abs_step = np.abs(step)
+
+        terms = np.empty((len(FEATURES), self.num_channels, block.shape[1]))
+        np.square(block, out=terms[RMS])
+        np.abs(block, out=terms[MAV])
+        terms[WL] = abs_step
+        terms[ZC] = (extended[:, 2:] * extended[:, 1:-1] < 0) & (abs_step >= self.zc_threshold)
+        terms[SSC] = -diff[:, :-1] * step > self.ssc_threshold
+        terms[WAMP] = abs_step > self.wamp_threshold
+        return terms
+
+    def process(self, block):
+        """
+        Adds a block of samples and returns the feature matrices of the windows that ended in it.
+
+        Parameters:
+        - block: Array of shape (num_channels, samples), e.g. as returned by TrignoEMG.read.
+
+        Returns:
+        - features: Array of shape (hops, num_channels, features), one matrix per hop in time order. Features are
+          in the order of FEATURES. Empty if no window ended in the block.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block.reshape(self.num_channels, -1)
+        n = block.shape[1]
+        if n == 0:
+            return np.zeros((0, self.num_channels, len(FEATURES)))
+
+        start = self.samples
+        prefix = self._total[..., np.newaxis] + np.cumsum(self._terms(block), axis=2)  # Boundaries start+1..start+n
+
+        # Windows end on multiples of hop, from the first full window on
+        first_end = max(start // self.hop + 1, -(-self.window // self.hop)) * self.hop
+        ends = np.arange(first_end, start + n + 1, self.hop)
+        begins = ends - self.window
+        in_block = begins > start
+        end_values = prefix[..., ends - start - 1]
+        begin_values = np.where(in_block, prefix[..., np.maximum(begins - start - 1, 0)],
+                                self._prefix[..., begins % self.window])
+        sums = end_values - begin_values
+
+        # Keep the prefix sums of the last window boundaries for the windows ending in later blocks
+        kept = min(n, self.window)
+        boundaries = np.arange(start + n - kept + 1, start + n + 1)
+        self._prefix[..., boundaries % self.window] = prefix[..., n - kept:]
+        self._total = prefix[..., -1].copy()
+        self.samples += n
+
+        self._since_rebase += n
+        if self._since_rebase >= self.window:
+            self._prefix -= self._total[..., np.newaxis]
+            self._total[:] = 0
+            self._since_rebase = 0
+
+        features = np.empty((ends.size, self.num_channels, len(FEATURES)))
+        features[..., RMS] = np.sqrt(np.maximum(sums[RMS], 0) / self.window).T
+        features[..., MAV] = (sums[MAV] / self.window).T
+        features[..., WL] = sums[WL].T
+        features[..., [ZC, SSC, WAMP]] = np.rint(sums[[ZC, SSC, WAMP]]).transpose(2, 1, 0)
+        return features
+
+    def __call__(self, block):
+        return self.process(block)
+
+
+def extract_features(signal, rate, window=0.2, hop=0.025, **thresholds):
+    """
+    Batch mode of FeatureExtractor over a whole recording, e.g. load_csv(path).signals.
+
+    Parameters:
+    - signal: Array of shape (channels, samples).
+    - rate, window, hop: See FeatureExtractor.
+    - thresholds: zc_threshold, ssc_threshold and wamp_threshold of FeatureExtractor.
+
+    Returns:
+    - features: Array of shape (hops, channels, features).
+    - times: End time of the window of each feature matrix in seconds, shape (hops,).
+    """
+    signal = np.asarray(signal)
+    extractor = FeatureExtractor(signal.shape[0], rate, window=window, hop=hop, **thresholds)
+    features = [extractor.process(signal[:, i:i + _BATCH_CHUNK]) for i in range(0, signal.shape[1], _BATCH_CHUNK)]
+    features = np.concatenate(features, axis=0) if features else np.zeros((0, signal.shape[0], len(FEATURES)))
+
+    first_end = -(-extractor.window // extractor.hop) * extractor.hop
+    times = (first_end + extractor.hop * np.arange(features.shape[0])) / rate
+    return features, times
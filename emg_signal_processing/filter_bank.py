@@ -0,0 +1,156 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from collections import OrderedDict
+import threading
+import numpy as np
+from scipy.signal import butter, iirnotch, sosfilt, sosfilt_zi, tf2sos
+
+# Maximum number of filter designs kept in the cache, least recently used are dropped first
+DESIGN_CACHE_SIZE = 64
+
+_design_cache = OrderedDict()
+_design_cache_lock = threading.Lock()
+
+
+def _design_key(kind, order, cutoffs, fs, output):
+    cutoffs = tuple(float(c) for c in np.atleast_1d(cutoffs))
+    return (kind, order, cutoffs, float(fs), output)
+
+
+def _design(kind, order, cutoffs, fs, output):
+    if kind == 'notch':
+        b, a = iirnotch(cutoffs[0], Q=order, fs=fs)
+        if output == 'sos':
+            return tf2sos(b, a)
+        return b, a
+    if kind in ('low', 'high'):
+        cutoffs = cutoffs[0]
+    elif kind not in ('band', 'stop'):
+        raise ValueError("Invalid filter type. Should be 'low', 'high', 'band', 'stop' or 'notch'.")
+    return butter(order, cutoffs, btype=kind, fs=fs, output=output)
+
+
+def design_filter(kind, order, cutoffs, fs, output='sos'):
+    """
+    Get a Butterworth (or notch) filter design, from the cache if it has been designed before.
+
+    Parameters:
+    - kind: Filter type, 'low', 'high', 'band', 'stop' or 'notch'.
+    - order: Order of the Butterworth filter. For 'notch' this is the quality factor Q.
+    - cutoffs: Cutoff frequency, or (low, high) for 'band' and 'stop'. For 'notch' the notch frequency.
+    - fs: Sampling frequency.
+    - output: 'sos' for second-order sections or 'ba' for numerator/denominator.
+
+    Returns:
+    - The sos array, or the (b, a) tuple. The arrays are shared with the cache and read-only.
+    """
+    key = _design_key(kind, order, cutoffs, fs, output)
+    with _design_cache_lock:
+        if key in _design_cache:
+            _design_cache.move_to_end(key)
+            return _design_cache[key]
+
+    design = _design(*key)
+    arrays = design if isinstance(design, tuple) else (design,)
+    for array in arrays:
+        array.setflags(write=False)
+
+    with _design_cache_lock:
+        _design_cache[key] = design
+        _design_cache.move_to_end(key)
+        while len(_design_cache) > DESIGN_CACHE_SIZE:
+            _design_cache.popitem(last=False)
+    return design
+
+
+def invalidate(kind, order, cutoffs, fs, output=None):
+    """
+    Remove a design from the cache. If output is None both the 'sos' and 'ba' forms are removed.
+    """
+    outputs = ('sos', 'ba') if output is None else (output,)
+    with _design_cache_lock:
+        for form in outputs:
+            _design_cache.pop(_design_key(kind, order, cutoffs, fs, form), None)
+
+
+def clear_cache():
+    with _design_cache_lock:
+        _design_cache.clear()
+
+
+def config_envelope_rate(cfg):
+    """
+    The rate of the preprocessed envelope for a config module or Config object. With EXACT_RESAMPLING this is
+    PROCESSING_FREQ. Otherwise emg_preprocessing.downsample averages int(SENSOR_FREQ / PROCESSING_FREQ) samples,
+    so the rate is SENSOR_FREQ divided by that, e.g. 125 / 3 = 41.7 for 33.3.
+    """
+    if getattr(cfg, 'EXACT_RESAMPLING', False):
+        return cfg.PROCESSING_FREQ
+    factor = int(cfg.SENSOR_FREQ / cfg.PROCESSING_FREQ)
+    if factor <= 0:
+        raise ValueError("PROCESSING_FREQ must be less than SENSOR_FREQ.")
+    return cfg.SENSOR_FREQ / factor
+
+
+def config_filter_key(cfg):
+    """
+    The (kind, order, cutoffs, fs) of the preprocessing filter described by a config module or Config object.
+    """
+    cutoffs = tuple(c for c in (cfg.FILTER_LOW_CUTOFF_FREQUENCY, cfg.FILTER_HIGH_CUTOFF_FREQUENCY) if c is not None)
+    return (cfg.FILTER_BTYPE, cfg.FILTER_ORDER, cutoffs, config_envelope_rate(cfg))
+
+
+class FilterBank:
+    """
+    Cascade of filter stages that runs over all channels in one vectorized sosfilt call.
+
+    The second-order sections of every stage are stacked into one sos array, and the state (zi) of
+    each channel is carried from one block to the next, so blocks of any size can be filtered.
+
+    Parameters:
+    - stages: List of (kind, order, cutoffs) tuples, see design_filter. E.g.
+      [('band', 4, (20, 450)), ('notch', 30, 50)] for a band-pass followed by a 50 Hz notch.
+    - fs: Sampling frequency of the blocks.
+    - num_channels: Number of channels (rows) in the blocks that will be filtered.
+    """
+    def __init__(self, stages, fs, num_channels):
+        self.stages = [tuple(stage) for stage in stages]
+        self.fs = fs
+        self.num_channels = num_channels
+
+        self.sos = np.vstack([design_filter(kind, order, cutoffs, fs, 'sos') for kind, order, cutoffs in self.stages])
+        self._zi = None
+
+    def process(self, block):
+        """
+        Filter a block of samples, continuing from the state left by the previous block.
+
+        Parameters:
+        - block: Array of shape (num_channels, samples). A 1-D array is treated as one sample per channel.
+
+        Returns:
+        - filtered: Array of shape (num_channels, samples) with the filtered block.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block.reshape(self.num_channels, -1)
+        if block.shape[1] == 0:
+            return block.copy()
+
+        if self._zi is None:
+            # Start in steady state at the first sample to avoid a startup transient
+            self._zi = sosfilt_zi(self.sos)[:, np.newaxis, :] * block[np.newaxis, :, 0, np.newaxis]
+
+        filtered, self._zi = sosfilt(self.sos, block, axis=1, zi=self._zi)
+        return filtered
+
+    def __call__(self, block):
+        return self.process(block)
+
+    def reset(self):
+        """
+        Forget the filter state, the next block starts the filter over again.
+        """
+        self._zi = None
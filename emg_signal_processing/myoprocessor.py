@@ -87,23 +87,106 @@ def sequential_control(processed_signal, hand_or_wrist_state, cocontraction_stat
     return hand_array, wrist_array
 
 
+def _hold_last_forced(forced, value, initial):
+    """
+    Fill in a chain of samples where each sample is either forced to a value or keeps the previous one.
+
+    Parameters:
+    - forced: Boolean array, True where the sample is forced.
+    - value: Boolean array with the forced values.
+    - initial: The value before the first sample of the chain.
+
+    Returns:
+    - Boolean array with the forced value where forced, and the last forced value (or initial) elsewhere.
+    """
+    last_forced = np.maximum.accumulate(np.where(forced, np.arange(len(forced)), -1))
+    return np.where(last_forced >= 0, value[np.maximum(last_forced, 0)], initial)
+
+
+def sequential_control_block(processed_signal, hand_or_wrist_state, cocontraction_state, threshold=None, width=None, return_states=False):
+    '''
+    Block version of sequential_control. Gives exactly the same output and leaves the states exactly as
+    sequential_control would, but processes the whole block with array operations instead of one sample at a time.
+    The states are read once at the start and written once at the end of the block.
+
+    In sequential_control the hysteresis of sample i uses the cocontraction state from two samples back, so the
+    cocontraction sequence splits into two independent chains (even and odd samples). In each chain a sample is
+    forced False if a signal is below threshold-width, forced True if both are above threshold+width, and otherwise
+    keeps the value of the chain. Hand and wrist control is switched on every rising edge of the cocontraction,
+    which is counted with a cumulative sum.
+
+    Parameters:
+    - processed_signal: The preprocessed myosignals from the sensors, shape (channels, n). Only the first two are used.
+    - hand_or_wrist_state: ThreadSafeState telling if we are in hand or wrist state.
+    - cocontraction_state: ThreadSafeState with the current and previous cocontraction state.
+    - threshold: The threshold value for the hysteresis. Defaults to config.HYSTERESIS_THRESHOLD.
+    - width: The width of the hysteresis. Defaults to config.HYSTERESIS_WIDTH.
+    - return_states: If True, the wrist control state of every sample is returned as well.
+
+    Returns:
+    - hand_array: The difference signal for the hand to be used in the prosthesis control.
+    - wrist_array: The difference signal for the wrist to be used in the prosthesis control.
+    - wrist_control: Only if return_states. Boolean array, True where the sample is in wrist control.
+    '''
+    threshold = config.HYSTERESIS_THRESHOLD if threshold is None else threshold
+    width = config.HYSTERESIS_WIDTH if width is None else width
+
+    signal1 = np.asarray(processed_signal[0], dtype=np.float64)
+    signal2 = np.asarray(processed_signal[1], dtype=np.float64)
+    n = len(signal1)
+    if n == 0:
+        if return_states:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=bool)
+        return np.zeros(0), np.zeros(0)
+
+    cocontraction_active, prev_cocontraction_active = cocontraction_state.get_states()
+    hand_or_wrist, prev_hand_or_wrist = hand_or_wrist_state.get_states()
+
+    # Samples where the hysteresis does not depend on the previous state
+    low = (signal1 < (threshold-width)) | (signal2 < (threshold-width))
+    high = (signal1 > (threshold+width)) & (signal2 > (threshold+width))
+    forced = low | high
+
+    cocontraction = np.empty(n, dtype=bool)
+    cocontraction[0::2] = _hold_last_forced(forced[0::2], high[0::2], prev_cocontraction_active)
+    cocontraction[1::2] = _hold_last_forced(forced[1::2], high[1::2], cocontraction_active)
+
+    # Switch between hand and wrist on every rising edge of the cocontraction
+    previous = np.concatenate(([cocontraction_active], cocontraction[:-1]))
+    switches = np.cumsum(~previous & cocontraction)
+    wrist_control = np.logical_xor(hand_or_wrist, switches % 2 == 1)
+
+    diff_signal = signal1 - signal2
+    hand_array = np.where(wrist_control, 0.0, diff_signal)
+    wrist_array = np.where(wrist_control, diff_signal, 0.0)
+
+    # Write back the states as they would be after running sequential_control on the block
+    last_prev = cocontraction[-2] if n > 1 else cocontraction_active
+    cocontraction_state.set_states(bool(cocontraction[-1]), bool(last_prev))
+    if switches[-1] > 0:
+        hand_or_wrist_state.set_states(bool(wrist_control[-1]), not wrist_control[-1])
+
+    if return_states:
+        return hand_array, wrist_array, wrist_control
+    return hand_array, wrist_array
+
+
 ''' Proposed solution of Myoprocessor control with queue of preprocessed data as input.'''
 def myoprocessor_controll(preprocessed_emg_queue, hand_or_wrist, cocontraction):
     if not preprocessed_emg_queue.is_empty():
         sample_index, processed_emg = preprocessed_emg_queue.get_last()  # Get the last preprocessed signal from the queue
         
-        hand_controll, wrist_controll = sequential_control(processed_emg, hand_or_wrist, cocontraction)
+        hand_controll, wrist_controll = sequential_control_block(processed_emg, hand_or_wrist, cocontraction)
         return hand_controll, wrist_controll
     else:
         return None, None
 
 
 ''' Myoprocessor function proposed solution. Preprocessed data as input.'''
-def myoprocessor_controll_directly(preprocessed_data, hand_or_wrist, cocontraction):
+def myoprocessor_controll_directly(preprocessed_data, hand_or_wrist, cocontraction, return_states=False):
     if not preprocessed_data is None:
-        hand_controll, wrist_controll = sequential_control(preprocessed_data, hand_or_wrist, cocontraction)
-
-        return hand_controll, wrist_controll
+        # With return_states, the wrist control state of every sample is returned as a third value
+        return sequential_control_block(preprocessed_data, hand_or_wrist, cocontraction, return_states=return_states)
     else:
-        return None, None
+        return (None, None, None) if return_states else (None, None)
     
\ No newline at end of file
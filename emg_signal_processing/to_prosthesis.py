@@ -23,31 +23,37 @@ def deadband(signal, threshold):
     return np.where(np.abs(signal) < threshold, 0, signal)
 
 
-def prosthesis_signals(hand_diff_signal, wrist_diff_signal):
+def prosthesis_signals(hand_diff_signal, wrist_diff_signal, hand_gain=None, wrist_gain=None, hand_threshold=None, wrist_threshold=None):
     """
     Process the hand and wrist difference signals to control the prosthesis. The two signals come from myoprocessor, which is made in lab 3.
     
     Parameters:
     - hand_diff_signal: The difference signal for the hand.
     - wrist_diff_signal: The difference signal for the wrist.
-    - hand_gain: The gain to apply to the hand signal.
-    - wrist_gain: The gain to apply to the wrist signal.
-    - threshold: The deadband threshold.
+    - hand_gain: The gain to apply to the hand signal. Defaults to config.HAND_GAIN.
+    - wrist_gain: The gain to apply to the wrist signal. Defaults to config.WRIST_GAIN.
+    - hand_threshold: The deadband threshold of the hand. Defaults to config.HAND_DEADBAND_TRESHOLD.
+    - wrist_threshold: The deadband threshold of the wrist. Defaults to config.WRIST_DEADBAND_TRESHOLD.
     
     Returns:
     - combined_signal: The array of processed hand and wrist signals.
     """
+    hand_gain = config.HAND_GAIN if hand_gain is None else hand_gain
+    wrist_gain = config.WRIST_GAIN if wrist_gain is None else wrist_gain
+    hand_threshold = config.HAND_DEADBAND_TRESHOLD if hand_threshold is None else hand_threshold
+    wrist_threshold = config.WRIST_DEADBAND_TRESHOLD if wrist_threshold is None else wrist_threshold
+
     # Apply gain
-    hand_signal = hand_diff_signal*config.HAND_GAIN
-    wrist_signal = wrist_diff_signal*config.WRIST_GAIN
+    hand_signal = hand_diff_signal*hand_gain
+    wrist_signal = wrist_diff_signal*wrist_gain
     
     # Saturate signals
     hand_signal = saturate(hand_signal,-5,5)
     wrist_signal = saturate(wrist_signal,-5,5)
     
     # Apply deadband
-    hand_signal = deadband(hand_signal, config.HAND_DEADBAND_TRESHOLD)
-    wrist_signal = deadband(wrist_signal, config.WRIST_DEADBAND_TRESHOLD)
+    hand_signal = deadband(hand_signal, hand_threshold)
+    wrist_signal = deadband(wrist_signal, wrist_threshold)
     
     # Combine signals into an array
     combined_signal = np.array([hand_signal, wrist_signal])
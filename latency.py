@@ -0,0 +1,132 @@
+import time
+import numpy as np
+
+END_TO_END = 'end_to_end'
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in nanoseconds with log-spaced bins, cheap enough to record every block.
+
+    Values below 2**SUB_BITS ns get their own bin. Larger values are binned by their highest SUB_BITS + 1 bits, so
+    every bin is at most 1/2**SUB_BITS (about 6 %) wide relative to its value. The max is kept exactly.
+
+    There is no lock: each histogram should have one writer (e.g. one pipeline stage thread), and readers take a
+    snapshot of the counts, which may be off by the one record being written.
+    """
+    SUB_BITS = 4
+    NUM_BINS = (65 - SUB_BITS) << SUB_BITS  # Enough for any 64 bit value
+
+    def __init__(self):
+        self.counts = [0] * self.NUM_BINS
+        self.count = 0
+        self.max = 0
+
+    @classmethod
+    def bin_index(cls, ns):
+        bits = ns.bit_length()
+        if bits <= cls.SUB_BITS:
+            return ns
+        shift = bits - cls.SUB_BITS - 1
+        return (shift << cls.SUB_BITS) + (ns >> shift)
+
+    @classmethod
+    def bin_upper(cls, index):
+        """
+        Largest value in bin number index.
+        """
+        if index < 2 << cls.SUB_BITS:
+            return index
+        shift = (index >> cls.SUB_BITS) - 1
+        mantissa = index - (shift << cls.SUB_BITS)
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, ns):
+        if ns < 0:
+            ns = 0
+        self.counts[self.bin_index(ns)] += 1
+        self.count += 1
+        if ns > self.max:
+            self.max = ns
+
+    def percentiles(self, percents=(50, 95, 99)):
+        """
+        Returns the upper edge of the bin holding each percentile in ns, or None for an empty histogram.
+        """
+        counts = np.array(self.counts, dtype=np.int64)
+        total = counts.sum()
+        if total == 0:
+            return [None for _ in percents]
+        cumulative = np.cumsum(counts)
+        results = []
+        for p in percents:
+            index = int(np.searchsorted(cumulative, np.ceil(total * p / 100)))
+            results.append(min(self.bin_upper(index), self.max))
+        return results
+
+    def reset(self):
+        self.counts = [0] * self.NUM_BINS
+        self.count = 0
+        self.max = 0
+
+
+class LatencyTracker:
+    """
+    Latency of EMG blocks from the moment they are received from the TCU, per stage and end to end.
+
+    A block is stamped with stamp() when it is received, and record(name, stamp) adds the time since then to the
+    histogram of that stage. pipeline.Pipeline does both for its stages when it is given a tracker.
+    """
+    def __init__(self):
+        self.histograms = {}
+
+    @staticmethod
+    def stamp():
+        return time.monotonic_ns()
+
+    def histogram(self, name):
+        # Created by the first record, which comes from the one thread that writes it
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        return self.histograms[name]
+
+    def record(self, name, stamp, now=None):
+        """
+        Records the time since stamp (from stamp()) under name. Returns the time of the record.
+        """
+        if now is None:
+            now = time.monotonic_ns()
+        self.histogram(name).record(now - stamp)
+        return now
+
+    def stats(self):
+        """
+        Returns a dict of count, p50, p95, p99 and max latency in ms, by stage name.
+        """
+        stats = {}
+        for name, histogram in list(self.histograms.items()):
+            p50, p95, p99 = histogram.percentiles((50, 95, 99))
+            stats[name] = {
+                'count': histogram.count,
+                'p50': p50 / 1e6 if p50 is not None else None,
+                'p95': p95 / 1e6 if p95 is not None else None,
+                'p99': p99 / 1e6 if p99 is not None else None,
+                'max': histogram.max / 1e6,
+            }
+        return stats
+
+    def report(self):
+        """
+        Returns the stats as a printable table, with times in ms since the block was received.
+        """
+        lines = ["{:<20}{:>8}{:>10}{:>10}{:>10}{:>10}".format('since recv [ms]', 'blocks', 'p50', 'p95', 'p99', 'max')]
+        for name, s in self.stats().items():
+            if s['count'] == 0:
+                continue
+            lines.append("{:<20}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                name, s['count'], s['p50'], s['p95'], s['p99'], s['max']))
+        return "\n".join(lines)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
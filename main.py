@@ -10,14 +10,14 @@ import threading
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import matplotlib.pyplot as plt
-import matplotlib as mpl
 import matplotlib.style as mplstyle
-from emg_signal_processing import emg_in, emg_preprocessing, myoprocessor, to_prosthesis
+from emg_signal_processing import emg_in, emg_preprocessing, myoprocessor, to_prosthesis, filter_bank
+from classes import RingBuffer
+import plots
 import time, threading
 import struct
 import serial
 import numpy as np
-from scipy import signal
 from collections import deque
 mplstyle.use(['fast'])
 plt.switch_backend('TkAgg')
@@ -94,18 +94,18 @@ class Trigno:
 
 class Thread_Safe_Buffer:
     def __init__(self, length):
-        self.buf = np.zeros((length,16))
+        self.ring = RingBuffer(num_channels=16, capacity=length) # Written in place, no shifting of the history on push
         self.length = length
-        self.lock = threading.Lock()
+        self.lock = threading.Lock() # A push in the middle of latest() would mix old and new samples
 
     def push(self, value):
         with(self.lock):
-            for i in range (self.length-1,0,-1):
-                self.buf[i,:] = self.buf[i-1,:]
-            self.buf[0,:] = value
+            self.ring.write(np.asarray(value).reshape(16, 1))
+
     def copy(self):
+        # Newest sample in row 0, like before
         with(self.lock):
-            return np.copy(self.buf)
+            return self.ring.latest(self.length)[:, ::-1].T
 
 class Multiprocess_Safe_Buffer:
     def __init__(self, length):
@@ -169,7 +169,8 @@ class LiveLFilter(LiveFilter):
 def filtering_iir(raw_sig, order, lowcut, highcut, btype, fs):
    # Create the filter
    # b, a = signal.butter(order, [lowcut, highcut], btype=btype, fs=fs)
-    b, a = signal.iirfilter(order, [lowcut, highcut], btype=btype, ftype='butter', fs=fs)
+    #b, a = signal.iirfilter(order, [lowcut, highcut], btype=btype, ftype='butter', fs=fs)
+    b, a = filter_bank.design_filter(btype, order, (lowcut, highcut), fs, output='ba') # Cached, not redesigned for every sample vector
     live_lfilter = LiveLFilter(b, a)
     # simulate live filter - passing values one by one
     for x in raw_sig: print(x)
@@ -179,62 +180,38 @@ def filtering_iir(raw_sig, order, lowcut, highcut, btype, fs):
 
 def plotter(buffer, interval):
     fig, ax = plt.subplots()
-    #plt.ion() ## Vet ikke om denne er nødvendig, men den gjør plottingen dobbelt så treg
-    ax.set_ylim(-0.1,0.1)
-    
-    lines = [ax.plot([], [], markevery=10, label=f'EMG {i+1}')[0] for i in range(16)]  # Create a line for each sensor
-    mpl.rcParams['path.simplify'] = True
-    mpl.rcParams['path.simplify_threshold'] = 1.0
+    ax.set_xlabel("Samples")
+    # Only the lines are redrawn (blitting), and at most one min/max pair per pixel column
+    trace = plots.LiveTrace(ax, 16, buffer.length, fs=1, labels=[f'EMG {i+1}' for i in range(16)], ylim=(-0.1, 0.1))
+    renderer = plots.BlitRenderer(fig, [trace])
+    cursor = buffer.ring.cursor(from_start=True)
+    plt.show(block=False)
     while True:
-        buf = buffer.copy()
-        for i, line in enumerate(lines):
-            line.set_xdata(range(len(buf[:,i])))
-            line.set_ydata(buf[:,i])
-
-        start = time.time()
-        ax.relim()
-        ax.autoscale_view() 
-        fig.canvas.draw()
-        fig.canvas.flush_events()
-        print("Plotting time:" , "{:07.2f}".format((time.time() - start)*1000))
-        
-        plt.pause(interval)
+        for block in cursor.read():
+            trace.append(block)
+        renderer.render()
+        time.sleep(interval)
 
 
 def plotter_all(raw_buffer, proc_buffer, interval):
     fig1, ax1 = plt.subplots()
     fig2, ax2 = plt.subplots()
-    plt.ion() ## Vet ikke om denne er nødvendig, men den gjør plottingen dobbelt så treg
-    ax1.set_ylim(-0.1,0.1)
-    ax2.set_ylim(-0.1,0.1)
-
-    lines1 = [ax1.plot([], [], markevery=10, label=f'EMG {i+1}')[0] for i in range(16)]  # Create a line for each sensor
-    lines2 = [ax2.plot([], [], markevery=10, label=f'EMG {i+1}')[0] for i in range(16)]  # Create a line for each sensor
-    mpl.rcParams['path.simplify'] = True
-    mpl.rcParams['path.simplify_threshold'] = 1.0
+    ax1.set_xlabel("Samples")
+    ax2.set_xlabel("Samples")
+    trace1 = plots.LiveTrace(ax1, 16, raw_buffer.length, fs=1, labels=[f'EMG {i+1}' for i in range(16)], ylim=(-0.1, 0.1))
+    trace2 = plots.LiveTrace(ax2, 16, proc_buffer.length, fs=1, labels=[f'EMG {i+1}' for i in range(16)], ylim=(-0.1, 0.1))
+    renderers = [plots.BlitRenderer(fig1, [trace1]), plots.BlitRenderer(fig2, [trace2])]
+    cursor1 = raw_buffer.ring.cursor(from_start=True)
+    cursor2 = proc_buffer.ring.cursor(from_start=True)
+    plt.show(block=False)
     while True:
-        buf_raw = raw_buffer.copy()
-        buf_proc = proc_buffer.copy()
-        for i, line in enumerate(lines1):
-            line.set_xdata(range(len(buf_raw[:,i])))
-            line.set_ydata(buf_raw[:,i])
-
-        for i, line in enumerate(lines2):
-            line.set_xdata(range(len(buf_proc[:,i])))
-            line.set_ydata(buf_proc[:,i])
-
-        start = time.time()
-        ax1.relim()
-        ax1.autoscale_view() 
-        fig1.canvas.draw()
-        fig1.canvas.flush_events()
-        ax2.relim()
-        ax2.autoscale_view()
-        fig2.canvas.draw()
-        fig2.canvas.flush_events()
-        print("Plotting time:" , "{:07.2f}".format((time.time() - start)*1000))
-        
-        plt.pause(interval)
+        for block in cursor1.read():
+            trace1.append(block)
+        for block in cursor2.read():
+            trace2.append(block)
+        for renderer in renderers:
+            renderer.render()
+        time.sleep(interval)
         
 def outputter(buffer, interval):
     ser = serial.Serial('COM6', baudrate=9600, timeout=1)  # Open serial port
@@ -5,12 +5,18 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import matplotlib.pyplot as plt
 import plots
-from emg_signal_processing import emg_in, emg_preprocessing, myoprocessor, to_prosthesis
+from emg_signal_processing import emg_in, emg_preprocessing, myoprocessor, to_prosthesis, features, filter_bank
 import time, threading
 import pyserial
+import niDAQ
 from classes import ThreadSafeState, ThreadSafeQueue
+from pipeline import Pipeline, BLOCK, KEEP_LATEST
+from latency import LatencyTracker
+from recorder import SessionRecorder
+from compiled_pipeline import CompiledPipeline, ConfigWatcher
 import serial.tools.list_ports
 import serial
+import config
 
 
 plt.switch_backend('TkAgg')
@@ -26,9 +32,11 @@ signal.signal(signal.SIGINT, signal_handler)  # Register the signal handler
 
 # Initialize queues for raw data, processed data, and prosthesis setpoints
 WINDOW_SIZE = 5
+PIPELINE_QUEUE_SIZE = 8 # Blocks that can wait between two pipeline stages
 raw_emg_queue = ThreadSafeQueue(window_size=WINDOW_SIZE)
 preprocessed_emg_queue = ThreadSafeQueue(window_size=WINDOW_SIZE)
 prosthesis_setpoint_queue = ThreadSafeQueue(window_size=WINDOW_SIZE)
+feature_queue = ThreadSafeQueue(window_size=WINDOW_SIZE) # (channels, features) matrices, newest last
 
 # Initialize states for hand/wrist control and cocontraction
 cocontraction = ThreadSafeState()
@@ -52,40 +60,161 @@ def main():
         print("Unknown error:", e)
         ser = None
 
-    # Define threads for data processing
-    #def data_processing_thread():
-    #    try:
-    while not stop_event.is_set():
-        raw_data = emg_in.read_raw_data(dev, raw_emg_queue=raw_emg_queue)
-        #preprocessed_data = emg_preprocessing.preprocess_raw_data(raw_emg_queue=raw_emg_queue, preprocessed_emg_queue=preprocessed_emg_queue)
-        preprocessed_data = emg_preprocessing.preprocess_raw_data_directly(raw_data=raw_data, preprocessed_emg_queue=preprocessed_emg_queue)
-
-        #hand_controll, wrist_controll = myoprocessor.myoprocessor_controll(preprocessed_emg_queue, hand_or_wrist, cocontraction)
-        hand_controll, wrist_controll = myoprocessor.myoprocessor_controll_directly(preprocessed_data, hand_or_wrist, cocontraction)
-        setpoints = to_prosthesis.prosthesis_setpoints(prosthesis_setpoint_queue, hand_controll, wrist_controll)
-
-        if ser.is_open:
-            pyserial.write_to_hand(ser=ser, setpoints=setpoints)
-            #print('wsetpoints:', setpoints)
+    # Plot in a separate process fed from shared memory, or in the main thread from the queues
+    plot_process = None
+    if config.PLOT_MODE == 'process':
+        plot_process = plots.PlotProcess(num_channels=len(config.ACTIVE_CHANNELS))
+
+    # Record the session to disk, written on a background thread
+    recorder = None
+    if config.RECORDING_DIR is not None:
+        num_channels = len(config.ACTIVE_CHANNELS)
+        streams = {'raw': (num_channels, dev.rate if dev is not None else 2000),
+                   'processed': (num_channels, filter_bank.config_envelope_rate(config)),
+                   'setpoints': (2, filter_bank.config_envelope_rate(config))}
+        if config.FEATURE_EXTRACTION:
+            # One row for each channel and feature, channel-major
+            streams['features'] = (num_channels * len(features.FEATURES), 1 / config.FEATURE_HOP)
+        recorder = SessionRecorder(config.RECORDING_DIR, streams=streams)
+
+    # Latency from the TCU socket to each stage, off by default as it records every block at every stage
+    latency = LatencyTracker() if config.LATENCY_TRACKING else None
+
+    def acquire():
+        # The block is stamped right after the read, so plotting and recording it count in the latency
+        block = emg_in.read_raw_data(dev, raw_emg_queue=raw_emg_queue, clock=LatencyTracker.stamp)
+        if block is None:
+            return None
+        stamp, raw_data = block
+        if plot_process is not None:
+            plot_process.push_raw(raw_data)
+        if recorder is not None:
+            recorder.write('raw', raw_data)
+        return stamp, raw_data
+
+    # Envelope filter that keeps its state from one block to the next. With EXACT_RESAMPLING the blocks are
+    # resampled from the Trigno rate straight to PROCESSING_FREQ, keeping the samples between blocks
+    envelope_filter, emg_resampler = emg_preprocessing.make_envelope_chain(len(config.ACTIVE_CHANNELS),
+                                                                           dev.rate if dev is not None else 2000)
+    if emg_resampler is not None:
+        print("Resampling adds {:.0f} ms of delay to the envelope".format(1000 * emg_resampler.delay))
+
+    # Sliding window features of the raw blocks, computed on the preprocess thread
+    feature_extractor = None
+    if config.FEATURE_EXTRACTION:
+        feature_extractor = features.FeatureExtractor(len(config.ACTIVE_CHANNELS), dev.rate if dev is not None else 2000,
+                                                      window=config.FEATURE_WINDOW, hop=config.FEATURE_HOP)
+
+    def extract_features(raw_data):
+        feature_matrices = feature_extractor.process(raw_data)
+        for feature_matrix in feature_matrices:
+            feature_queue.append(feature_matrix)
+        if recorder is not None and len(feature_matrices):
+            recorder.write('features', feature_matrices.reshape(len(feature_matrices), -1).T)
+
+    def preprocess(raw_data):
+        if feature_extractor is not None and raw_data is not None:
+            extract_features(raw_data)
+        preprocessed_data = emg_preprocessing.preprocess_raw_data_directly(raw_data=raw_data, preprocessed_emg_queue=preprocessed_emg_queue, envelope_filter=envelope_filter, resampler=emg_resampler)
+        if plot_process is not None:
+            plot_process.push_processed(preprocessed_data)
+        if recorder is not None and preprocessed_data is not None:
+            recorder.write('processed', preprocessed_data)
+        return preprocessed_data
+
+    def setpoints(controll):
+        prosthesis_setpoints = to_prosthesis.prosthesis_setpoints(prosthesis_setpoint_queue, *controll)
+        if plot_process is not None:
+            plot_process.push_setpoints(prosthesis_setpoints)
+        if recorder is not None and prosthesis_setpoints is not None:
+            recorder.write('setpoints', prosthesis_setpoints)
+        return prosthesis_setpoints
+
+    # With CONFIG_WATCH the processing runs in one stage with the parameters of a compiled snapshot, which the
+    # watcher replaces between blocks when config.py changes
+    compiled = None
+    watcher = None
+    if config.CONFIG_WATCH:
+        compiled = CompiledPipeline(len(config.ACTIVE_CHANNELS), hand_or_wrist, cocontraction,
+                                    raw_rate=dev.rate if dev is not None else 2000)
+        watcher = ConfigWatcher(compiled, sidecar=config.CONFIG_SIDECAR)
+
+    def control(raw_data):
+        if feature_extractor is not None:
+            extract_features(raw_data)
+        preprocessed_data, prosthesis_setpoints = compiled.process(raw_data)
+        preprocessed_emg_queue.append(preprocessed_data)
+        prosthesis_setpoint_queue.append(prosthesis_setpoints)
+        if plot_process is not None:
+            plot_process.push_processed(preprocessed_data)
+            plot_process.push_setpoints(prosthesis_setpoints)
+        if recorder is not None:
+            recorder.write('processed', preprocessed_data)
+            recorder.write('setpoints', prosthesis_setpoints)
+        return prosthesis_setpoints
+
+    # Each step runs on its own thread, so a slow serial write does not delay the next read from the TCU socket.
+    # Raw and preprocessed blocks are never dropped, as the filter and the cocontraction state run over them.
+    # The serial writer only needs the newest setpoints.
+    pipeline = Pipeline(stop_event, latency=latency)
+    pipeline.add_stage('acquire', acquire, stamped=True)
+    if compiled is not None:
+        pipeline.add_stage('control', control, maxsize=PIPELINE_QUEUE_SIZE, policy=BLOCK)
+    else:
+        pipeline.add_stage('preprocess', preprocess, maxsize=PIPELINE_QUEUE_SIZE, policy=BLOCK)
+        pipeline.add_stage('myoprocessor', lambda preprocessed_data: myoprocessor.myoprocessor_controll_directly(preprocessed_data, hand_or_wrist, cocontraction),
+                           maxsize=PIPELINE_QUEUE_SIZE, policy=BLOCK)
+        pipeline.add_stage('setpoints', setpoints, maxsize=PIPELINE_QUEUE_SIZE, policy=BLOCK)
+    # The DAQ gets every setpoint, clocked out by its own sample clock from one task that stays open
+    if config.DAQ_OUTPUT:
+        daq_sink = niDAQ.get_sink()
+
+        def daq(prosthesis_setpoints):
+            daq_sink.write(prosthesis_setpoints)
+            return prosthesis_setpoints
+        pipeline.add_stage('daq', daq, maxsize=PIPELINE_QUEUE_SIZE, policy=BLOCK)
+    # The serial engine writes and reads the acknowledgments on its own threads, so submitting never blocks
+    serial_engine = None
+    if ser is not None and ser.is_open:
+        # The engine records the serial and end to end latency when its writer thread has written the block
+        serial_engine = pyserial.SerialOutputEngine(ser, latency=latency)
+        pipeline.add_stage('serial', serial_engine.submit, maxsize=1, policy=KEEP_LATEST, stamped=True)
     else:
         print("Serial port is not open")
 
-        #except Exception as e:
-        #    print("Unknown error:", e)
-        #    stop_event.set()
-
-
-    # Start data processing thread
-    #processing_thread = threading.Thread(target=data_processing_thread)
-    plotThread = threading.Thread(target=plots.plot_all_signals(raw_emg_queue=raw_emg_queue, preprocessed_emg_queue=preprocessed_emg_queue, prosthesis_setpoint_queue=prosthesis_setpoint_queue, stop_event=stop_event))
-    plotThread.start()
-    plotThread.join()
-    #processing_thre+ad.start()
-    # Start plotting in the main thread
-    #plots.plot_all_signals(raw_emg_queue=raw_emg_queue, preprocessed_emg_queue=preprocessed_emg_queue, prosthesis_setpoint_queue=prosthesis_setpoint_queue, stop_event=stop_event)
-    # Wait for data processing thread to finish
-    #processing_thread.join()
-    #ser.close()  # Close serial port
+    if plot_process is not None:
+        plot_process.start()
+    if watcher is not None:
+        watcher.start()
+    pipeline.start()
+
+    try:
+        if plot_process is not None:
+            # Closing the plot window also stops the pipeline
+            while not stop_event.is_set() and plot_process.is_alive():
+                stop_event.wait(0.5)
+        else:
+            plots.plot_all_signals(raw_emg_queue=raw_emg_queue, preprocessed_emg_queue=preprocessed_emg_queue, prosthesis_setpoint_queue=prosthesis_setpoint_queue, stop_event=stop_event)
+    finally:
+        pipeline.stop(timeout=2)
+        if watcher is not None:
+            watcher.stop(timeout=1)
+            print("Config reloaded {} times, {} failed".format(watcher.reloads, watcher.errors))
+        if plot_process is not None:
+            plot_process.stop(writers=[stage.thread for stage in pipeline.stages if stage.thread is not None])
+        print(pipeline.report())
+        if latency is not None:
+            print(latency.report())
+        if recorder is not None:
+            recorder.close()
+        niDAQ.close_daq()
+        if serial_engine is not None:
+            serial_engine.close()
+            print(serial_engine.report())
+        if ser is not None:
+            ser.close()  # Close serial port
+        if dev is not None:
+            emg_in.stop_trigno(dev)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,127 @@
-import pandas as pd
+import hashlib
+import os
+from collections import namedtuple
+import numpy as np
+
+CACHE_SUFFIX = '.cache.npz'
+CACHE_VERSION = 1
+
+CsvData = namedtuple('CsvData', ['time', 'signals', 'names'])
+CsvData.__doc__ = """
+Parsed recording.
+
+- time: Array of shape (samples,) if all the time columns are the same, otherwise (channels, samples).
+- signals: float32 array of shape (channels, samples). Empty cells and NaN are NaN.
+- names: Name of each channel, e.g. 'EMG_1', taken from the column header.
+"""
+
+
+def _detect_delimiter(header):
+    """
+    Delimiter of the export: ';' or tab, whichever the header has most of. ',' only if it has neither, as it is
+    the decimal separator otherwise.
+    """
+    counts = {delimiter: header.count(delimiter) for delimiter in (';', '\t')}
+    delimiter = max(counts, key=counts.get)
+    if counts[delimiter] == 0:
+        return ','
+    return delimiter
+
+
+def _channel_name(column):
+    """
+    'Signal value - EMG 1' -> 'EMG_1'. The part after the last ' - ' names the channel in every export.
+    """
+    name = column.rsplit(' - ', 1)[-1] if ' - ' in column else column
+    return name.strip().replace(' ', '_')
+
+
+def parse_csv(file_path):
+    """
+    Parses a recording in one pass. The delimiter and the column layout (a time column before every signal column)
+    are detected from the header, and decimal commas are read as points.
+
+    Returns:
+    - CsvData with the signals as float32 and the repeated time columns merged into one if they are equal.
+    """
+    with open(file_path, encoding='utf-8-sig') as f:
+        text = f.read()
+
+    header, _, body = text.partition('\n')
+    header = header.rstrip('\r')
+    delimiter = _detect_delimiter(header)
+    columns = header.split(delimiter)
+    if delimiter != ',':
+        body = body.replace(',', '.')
+
+    rows = [line.rstrip('\r') for line in body.splitlines() if line.strip()]
+    fields = delimiter.join(rows).split(delimiter)
+    if len(fields) != len(rows) * len(columns):
+        raise ValueError("{}: rows do not all have the {} columns of the header.".format(file_path, len(columns)))
+    values = np.array([field or 'nan' for field in fields], dtype=np.float64).reshape(len(rows), len(columns)).T
+
+    is_time = np.array([column.strip().startswith('Time') for column in columns])
+    signals = values[~is_time].astype(np.float32)
+    names = [_channel_name(column) for column, t in zip(columns, is_time) if not t]
+
+    times = values[is_time]
+    if times.shape[0] == 0:
+        time = np.arange(values.shape[1])
+    elif np.array_equal(times, times[:1].repeat(times.shape[0], axis=0), equal_nan=True):
+        time = times[0]
+    else:
+        time = times
+    if np.array_equal(time, np.round(time)):
+        time = time.astype(np.int64)
+    return CsvData(time=time, signals=signals, names=names)
+
+
+def _file_hash(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def load_csv(file_path, use_cache=True):
+    """
+    Loads a recording, from the binary cache next to it when the CSV is unchanged.
+
+    The cache (file_path + '.cache.npz') is used if the CSV has the same modification time and size as when it was
+    written. If only the modification time changed, the content hash decides. Otherwise the CSV is parsed again and
+    the cache rewritten.
+
+    Parameters:
+    - file_path: Path of the CSV file.
+    - use_cache: If False the CSV is always parsed and no cache is written.
+
+    Returns:
+    - CsvData
+    """
+    stat = os.stat(file_path)
+    cache_path = file_path + CACHE_SUFFIX
+    file_hash = None
+
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as cache:
+                if int(cache['version']) == CACHE_VERSION and int(cache['size']) == stat.st_size:
+                    unchanged = int(cache['mtime_ns']) == stat.st_mtime_ns
+                    if not unchanged:
+                        file_hash = _file_hash(file_path)
+                        unchanged = str(cache['hash']) == file_hash
+                    if unchanged:
+                        return CsvData(time=cache['time'], signals=cache['signals'], names=cache['names'].tolist())
+        except (OSError, KeyError, ValueError):
+            pass  # Unreadable or old cache, parse the CSV again
+
+    data = parse_csv(file_path)
+    if use_cache:
+        try:
+            np.savez(cache_path, version=CACHE_VERSION, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                     hash=file_hash or _file_hash(file_path), time=data.time, signals=data.signals,
+                     names=np.array(data.names))
+        except OSError:
+            pass  # E.g. a read-only directory, the data is still returned
+    return data
 
 
 def load_emg_data_csv(file_path):
@@ -9,34 +132,19 @@ def load_emg_data_csv(file_path):
         file_path (str): The path to the CSV file containing the EMG data.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the EMG data.
+        pd.DataFrame: A DataFrame with a Time_<channel> and a Signal_<channel> column for each channel,
+        e.g. Time_EMG_1 and Signal_EMG_1.
     """
+    import pandas as pd
+
     try:
-        # Read the CSV file with semicolon as delimiter and comma as decimal separator
-        df = pd.read_csv(file_path, delimiter='\t', decimal=',')
-      
-        # If the initial attempt fails, try other possible delimiters
-        if df.shape[1] == 1:
-            # Try with a semicolon if tabs don't work
-            df = pd.read_csv(file_path, sep=';', decimal=',', encoding='utf-8')
-
-        # Rename columns to avoid duplication
-        df.columns = [
-            'Time_EMG_1', 'Signal_EMG_1', 
-            'Time_EMG_2', 'Signal_EMG_2', 
-            'Time_EMG_3', 'Signal_EMG_3', 
-            'Time_EMG_4', 'Signal_EMG_4'
-        ]
-        # Display basic information about the data
-        print("CSV Data loaded successfully!")
-        print(f"Number of sensors (columns): {df.shape[1] // 2}")
-        print(f"Number of samples (rows): {df.shape[0]}")
-        print(f"Column names (sensor labels): {list(df.columns)}")
-
-        # Return the DataFrame
-        return df
+        data = load_csv(file_path)
+        columns = {}
+        for i, name in enumerate(data.names):
+            columns['Time_' + name] = data.time if data.time.ndim == 1 else data.time[i]
+            columns['Signal_' + name] = data.signals[i]
+        return pd.DataFrame(columns)
 
     except Exception as e:
         print(f"An error occurred while reading the CSV file: {e}")
         return None
-
@@ -1,33 +1,308 @@
-import nidaqmx
+import threading
+import time
+import numpy as np
+import config
+from emg_signal_processing import filter_bank
+
+try:
+    import nidaqmx
+    from nidaqmx.constants import AcquisitionType, RegenerationMode
+except ImportError:
+    # Only needed with the cDAQ chassis, FakeDaqTask can be used without it
+    nidaqmx = None
 
 
 DEV_NAME = "cDAQ9191-16C8EAEMod1" # Device name, you find this in NI MAX
 
+# DAQmx error raised on write when the output buffer ran empty and generation stopped, instead of regenerating old samples
+UNDERRUN_ERROR_CODE = -200290
+
+class FakeDaqError(Exception):
+    """ Stands in for nidaqmx.DaqError, with the same error_code attribute. """
+    def __init__(self, message, error_code):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+class _FakeChannels:
+    def __init__(self, task):
+        self._task = task
+
+    def add_ao_voltage_chan(self, physical_channel, min_val=-10.0, max_val=10.0):
+        self._task.channels.append(physical_channel)
+        self._task.limits = (min_val, max_val)
+
+
+class _FakeTiming:
+    def __init__(self, task):
+        self._task = task
+
+    def cfg_samp_clk_timing(self, rate, sample_mode=None, samps_per_chan=1000):
+        self._task.rate = rate
+        self._task.buffer_size = samps_per_chan
+
+
+class _FakeOutStream:
+    def __init__(self, task):
+        self._task = task
+        self.regen_mode = None
+
+    @property
+    def total_samp_per_chan_generated(self):
+        return self._task.generated()
+
+    @property
+    def space_avail(self):
+        return self._task.buffer_size - (self._task.written - self._task.generated())
+
+
+class FakeDaqTask:
+    """
+    In-process stand-in for nidaqmx.Task with buffered analog output, for testing AnalogOutputSink without the cDAQ.
+
+    The sample clock is simulated with time.monotonic: after start() the task generates rate samples per second from
+    its buffer. write() blocks while the buffer is full, like DAQmx, and raises an underrun error (UNDERRUN_ERROR_CODE)
+    if the buffer ran empty before it. Every write is recorded in writes as (time in ns, copy of the data).
+    """
+    def __init__(self):
+        self.channels = []
+        self.limits = None
+        self.rate = None
+        self.buffer_size = 0
+        self.written = 0
+        self.writes = []
+        self.ao_channels = _FakeChannels(self)
+        self.timing = _FakeTiming(self)
+        self.out_stream = _FakeOutStream(self)
+        self._start_time = None
+        self._generated_before_start = 0
+
+    def generated(self):
+        if self._start_time is None:
+            return self._generated_before_start
+        elapsed = time.monotonic() - self._start_time
+        return min(self.written, self._generated_before_start + int(elapsed * self.rate))
+
+    def start(self):
+        self._start_time = time.monotonic()
+
+    def stop(self):
+        self._generated_before_start = self.generated()
+        self._start_time = None
+        # Samples left in the buffer are discarded when the task stops
+        self.written = self._generated_before_start
+
+    def write(self, data, auto_start=False, timeout=10.0):
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        if self.limits is not None and (data.min(initial=0) < self.limits[0] or data.max(initial=0) > self.limits[1]):
+            raise FakeDaqError("Value out of the range of the channel.", -200561)
+        if self._start_time is not None:
+            elapsed = time.monotonic() - self._start_time
+            if self._generated_before_start + elapsed * self.rate > self.written:
+                raise FakeDaqError("Generation stopped to prevent regeneration of old samples.", UNDERRUN_ERROR_CODE)
+            # Wait for room in the buffer
+            overflow = self.written + data.shape[1] - self.buffer_size - self.generated()
+            if overflow > 0:
+                time.sleep(overflow / self.rate)
+        self.writes.append((time.monotonic_ns(), data.copy()))
+        self.written += data.shape[1]
+        if auto_start and self._start_time is None:
+            self.start()
+        return data.shape[1]
+
+    def close(self):
+        self._start_time = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AnalogOutputSink:
+    """
+    Long-lived analog output task that streams the hand and wrist setpoints to the DAQ.
+
+    The task is configured once: one voltage channel for each row of the setpoints, sample clock timing at rate and
+    a buffer of buffer_seconds. Every write() puts a whole (2, n) setpoint block in the buffer with one 2-D write, and
+    the hardware clocks it out at the sample rate. The buffer is started with prefill zero samples, which is the
+    margin a late block has before the buffer runs empty. Regeneration is off, so an empty buffer is an underrun:
+    it is counted and the task is restarted.
+
+    Parameters:
+    - device: Device name as shown in NI MAX.
+    - channels: Analog output channels, one for each setpoint row (hand, wrist).
+    - rate: Sample rate in Hz. Defaults to the rate of the setpoints, see filter_bank.config_envelope_rate.
+    - buffer_seconds: Size of the output buffer in seconds.
+    - prefill: Number of zero samples written before the task starts.
+    - task_factory: Callable creating the task. Defaults to nidaqmx.Task, use FakeDaqTask to test without the DAQ.
+    """
+    def __init__(self, device=DEV_NAME, channels=('ao0', 'ao1'), rate=None, buffer_seconds=1.0, prefill=None,
+                 task_factory=None):
+        self.device = device
+        self.channels = list(channels)
+        self.rate = filter_bank.config_envelope_rate(config) if rate is None else rate
+        self.buffer_size = max(int(buffer_seconds * self.rate), 2)
+        self.prefill = max(int(0.1 * self.rate), 1) if prefill is None else prefill
+        if task_factory is None:
+            if nidaqmx is None:
+                raise ImportError("nidaqmx is not installed. Use task_factory=FakeDaqTask to run without the DAQ.")
+            task_factory = nidaqmx.Task
+        self.task_factory = task_factory
+
+        self.task = None
+        self.samples_written = 0
+        self.blocks_written = 0
+        self.underruns = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+
+    def start(self):
+        """
+        Creates and configures the task, fills the start of the buffer and starts the generation.
+        """
+        self.task = self.task_factory()
+        channel_list = ",".join("{}/{}".format(self.device, channel) for channel in self.channels)
+        self.task.ao_channels.add_ao_voltage_chan(channel_list, min_val=-10.0, max_val=10.0)
+        if nidaqmx is not None and not isinstance(self.task, FakeDaqTask):
+            self.task.timing.cfg_samp_clk_timing(self.rate, sample_mode=AcquisitionType.CONTINUOUS,
+                                                 samps_per_chan=self.buffer_size)
+            self.task.out_stream.regen_mode = RegenerationMode.DONT_ALLOW_REGENERATION
+        else:
+            self.task.timing.cfg_samp_clk_timing(self.rate, samps_per_chan=self.buffer_size)
+        self._start_generation()
+
+    def _start_generation(self):
+        self.task.write(np.zeros((len(self.channels), self.prefill)), auto_start=False)
+        self.task.start()
+
+    def _restart(self):
+        self.task.stop()
+        self._start_generation()
+
+    def write(self, setpoints):
+        """
+        Writes a setpoint block of shape (channels, n) to the output buffer. Blocks only while the buffer is full.
+
+        Returns:
+        - Number of samples written per channel.
+        """
+        data = np.ascontiguousarray(setpoints, dtype=np.float64)
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
+        if data.shape[1] == 0:
+            return 0
+
+        start = time.perf_counter()
+        try:
+            written = self.task.write(data, auto_start=False)
+        except Exception as e:
+            if getattr(e, 'error_code', None) != UNDERRUN_ERROR_CODE:
+                raise
+            # The buffer ran empty: restart the generation with a fresh margin and write the block again
+            self.underruns += 1
+            self._restart()
+            written = self.task.write(data, auto_start=False)
+        elapsed = time.perf_counter() - start
+
+        self.write_time += elapsed
+        self.max_write_time = max(self.max_write_time, elapsed)
+        self.samples_written += data.shape[1]
+        self.blocks_written += 1
+        return written
+
+    def buffered(self):
+        """
+        Number of samples per channel in the buffer that are not generated yet.
+        """
+        return self.buffer_size - self.task.out_stream.space_avail
+
+    def stats(self):
+        return {
+            'blocks': self.blocks_written,
+            'samples': self.samples_written,
+            'underruns': self.underruns,
+            'mean_write_ms': 1000 * self.write_time / self.blocks_written if self.blocks_written else 0.0,
+            'max_write_ms': 1000 * self.max_write_time,
+        }
+
+    def report(self):
+        return "DAQ output: {blocks} blocks, {samples} samples, {underruns} underruns, write time mean " \
+               "{mean_write_ms:.3f} ms, max {max_write_ms:.3f} ms".format(**self.stats())
+
+    def close(self):
+        if self.task is not None:
+            self.task.stop()
+            self.task.close()
+            self.task = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Sink shared by write_to_daq, so the task is configured once instead of on every write
+_sink = None
+_sink_lock = threading.Lock()
+_last_sample_index = None
+
+
+def get_sink(**kwargs):
+    """
+    The AnalogOutputSink used by write_to_daq, created and started on the first call. kwargs are passed to
+    AnalogOutputSink then, and ignored later.
+    """
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            sink = AnalogOutputSink(**kwargs)
+            sink.start()
+            _sink = sink
+        return _sink
+
+
+def close_daq():
+    """
+    Stops and closes the shared sink, and prints its report.
+    """
+    global _sink, _last_sample_index
+    with _sink_lock:
+        if _sink is not None:
+            print(_sink.report())
+            _sink.close()
+            _sink = None
+            _last_sample_index = None
+
+
 # Periodically read from setpoint queue and write to the DAQ
-# 1. Create a task
-def write_to_daq(setpoint_queue):
+def write_to_daq(setpoint_queue, sink=None):
+    """
+    Writes the newest setpoint block of the queue to the DAQ, hand on ao0 and wrist on ao1. A block that was
+    already written is skipped. Uses the shared sink from get_sink unless another AnalogOutputSink is given.
+    """
+    global _last_sample_index
     if setpoint_queue.is_empty():
         print("Setpoint queue is empty")
         return
-    # Check if DAQ is connected
+    sample_index, setpoint = setpoint_queue.get_last()
+    if sample_index == _last_sample_index:
+        return
     try:
-        with nidaqmx.Task() as task:
-            print("Task created in daq")
-            task.ao_channels.add_ao_voltage_chan(DEV_NAME+"/ao0") # ao0 is the channel number
-            sample_index, setpoint = setpoint_queue.get_last()
-            for i in range(len(setpoint)):
-                print(task.write(setpoint[i], auto_start=True))
-            #print(task.write(setpoint[0], auto_start=True)) # Write 3 values to the channel
-    except nidaqmx.DaqError as e:
-        print("Error writing to DAQ:", e)
+        (sink if sink is not None else get_sink()).write(setpoint)
+        _last_sample_index = sample_index
+    except ImportError as e:
+        print(e)
         return
     except Exception as e:
-        print("Unknown error:", e)
+        print("Error writing to DAQ:", e)
         return
-    
 
 '''
 with nidaqmx.Task() as task:
     task.ao_channels.add_ao_voltage_chan(DEV_NAME+"/ao0") # ai0 is the channel number
     print(task.write([1.0, 2.0, 3.0, 9.3], auto_start=True)) # Write 3 values to the channel
-'''
\ No newline at end of file
+'''
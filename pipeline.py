@@ -0,0 +1,214 @@
+from collections import deque
+import queue
+import threading
+import time
+
+from latency import END_TO_END
+
+# Overflow policies of a StageQueue
+BLOCK = 'block'               # The producer waits until there is room
+DROP_OLDEST = 'drop_oldest'   # The oldest item is dropped to make room
+KEEP_LATEST = 'keep_latest'   # Everything queued is dropped, only the newest item is kept
+
+
+class StageQueue:
+    """
+    Bounded queue between two pipeline stages, with a policy for what to do when it is full.
+
+    Parameters:
+    - maxsize: Maximum number of items in the queue.
+    - policy: BLOCK, DROP_OLDEST or KEEP_LATEST.
+    """
+    def __init__(self, maxsize=8, policy=BLOCK):
+        if policy not in (BLOCK, DROP_OLDEST, KEEP_LATEST):
+            raise ValueError("Invalid overflow policy. Should be 'block', 'drop_oldest' or 'keep_latest'.")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.max_depth = 0
+        self._items = deque()
+        self._condition = threading.Condition()
+
+    def put(self, item, stop_event=None, poll_interval=0.1):
+        """
+        Puts an item in the queue. With the BLOCK policy this waits for room, but gives up if stop_event is set.
+        Returns False if the item was not queued because of stop_event.
+        """
+        with self._condition:
+            if self.policy == KEEP_LATEST:
+                self.dropped += len(self._items)
+                self._items.clear()
+            elif len(self._items) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._items) >= self.maxsize:
+                        if stop_event is not None and stop_event.is_set():
+                            return False
+                        self._condition.wait(poll_interval)
+
+            self._items.append(item)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Takes the oldest item from the queue. Raises queue.Empty if nothing arrives within the timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: len(self._items) > 0, timeout):
+                raise queue.Empty
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def depth(self):
+        with self._condition:
+            return len(self._items)
+
+
+class Stage:
+    """
+    One step of a Pipeline, running func on its own thread.
+
+    The first stage of a pipeline is the source: func is called with no arguments and should block until it has
+    something to return (e.g. reading from the Trigno device). The other stages take the items from the queue of
+    the stage before: func(item). Whatever func returns is passed on to the next stage, except None.
+
+    With a latency.LatencyTracker, items travel between the stages together with the time the source received them,
+    and every stage records the time since then when func returns. The last stage also records it as end to end.
+    A stamped source returns (stamp, item), with the stamp (from LatencyTracker.stamp) taken right after the read,
+    so the time func spends after it counts too. Otherwise the source is stamped when func returns. A stamped stage
+    after the source is called func(item, stamp) instead and records its own latency, for work it hands to another
+    thread such as the serial writer. Its stamp is None without a tracker.
+    """
+    def __init__(self, name, func, input_queue=None, latency=None, stamped=False):
+        self.name = name
+        self.func = func
+        self.input_queue = input_queue
+        self.latency = latency
+        self.stamped = stamped
+        self.output_queue = None
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.thread = None
+
+    def run(self, stop_event, poll_interval=0.1):
+        stamp = None
+        while not stop_event.is_set():
+            if self.input_queue is None:
+                args = ()
+            else:
+                try:
+                    item = self.input_queue.get(timeout=poll_interval)
+                except queue.Empty:
+                    continue
+                if self.latency is not None:
+                    stamp, item = item
+                args = (item, stamp) if self.stamped else (item,)
+
+            start = time.perf_counter()
+            try:
+                result = self.func(*args)
+            except Exception as e:
+                print("Error in pipeline stage '{}': {}".format(self.name, e))
+                self.errors += 1
+                stop_event.set()
+                break
+            self.busy_time += time.perf_counter() - start
+            self.processed += 1
+
+            if self.stamped and self.input_queue is None and result is not None:
+                stamp, result = result
+            if self.latency is not None:
+                if self.input_queue is None:
+                    if not self.stamped:
+                        # Stamp the block when the source has returned it
+                        stamp = self.latency.stamp()
+                elif not self.stamped:
+                    now = self.latency.record(self.name, stamp)
+                    if self.output_queue is None:
+                        self.latency.record(END_TO_END, stamp, now)
+                if result is not None:
+                    result = (stamp, result)
+
+            if result is not None and self.output_queue is not None:
+                self.output_queue.put(result, stop_event=stop_event)
+
+
+class Pipeline:
+    """
+    Runs each stage on its own thread, connected by bounded StageQueues, until stop_event is set.
+
+    Parameters:
+    - stop_event: threading.Event that stops all the stages when set.
+    - latency: Optional latency.LatencyTracker to record the latency of each block at every stage.
+    """
+    def __init__(self, stop_event, latency=None):
+        self.stop_event = stop_event
+        self.latency = latency
+        self.stages = []
+        self._start_time = None
+
+    def add_stage(self, name, func, maxsize=8, policy=BLOCK, stamped=False):
+        """
+        Adds a stage at the end of the pipeline. maxsize and policy are for the queue in front of the stage,
+        and are not used for the first (source) stage. See Stage for stamped.
+        """
+        input_queue = None
+        if self.stages:
+            input_queue = StageQueue(maxsize=maxsize, policy=policy)
+            self.stages[-1].output_queue = input_queue
+        stage = Stage(name, func, input_queue, latency=self.latency, stamped=stamped)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        for stage in self.stages:
+            stage.thread = threading.Thread(target=stage.run, args=(self.stop_event,), name=stage.name, daemon=True)
+            stage.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Sets stop_event and waits for all the stage threads to finish.
+        """
+        self.stop_event.set()
+        self.join(timeout)
+
+    def join(self, timeout=None):
+        for stage in self.stages:
+            if stage.thread is not None:
+                stage.thread.join(timeout)
+
+    def stats(self):
+        """
+        Returns a dict with throughput and queue counters for each stage, by stage name.
+        """
+        elapsed = time.perf_counter() - self._start_time if self._start_time is not None else 0.0
+        stats = {}
+        for stage in self.stages:
+            q = stage.input_queue
+            stats[stage.name] = {
+                'processed': stage.processed,
+                'throughput': stage.processed / elapsed if elapsed > 0 else 0.0,  # Items per second
+                'busy_time': stage.busy_time,
+                'errors': stage.errors,
+                'queue_depth': q.depth() if q is not None else 0,
+                'queue_max_depth': q.max_depth if q is not None else 0,
+                'queue_dropped': q.dropped if q is not None else 0,
+            }
+        return stats
+
+    def report(self):
+        """
+        Returns the stats as a printable table.
+        """
+        lines = ["{:<14}{:>10}{:>10}{:>8}{:>8}{:>9}".format('stage', 'items', 'items/s', 'depth', 'max', 'dropped')]
+        for name, s in self.stats().items():
+            lines.append("{:<14}{:>10}{:>10.1f}{:>8}{:>8}{:>9}".format(
+                name, s['processed'], s['throughput'], s['queue_depth'], s['queue_max_depth'], s['queue_dropped']))
+        return "\n".join(lines)
@@ -3,143 +3,319 @@ import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import matplotlib.animation as animation
 import time
+import signal
+import multiprocessing
 import config
+from shared_buffer import SharedRingBuffer
+from classes import RingBuffer
 
     
-def plot_all_signals(raw_emg_queue, preprocessed_emg_queue, prosthesis_setpoint_queue, stop_event):
+class LiveTrace:
     """
-    Plot all signals in real-time.
+    Scrolling plot of a multi-channel stream in one axes, to be drawn by a BlitRenderer.
+
+    The history is kept in place in a RingBuffer, so appending a block does not move the old samples. When the
+    history has more samples than the axes is wide in pixels, each pixel column is drawn as the min and max of the
+    samples that fall in it. That looks the same as drawing every sample, but the number of points drawn only
+    depends on the size of the window. The x axis is the time in seconds relative to the newest sample.
+
+    Parameters:
+    - ax: The matplotlib axes to draw in.
+    - num_channels: Number of channels (one line each).
+    - history: Number of samples shown.
+    - fs: Sampling frequency, for the time axis.
+    - labels: Optional list of line labels.
+    - ylim: Initial y limits. They are only changed when the data goes outside of them.
+    """
+    def __init__(self, ax, num_channels, history, fs, labels=None, ylim=(-1, 1)):
+        self.ax = ax
+        self.history = history
+        self.fs = fs
+        self.ring = RingBuffer(num_channels, history)
+        self._ordered = np.zeros((num_channels, history))
+        self._width = None
+        self._x = None
+        self._y = None
+
+        labels = labels if labels is not None else [None] * num_channels
+        self.lines = [ax.plot([], [], label=label, animated=True)[0] for label in labels]
+        ax.set_xlim(-history / fs, 0)
+        ax.set_ylim(*ylim)
+
+    def append(self, block):
+        self.ring.write(block)
+
+    def _resize(self, width):
+        # Preallocate the decimated x and y, only redone when the axes changes size
+        self._width = width
+        t = (np.arange(self.history) - self.history + 1) / self.fs
+        if self.history <= 2 * width:
+            self._bin = 1
+            self._x = t
+            self._y = np.zeros((len(self.lines), self.history))
+        else:
+            self._bin = self.history // width
+            used = width * self._bin
+            self._x = np.repeat(t[self.history - used:].reshape(width, self._bin).mean(axis=1), 2)
+            self._y = np.zeros((len(self.lines), 2 * width))
+        for line in self.lines:
+            line.set_xdata(self._x)
+
+    def update(self):
+        """
+        Puts the newest data in the lines. Returns True if the y limits had to change, which needs a full redraw.
+        """
+        width = max(int(self.ax.get_window_extent().width), 1)
+        if width != self._width:
+            self._resize(width)
+
+        data = self.ring.latest(self.history, out=self._ordered)
+        if self._bin == 1:
+            self._y[:] = data
+        else:
+            binned = data[:, self.history - self._x.size // 2 * self._bin:].reshape(data.shape[0], -1, self._bin)
+            np.min(binned, axis=2, out=self._y[:, 0::2])
+            np.max(binned, axis=2, out=self._y[:, 1::2])
+        for line, y in zip(self.lines, self._y):
+            line.set_ydata(y)
+
+        low, high = self.ax.get_ylim()
+        data_low, data_high = np.nanmin(self._y), np.nanmax(self._y)
+        if data_low < low or data_high > high:
+            margin = 0.1 * (max(data_high, high) - min(data_low, low))
+            self.ax.set_ylim(min(data_low, low) - margin, max(data_high, high) + margin)
+            return True
+        return False
+
+
+class BlitRenderer:
+    """
+    Draws the LiveTraces of a figure with blitting: the axes, grid and legend are drawn once and saved as the
+    background, and each update only restores that background and redraws the lines. The whole figure is only
+    redrawn when a trace changes its y limits or the window is resized.
+
+    Parameters:
+    - fig: The matplotlib figure.
+    - traces: List of LiveTrace in the figure.
+    """
+    def __init__(self, fig, traces):
+        self.fig = fig
+        self.traces = traces
+        self._background = None
+        fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for trace in self.traces:
+            for line in trace.lines:
+                trace.ax.draw_artist(line)
+
+    def render(self):
+        canvas = self.fig.canvas
+        full_redraw = any([trace.update() for trace in self.traces])
+        if full_redraw or self._background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            self._draw_lines()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+
+def _append_new_blocks(queue, last_sample, append):
+    """
+    Appends the blocks put in a ThreadSafeQueue since sample number last_sample. Returns the new last sample number.
+    """
+    sample_num, blocks = queue.get_copy()
+    new_blocks = min(sample_num - last_sample, len(blocks))
+    for block in blocks[len(blocks) - new_blocks:]:
+        append(block)
+    return sample_num
+
+
+def plot_all_signals(raw_emg_queue, preprocessed_emg_queue, prosthesis_setpoint_queue, stop_event, frame_rate=30):
+    """
+    Plot all signals in real-time. The lines are drawn with blitting (see BlitRenderer), at most frame_rate times a second.
     """
     plt.ion()  # Enable interactive mode
     # Define the time window size in seconds
     window_raw = int(config.SENSOR_FREQ*raw_emg_queue.window_size)
     window_processed = int(config.PROCESSING_FREQ*preprocessed_emg_queue.window_size)
     window_setpoint = int(config.PROCESSING_FREQ*prosthesis_setpoint_queue.window_size)
+    labels = [f'EMG {i+1}' for i in range(len(config.ACTIVE_CHANNELS))]
 
     # Raw emg
     fig_raw, ax1 = plt.subplots()
     ax1.set_title("Raw EMG Signal")
-    ax1.set_xlabel("Sample Index")
+    ax1.set_xlabel("Time [s]")
     ax1.set_ylabel("Amplitude")
-    ax1.set_xlim(0, window_raw+100)  # Initial x-limits
-    ax1.set_ylim(-1, 1)  
     ax1.grid(True)
-    lines1 = [ax1.plot([], [], label=f'EMG {i+1}')[0] for i in range(len(config.ACTIVE_CHANNELS))]  # Create a line for each sensor
+    raw_trace = LiveTrace(ax1, len(labels), window_raw, config.SENSOR_FREQ, labels=labels, ylim=(-1, 1))
     ax1.legend(loc='upper right')
 
     # Preprocessed emg
     fig_pros, ax2 = plt.subplots()
     ax2.set_title("Preprocessed EMG Signal")
-    ax2.set_xlabel("Sample Index")
+    ax2.set_xlabel("Time [s]")
     ax2.set_ylabel("Amplitude")
-    ax2.set_xlim(0, window_processed+100)  # Initial x-limits
-    ax2.set_ylim(-5, 5)
     ax2.grid(True)
-    lines2 = [ax2.plot([], [], label=f'EMG {i+1}')[0] for i in range(len(config.ACTIVE_CHANNELS))]
+    processed_trace = LiveTrace(ax2, len(labels), window_processed, config.PROCESSING_FREQ, labels=labels, ylim=(-5, 5))
     ax2.legend(loc='upper right')
 
     # Setpoints
     fig_setpoint, (ax3, ax4) = plt.subplots(2, 1)
     ax3.set_title("Prosthesis Setpoints")
-    #ax3.set_xlabel("Time")
     ax3.set_ylabel("Hand [V]")
     ax3.grid(True)
-    #ax4.set_title("Prosthesis Setpoints: Wrist Control")
-    ax4.set_xlabel("Time")
+    ax4.set_xlabel("Time [s]")
     ax4.set_ylabel("Wrist [V]")
     ax4.grid(True)
-    
-    ax3.set_ylim(-5.5, 5.5)  # Initial y-limits
-    ax3.set_xlim(0, 34)  # Initial x-limits
-    ax4.set_ylim(-5.5, 5.5) 
-    ax4.set_xlim(0, 34)  # Initial x-limits
-
-    line3, = ax3.plot([], [])
-    line4, = ax4.plot([], [])
+    hand_trace = LiveTrace(ax3, 1, window_setpoint, config.PROCESSING_FREQ, ylim=(-5.5, 5.5))
+    wrist_trace = LiveTrace(ax4, 1, window_setpoint, config.PROCESSING_FREQ, ylim=(-5.5, 5.5))
 
-    # Initialize buffer to store data
-    raw_data_buffer = np.zeros((len(config.ACTIVE_CHANNELS), int(window_raw)))
-    last_sample_raw = 0
-    preprocessed_buffer = np.zeros((len(config.ACTIVE_CHANNELS), int(window_processed)))
-    setpoint_buffer = np.zeros((2, int(window_setpoint)))  # Assuming 2 prosthesis setpoints (Hand and Wrist)
+    def append_setpoints(setpoints):
+        hand_trace.append(setpoints[0:1])
+        wrist_trace.append(setpoints[1:2])
 
-    current_pos_raw = 0  # Start at position 0
-    current_pos_processed = 0
-    current_pos_setpoint = 0
+    renderers = [BlitRenderer(fig_raw, [raw_trace]), BlitRenderer(fig_pros, [processed_trace]), BlitRenderer(fig_setpoint, [hand_trace, wrist_trace])]
+    plt.show(block=False)
 
-    start_time = time.time()
+    last_sample_raw = last_sample_processed = last_sample_setpoint = 0
+    next_frame = time.perf_counter()
     while not stop_event.is_set():
-        if not raw_emg_queue.is_empty():
-            #sample_index, raw_data = raw_emg_queue.get_copy()
-            sample_index_raw, raw_data = raw_emg_queue.get_last()
-            
-            if sample_index_raw == last_sample_raw:
-                #print('Same sample as last read, skipping...')
-                time.sleep(0.01)
-                continue
-            
-            last_sample_raw = sample_index_raw
-            raw_data_buffer = np.roll(raw_data_buffer, -len(raw_data[0]), axis=1)  # Shift data to the left
-            raw_data_buffer[:, -len(raw_data[0]):] = raw_data  # Append new data to the right
-            
-            for i, line in enumerate(lines1):
-                line.set_xdata(np.arange(current_pos_raw, current_pos_raw + len(raw_data_buffer[i])))
-                line.set_ydata(raw_data_buffer[i])
-
-            ax1.relim()
-            ax1.autoscale_view() 
-            ax1.set_xlim(current_pos_raw, current_pos_raw + window_raw+100)
-            fig_raw.canvas.draw()
-            fig_raw.canvas.flush_events()
-            plt.pause(0.001)
-            current_pos_raw = current_pos_raw + len(raw_data[0])
-            
-
-        if not preprocessed_emg_queue.is_empty():
-            sample_index_pros, preprocessed_data = preprocessed_emg_queue.get_last()
-            
-            preprocessed_buffer = np.roll(preprocessed_buffer, -len(preprocessed_data[0]), axis=1)  # Shift data to the left
-            preprocessed_buffer[:, -len(preprocessed_data[0]):] = preprocessed_data  # Append new data to the right
-            
-            for i, line in enumerate(lines2):
-                line.set_xdata(np.arange(current_pos_processed, current_pos_processed + len(preprocessed_buffer[i])))
-                line.set_ydata(preprocessed_buffer[i])
-                
-            ax2.relim()
-            ax2.autoscale_view()
-            ax2.set_xlim(current_pos_processed, current_pos_processed + window_processed)
-            # Redraw the plot
-            fig_pros.canvas.draw()
-            fig_pros.canvas.flush_events()
-            plt.pause(0.001)
-            current_pos_processed = current_pos_processed + len(preprocessed_data[0])
-
-        if not prosthesis_setpoint_queue.is_empty():
-            sample_index, setpoints = prosthesis_setpoint_queue.get_last()
-            hand_setpoint, wrist_setpoint = setpoints
-
-            setpoint_buffer = np.roll(setpoint_buffer, -len(hand_setpoint), axis=1)  # Shift data to the left
-            setpoint_buffer[:, -len(hand_setpoint):] = setpoints
-            
-            line3.set_xdata(np.arange(current_pos_setpoint, current_pos_setpoint + len(setpoint_buffer[0])))
-            line3.set_ydata(setpoint_buffer[0])
-
-            line4.set_xdata(np.arange(current_pos_setpoint, current_pos_setpoint + len(setpoint_buffer[1])))
-            line4.set_ydata(setpoint_buffer[1])
-
-            ax3.relim()
-            ax3.autoscale_view()
-            ax4.relim()
-            ax4.autoscale_view()
-
-            ax3.set_xlim(current_pos_setpoint, current_pos_setpoint + window_setpoint)
-            ax4.set_xlim(current_pos_setpoint, current_pos_setpoint + window_setpoint)
-            fig_setpoint.canvas.draw()
-            fig_setpoint.canvas.flush_events()
-            current_pos_setpoint = current_pos_setpoint + len(setpoint_buffer[0])
-            plt.pause(0.001)
+        last_sample_raw = _append_new_blocks(raw_emg_queue, last_sample_raw, raw_trace.append)
+        last_sample_processed = _append_new_blocks(preprocessed_emg_queue, last_sample_processed, processed_trace.append)
+        last_sample_setpoint = _append_new_blocks(prosthesis_setpoint_queue, last_sample_setpoint, append_setpoints)
+
+        for renderer in renderers:
+            renderer.render()
 
+        # Wait for the next frame. plt.pause is not used, as it would redraw the whole figure.
+        next_frame = max(next_frame + 1 / frame_rate, time.perf_counter())
+        time.sleep(max(next_frame - time.perf_counter(), 0))
 
     plt.ioff()  # Disable interactive mode when exiting
     #plt.close(fig_raw, fig_pros, fig_setpoint)
 
+
+def _plot_process_main(raw_name, processed_name, setpoint_name, display_rate, stop_event):
+    """
+    Entry point of the plot process. Draws the newest data from the shared ring buffers display_rate times a second.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-c is handled by the main process, which sets stop_event
+    raw_ring = SharedRingBuffer.attach(raw_name)
+    processed_ring = SharedRingBuffer.attach(processed_name)
+    setpoint_ring = SharedRingBuffer.attach(setpoint_name)
+    raw_cursor = raw_ring.cursor()
+    processed_cursor = processed_ring.cursor()
+    setpoint_cursor = setpoint_ring.cursor()
+
+    plt.ion()
+    fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 1, figsize=(8, 9))
+    ax1.set_title("Raw EMG Signal")
+    ax2.set_title("Preprocessed EMG Signal")
+    ax3.set_title("Prosthesis Setpoints")
+    ax3.set_ylabel("Hand [V]")
+    ax4.set_ylabel("Wrist [V]")
+    ax4.set_xlabel("Time [s]")
+    labels = [f'EMG {i+1}' for i in range(raw_ring.num_channels)]
+    raw_trace = LiveTrace(ax1, raw_ring.num_channels, raw_ring.capacity, config.SENSOR_FREQ, labels=labels, ylim=(-1, 1))
+    processed_trace = LiveTrace(ax2, processed_ring.num_channels, processed_ring.capacity, config.PROCESSING_FREQ, labels=labels, ylim=(-5, 5))
+    hand_trace = LiveTrace(ax3, 1, setpoint_ring.capacity, config.PROCESSING_FREQ, ylim=(-5.5, 5.5))
+    wrist_trace = LiveTrace(ax4, 1, setpoint_ring.capacity, config.PROCESSING_FREQ, ylim=(-5.5, 5.5))
+    for ax in (ax1, ax2, ax3, ax4):
+        ax.grid(True)
+    ax1.legend(loc='upper right')
+    ax2.legend(loc='upper right')
+    fig.tight_layout()
+    renderer = BlitRenderer(fig, [raw_trace, processed_trace, hand_trace, wrist_trace])
+    plt.show(block=False)
+
+    interval = 1 / display_rate
+    next_frame = time.perf_counter()
+    try:
+        while not stop_event.is_set() and plt.fignum_exists(fig.number):
+            raw_trace.append(raw_cursor.read())
+            processed_trace.append(processed_cursor.read())
+            setpoints = setpoint_cursor.read()
+            hand_trace.append(setpoints[0:1])
+            wrist_trace.append(setpoints[1:2])
+            renderer.render()
+
+            next_frame = max(next_frame + interval, time.perf_counter())
+            time.sleep(max(next_frame - time.perf_counter(), 0))
+    finally:
+        plt.close(fig)
+        raw_ring.close()
+        processed_ring.close()
+        setpoint_ring.close()
+
+
+class PlotProcess:
+    """
+    Runs the live plots in a separate process, so matplotlib does not compete with acquisition and control for the GIL.
+
+    The control loop writes its blocks to shared ring buffers with push_raw, push_processed and push_setpoints, which
+    never wait on the plotter. The plot process reads the newest window from them display_rate times a second.
+
+    Parameters:
+    - num_channels: Number of EMG channels.
+    - display_rate: Plot updates per second. Defaults to config.PLOT_DISPLAY_RATE.
+    - window_seconds: Seconds of data shown. Defaults to config.PLOT_WINDOW_SECONDS.
+    """
+    def __init__(self, num_channels, display_rate=None, window_seconds=None):
+        display_rate = config.PLOT_DISPLAY_RATE if display_rate is None else display_rate
+        window_seconds = config.PLOT_WINDOW_SECONDS if window_seconds is None else window_seconds
+
+        self.raw_ring = SharedRingBuffer(num_channels, int(config.SENSOR_FREQ * window_seconds))
+        self.processed_ring = SharedRingBuffer(num_channels, int(config.PROCESSING_FREQ * window_seconds))
+        self.setpoint_ring = SharedRingBuffer(2, int(config.PROCESSING_FREQ * window_seconds))
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_plot_process_main, name='plotter', daemon=True,
+            args=(self.raw_ring.name, self.processed_ring.name, self.setpoint_ring.name, display_rate, self.stop_event))
+
+    def start(self):
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def push_raw(self, raw_data):
+        if raw_data is not None:
+            self.raw_ring.write(raw_data)
+
+    def push_processed(self, processed_data):
+        if processed_data is not None:
+            self.processed_ring.write(processed_data)
+
+    def push_setpoints(self, setpoints):
+        if setpoints is not None:
+            self.setpoint_ring.write(setpoints)
+
+    def stop(self, timeout=5, writers=()):
+        """
+        Stops the plot process and frees the shared memory.
+
+        Parameters:
+        - timeout: Seconds to wait for the plot process, and then for each writer.
+        - writers: Threads that call push_raw, push_processed or push_setpoints, e.g. the pipeline stages. They are
+          joined first, as a push to closed shared memory crashes the process. If one is still running after the
+          timeout the memory is left open, and freed when the process exits.
+        """
+        self.stop_event.set()
+        if self.process.is_alive():
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        for writer in writers:
+            writer.join(timeout)
+            if writer.is_alive():
+                print("Plot writer '{}' is still running, leaving the shared memory open".format(writer.name))
+                return
+        self.raw_ring.close()
+        self.processed_ring.close()
+        self.setpoint_ring.close()
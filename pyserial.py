@@ -2,8 +2,14 @@
 #
 # SPDX-License-Identifier:    BSD-3-Clause
 
+from collections import deque
+import os
+import select
+import threading
+import time
 import serial
 import numpy as np
+from latency import LatencyHistogram, END_TO_END
 
 # Initialize serial communication
 def float_to_quantized_byte(value, min_value=-5.0, max_value=5.0):
@@ -19,40 +25,98 @@ def float_to_quantized_byte(value, min_value=-5.0, max_value=5.0):
     return normalized
 
 
+def quantize_to_bytes(values, min_value=-5.0, max_value=5.0):
+    """
+    Array version of float_to_quantized_byte, giving exactly the same bytes as calling it on every value.
+    The arithmetic is done in the dtype of values, like float_to_quantized_byte does for a NumPy scalar.
+    """
+    clipped = np.clip(values, min_value, max_value)
+    # Truncation in astype is the same as int(), the values are never negative here
+    return ((clipped - min_value) / (max_value - min_value) * 255).astype(np.uint8)
+
+
+def encode_setpoints(setpoints, min_value=-5.0, max_value=5.0):
+    """
+    Builds the packets of a whole setpoint block at once, the same bytes setpoint_packet gives sample by sample.
+
+    Parameters:
+    - setpoints: Array of shape (2, n) with the hand and wrist setpoints, from to_prosthesis.prosthesis_signals.
+
+    Returns:
+    - data: bytes with the n packets of 4 bytes [open, close, right, left], for one ser.write.
+    - conflicts: Number of samples where both setpoints were non-zero, sent as all zero packets.
+    """
+    hand = np.asarray(setpoints[0])
+    wrist = np.asarray(setpoints[1])
+    hand_active = hand != 0
+    wrist_active = wrist != 0
+    hand_only = hand_active & ~wrist_active
+    wrist_only = wrist_active & ~hand_active
+
+    packets = np.zeros((hand.shape[0], 4), dtype=np.uint8)
+    hand_bytes = quantize_to_bytes(hand, min_value, max_value)
+    wrist_bytes = quantize_to_bytes(wrist, min_value, max_value)
+    positive = hand > 0
+    packets[:, 0] = np.where(hand_only & positive, hand_bytes, 0)      # Open
+    packets[:, 1] = np.where(hand_only & ~positive, hand_bytes, 0)     # Close
+    positive = wrist > 0
+    packets[:, 2] = np.where(wrist_only & positive, wrist_bytes, 0)    # Turn right
+    packets[:, 3] = np.where(wrist_only & ~positive, wrist_bytes, 0)   # Turn left
+
+    conflicts = int(np.count_nonzero(hand_active & wrist_active))
+    return packets.tobytes(), conflicts
+
+
+def write_block_to_hand(ser, setpoints):
+    """
+    Writes a whole setpoint block to the hand with one ser.write, without waiting for acknowledgments.
+
+    Returns:
+    - conflicts: Number of samples where both hand and wrist setpoints were non-zero.
+    """
+    data, conflicts = encode_setpoints(setpoints)
+    ser.write(data)
+    return conflicts
+
+
+def setpoint_packet(hand_val, wrist_val):
+    """
+    Builds the 4 byte packet for one hand and wrist setpoint: [open, close, right, left] torques.
+
+    Returns:
+    - packet: bytes of the packet. All zero if both setpoints are non-zero.
+    - conflict: True if both setpoints were non-zero, which the hand can not do at the same time.
+    """
+    packet = [0x00, 0x00, 0x00, 0x00]  # Initialize packet
+    conflict = False
+
+    if hand_val != 0 and wrist_val == 0:
+        if hand_val > 0:
+            packet[0] = float_to_quantized_byte(hand_val) # Open with torque = hand_val
+        else:
+            packet[1] = float_to_quantized_byte(hand_val) # Close with torque = hand_val
+    elif hand_val == 0 and wrist_val != 0:
+        if wrist_val > 0:   # Turn right with torque = wrist_val
+            packet[2] = float_to_quantized_byte(wrist_val)
+        else:
+            packet[3] = float_to_quantized_byte(wrist_val) # Turn left with torque = wrist_val
+    elif hand_val != 0 and wrist_val != 0:
+        conflict = True
+    return bytes(packet), conflict
+
+
 def write_to_hand(ser, setpoints):   
     """
     Write setpoints to the hand using serial communication.
     """
-    last_setpoint = "hand"
     #if ser.is_open:
     hand_setpoints = setpoints[0]
     wrist_setpoints = setpoints[1]  
     for i in range(len(hand_setpoints)):
-        packet = [0x00, 0x00, 0x00, 0x00]  # Initialize packet
-
-        hand_val = hand_setpoints[i]
-        wrist_val = wrist_setpoints[i]
-
-        if hand_val != 0 and wrist_val == 0:
-            if hand_val > 0:
-                hand_val = float_to_quantized_byte(hand_val)
-                packet[0] = hand_val # Open with torque = hand_val
-            else:
-                hand_val = float_to_quantized_byte(hand_val)
-                packet[1] = hand_val   # Close with torque = hand_val
-        elif hand_val == 0 and wrist_val != 0:
-            if wrist_val > 0:   # Turn right with torque = wrist_val
-                wrist_val = float_to_quantized_byte(wrist_val)
-                packet[2] = wrist_val
-            else:
-                wrist_val = float_to_quantized_byte(wrist_val)
-                packet[3] = wrist_val # Turn left with torque = wrist_val
-        elif hand_val == 0 and wrist_val == 0:
-            packet = [0x00, 0x00, 0x00, 0x00]
-        else:
+        packet_bytes, conflict = setpoint_packet(hand_setpoints[i], wrist_setpoints[i])
+        if conflict:
             print("Both wrist and hand setpoints cannot be non-zero at the same time")
         # Send setpoints to the hand
-        packet_bytes = bytearray(packet)
         ser.write(packet_bytes)
 
         print("Feedback from serial: ", ser.read(1))
@@ -62,6 +126,225 @@ def write_to_hand(ser, setpoints):
     #ser.close()  # Close serial port
 
 
+class SerialOutputEngine:
+    """
+    Sends setpoint packets to the hand without blocking the control loop.
+
+    submit() only builds the packets of a block and hands them to a writer thread, which sends every packet of the
+    blocks it takes. If the writer falls behind (the serial line at 9600 baud takes about 4 ms per packet), only the
+    newest max_pending blocks wait for it and older waiting blocks are dropped, so the hand always gets the newest
+    setpoints. On an idle line every packet is sent. A packet identical to the last one sent is skipped. The
+    acknowledgment byte the hand sends for every packet is read on a separate reader thread and matched to the
+    packets in the order they were sent, which gives the round-trip time of each packet.
+
+    With a latency.LatencyTracker, the stamp given with a block is recorded under latency_name and as end to end
+    when the last packet of the block has been written, on the writer thread.
+
+    Parameters:
+    - ser: Open serial.Serial (or any object with write, read and in_waiting).
+    - max_pending: Number of blocks that can wait for the writer. Older waiting blocks are dropped (coalesced).
+    - skip_duplicates: If True, a packet equal to the last packet sent is not sent again.
+    - ack_timeout: Seconds to wait for an acknowledgment before the packet is counted as lost.
+    - latency: Optional latency.LatencyTracker for the stamps of the blocks.
+    - latency_name: Name the write latency is recorded under.
+    """
+    def __init__(self, ser, max_pending=1, skip_duplicates=True, ack_timeout=1.0, latency=None, latency_name='serial'):
+        self.ser = ser
+        self.max_pending = max_pending
+        self.skip_duplicates = skip_duplicates
+        self.ack_timeout = ack_timeout
+        self.latency = latency
+        self.latency_name = latency_name
+
+        self.rtt = LatencyHistogram()  # Written by the reader thread only
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.duplicates = 0
+        self.conflicts = 0
+        self.acks = 0
+        self.lost = 0
+        self.unmatched_acks = 0
+        self.errors = 0
+
+        self._pending = deque(maxlen=max_pending)  # (stamp, packets) of the blocks waiting for the writer
+        self._in_flight = deque()  # (send time in ns) of packets waiting for their acknowledgment
+        self._in_flight_lock = threading.Lock()  # The writer adds to _in_flight and the reader takes from it
+        self._last_packet = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='serial_writer', daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, name='serial_reader', daemon=True)
+        self._writer.start()
+        self._reader.start()
+
+    def submit(self, setpoints, stamp=None):
+        """
+        Queues the packets of a (2, n) setpoint block from to_prosthesis.prosthesis_signals. Never blocks on the port.
+
+        Parameters:
+        - setpoints: Array of shape (2, n).
+        - stamp: Optional LatencyTracker.stamp of the block, recorded when the block has been written.
+        """
+        data, conflicts = encode_setpoints(setpoints)
+        self.conflicts += conflicts
+        self.submit_packets([data[i:i + 4] for i in range(0, len(data), 4)], stamp=stamp)
+
+    def submit_packets(self, packets, stamp=None):
+        """
+        Queues already encoded 4 byte packets as one block, oldest first.
+        """
+        packets = list(packets)
+        with self._condition:
+            if len(self._pending) == self.max_pending:
+                self.coalesced += len(self._pending[0][1])
+            self._pending.append((stamp, packets))
+            self.submitted += len(packets)
+            self._condition.notify()
+
+    def _write_loop(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                if not self._pending:
+                    self._condition.wait(0.1)
+                    continue
+                stamp, packets = self._pending.popleft()
+
+            for packet in packets:
+                self._send(packet)
+            if self.latency is not None and stamp is not None:
+                now = self.latency.record(self.latency_name, stamp)
+                self.latency.record(END_TO_END, stamp, now)
+
+    def _send(self, packet):
+        if self.skip_duplicates and packet == self._last_packet:
+            self.duplicates += 1
+            return
+        sent = time.monotonic_ns()
+        with self._in_flight_lock:
+            self._in_flight.append(sent)
+        try:
+            self.ser.write(packet)
+        except (serial.SerialException, OSError) as e:
+            print("Error writing to serial port:", e)
+            with self._in_flight_lock:
+                # The reader may have taken it as lost already, and appended ones are newer
+                if sent in self._in_flight:
+                    self._in_flight.remove(sent)
+            self.errors += 1
+            return
+        self._last_packet = packet
+        self.sent += 1
+
+    def _read_loop(self):
+        timeout_ns = int(self.ack_timeout * 1e9)
+        while not self._stop_event.is_set():
+            try:
+                ack = self.ser.read(1)  # Returns after the port timeout if nothing arrives
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._stop_event.is_set():
+                    break
+                print("Error reading from serial port:", e)
+                self.errors += 1
+                time.sleep(0.1)
+                continue
+
+            now = time.monotonic_ns()
+            with self._in_flight_lock:
+                # Packets that waited too long will not be acknowledged any more
+                while self._in_flight and now - self._in_flight[0] > timeout_ns:
+                    self._in_flight.popleft()
+                    self.lost += 1
+                if not ack:
+                    continue
+                sent = self._in_flight.popleft() if self._in_flight else None
+            if sent is not None:
+                self.rtt.record(now - sent)
+                self.acks += 1
+            else:
+                self.unmatched_acks += 1
+
+    def stats(self):
+        """
+        Returns a dict with the packet counters and the round-trip times in ms.
+        """
+        p50, p95, p99 = self.rtt.percentiles((50, 95, 99))
+        to_ms = lambda ns: ns / 1e6 if ns is not None else None
+        return {
+            'submitted': self.submitted, 'sent': self.sent, 'coalesced': self.coalesced,
+            'duplicates': self.duplicates, 'conflicts': self.conflicts, 'acks': self.acks, 'lost': self.lost,
+            'unmatched_acks': self.unmatched_acks, 'errors': self.errors,
+            'rtt_p50': to_ms(p50), 'rtt_p95': to_ms(p95), 'rtt_p99': to_ms(p99), 'rtt_max': to_ms(self.rtt.max),
+        }
+
+    def report(self):
+        s = self.stats()
+        lines = ["Serial packets: {submitted} submitted, {sent} sent, {coalesced} coalesced, {duplicates} duplicates "
+                 "skipped, {conflicts} hand/wrist conflicts, {acks} acknowledged, {lost} lost".format(**s)]
+        if self.rtt.count:
+            lines.append("Serial round trip [ms]: p50 {rtt_p50:.3f}, p95 {rtt_p95:.3f}, p99 {rtt_p99:.3f}, "
+                         "max {rtt_max:.3f}".format(**s))
+        return "\n".join(lines)
+
+    def close(self, timeout=1.0):
+        """
+        Stops the writer and reader threads. The serial port is left open.
+        """
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._writer.join(timeout)
+        self._reader.join(timeout + (self.ser.timeout or 0))
+
+
+class PtyHandSimulator:
+    """
+    Fake hand on a pseudo terminal (Linux and macOS only), for testing SerialOutputEngine and write_to_hand
+    without the hardware. Open serial.Serial(sim.port) to talk to it. Every 4 byte packet it receives is stored
+    with its arrival time and acknowledged with one byte after ack_delay seconds.
+
+    Parameters:
+    - ack_delay: Seconds before each acknowledgment is sent.
+    - ack_byte: The acknowledgment byte.
+    """
+    def __init__(self, ack_delay=0.0, ack_byte=b'\x01'):
+        import pty
+        import tty
+
+        self.ack_delay = ack_delay
+        self.ack_byte = ack_byte
+        self.packets = []  # (arrival time in ns, packet bytes)
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        tty.setraw(self._master)
+        self.port = os.ttyname(self._slave)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pty_hand', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        pending = b''
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                pending += os.read(self._master, 1024)
+            except OSError:
+                break
+            while len(pending) >= 4:
+                packet, pending = pending[:4], pending[4:]
+                self.packets.append((time.monotonic_ns(), packet))
+                if self.ack_delay:
+                    time.sleep(self.ack_delay)
+                os.write(self._master, self.ack_byte)
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join(1.0)
+        os.close(self._master)
+        os.close(self._slave)
+
 
 def test_serial_communication(ser):
     """
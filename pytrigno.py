@@ -20,7 +20,6 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import socket
-import struct
 import numpy
 
 class _BaseTrignoDaq(object):
@@ -70,6 +69,10 @@ class _BaseTrignoDaq(object):
 
         self._min_recv_size = self.total_channels * self.BYTES_PER_CHANNEL
 
+        # Receive buffer reused between reads, grown on demand in _recv_frames
+        self._buffer = bytearray()
+        self._buffer_view = memoryview(self._buffer)
+
         self._initialize()
 
     def _initialize(self):
@@ -101,7 +104,7 @@ class _BaseTrignoDaq(object):
         """
         self._send_cmd('START')
 
-    def read(self, num_samples):
+    def read(self, num_samples, out=None):
         """
         Request a sample of data from the device.
 
@@ -112,30 +115,54 @@ class _BaseTrignoDaq(object):
         ----------
         num_samples : int
             Number of samples to read per channel.
+        out : ndarray, shape=(total_channels, num_samples), optional
+            Array to write the decoded data into. If given, no memory is
+            allocated for the block and ``out`` is returned.
 
         Returns
         -------
         data : ndarray, shape=(total_channels, num_samples)
             Data read from the device. Each channel is a row and each column
-            is a point in time.
+            is a point in time. Without ``out`` this is a new float64 array,
+            so it can be kept after the next read.
+        """
+        frames = self._recv_frames(num_samples)
+        if out is None:
+            # A copy, as frames is a view of the receive buffer that the next read overwrites
+            return frames.T.astype(numpy.float64)
+
+        numpy.copyto(out, frames.T)
+        return out
+
+    def _recv_frames(self, num_samples):
+        """
+        Fill the receive buffer with ``num_samples`` frames from the data socket.
+
+        Returns
+        -------
+        frames : ndarray, shape=(num_samples, total_channels)
+            Zero-copy little-endian float32 view of the receive buffer, one
+            row per frame as sent on the wire.
         """
         l_des = num_samples * self._min_recv_size
+        if len(self._buffer) < l_des:
+            self._buffer = bytearray(l_des)
+            self._buffer_view = memoryview(self._buffer)
+
+        view = self._buffer_view[:l_des]
         l = 0
-        packet = bytes()
         while l < l_des:
             try:
-                packet += self._data_socket.recv(l_des - l)
+                n = self._data_socket.recv_into(view[l:], l_des - l)
             except socket.timeout:
-                l = len(packet)
-                packet += b'\x00' * (l_des - l)
                 raise IOError("Device disconnected.")
-            l = len(packet)
-
-        data = numpy.asarray(
-            struct.unpack('<'+'f'*self.total_channels*num_samples, packet))
-        data = numpy.transpose(data.reshape((-1, self.total_channels)))
+            if n == 0:
+                raise IOError("Device disconnected.")
+            l += n
 
-        return data
+        frames = numpy.frombuffer(self._buffer, dtype='<f4',
+                                  count=l_des // self.BYTES_PER_CHANNEL)
+        return frames.reshape(-1, self.total_channels)
 
     def stop(self):
         """Tell the device to stop streaming data."""
@@ -169,7 +196,115 @@ class _BaseTrignoDaq(object):
             print("warning: TrignoDaq command failed: {}".format(s))
 
 
-class TrignoEMG(_BaseTrignoDaq):
+def _emg_scaler(units):
+    """Multiplicative factor that converts EMG volts to ``units``."""
+    if units == 'mV':
+        return 1000.
+    elif units == 'normalized':
+        # max range of EMG data is 11 mV
+        return 1 / 0.011
+    return 1.
+
+
+class _TrignoEMGChannels(object):
+    """
+    Channel selection and decoding of Trigno EMG frames, shared by
+    ``TrignoEMG`` and ``pytrigno_async.AsyncTrignoEMG``.
+
+    Subclasses set ``total_channels`` and ``scaler`` and call
+    ``set_channel_range`` or ``set_active_channels``.
+    """
+
+    def set_channel_range(self, channel_range):
+        """
+        Sets the number of channels to read from the device.
+
+        Parameters
+        ----------
+        channel_range : tuple
+            Sensor channels to use (lowchan, highchan).
+        """
+        # Validate the channel range
+        if not isinstance(channel_range, tuple) or len(channel_range) != 2:
+            raise ValueError("Channel range must be a tuple of two integers.")
+
+        if not all(isinstance(ch, int) for ch in channel_range):
+            raise ValueError("Channel range values must be integers.")
+
+        self.channel_range = channel_range
+        self.active_channels = list(range(channel_range[0], channel_range[1] + 1))
+        self.num_channels = channel_range[1] - channel_range[0] + 1
+        self._update_channel_mask()
+
+    def set_active_channels(self, active_channels):
+        """
+        Sets the active channels to read from the device.
+
+        Parameters
+        ----------
+        active_channels : list of int
+            List of active channels(sensors) to read from.
+        """
+        # Validate active channels
+        if not isinstance(active_channels, list) or not active_channels:
+            raise ValueError("Active channels must be a non-empty list of integers.")
+
+        if not all(isinstance(ch, int) for ch in active_channels):
+            raise ValueError("Active channels must only contain integers.")
+        
+        self.active_channels = [ch - 1 for ch in active_channels]
+        self.num_channels = len(active_channels)
+        self._update_channel_mask()
+
+    def _update_channel_mask(self):
+        """
+        Build the decode plan for the active channels.
+
+        ``channel_mask`` marks the columns of a wire frame that are kept. When
+        the active channels are evenly spaced they are decoded through a
+        single strided slice, otherwise one strided column view per channel.
+        """
+        channels = self.active_channels
+        if not all(0 <= ch < self.total_channels for ch in channels):
+            raise ValueError("Active channels must be within 1 and {}.".format(self.total_channels))
+
+        self.channel_mask = numpy.zeros(self.total_channels, dtype=bool)
+        self.channel_mask[channels] = True
+
+        self._channel_slice = None
+        step = channels[1] - channels[0] if len(channels) > 1 else 1
+        if step > 0 and channels == list(range(channels[0], channels[-1] + 1, step)):
+            self._channel_slice = slice(channels[0], channels[-1] + 1, step)
+
+    def get_active_channels(self):
+        """
+        Get the list of active channels currently set.
+
+        Returns
+        -------
+        active_channels : list of int
+            List of active channel indices currently set.
+        """
+        return self.active_channels
+
+    def _decode(self, frames, out=None):
+        """
+        Scale the active channels of wire frames into a (num_channels,
+        num_samples) array, allocating it if ``out`` is None.
+        """
+        if out is None:
+            out = numpy.empty((self.num_channels, frames.shape[0]))
+
+        # Decode only the active channels, scaling them in the same write
+        if self._channel_slice is not None:
+            numpy.multiply(frames[:, self._channel_slice].T, self.scaler, out=out)
+        else:
+            for row, channel in enumerate(self.active_channels):
+                numpy.multiply(frames[:, channel], self.scaler, out=out[row])
+        return out
+
+
+class TrignoEMG(_TrignoEMGChannels, _BaseTrignoDaq):
     """
     Delsys Trigno wireless EMG system EMG data.
 
@@ -231,23 +366,53 @@ class TrignoEMG(_BaseTrignoDaq):
 
         self.rate = 2000
 
-        self.scaler = 1.
-        if units == 'mV':
-            self.scaler = 1000.
-        elif units == 'normalized':
-            # max range of EMG data is 11 mV
-            self.scaler = 1 / 0.011
+        self.scaler = _emg_scaler(units)
+
+    def read(self, out=None):
+        """
+        Request a sample of data from the device.
+
+        This is a blocking method, meaning it returns only once the requested
+        number of samples are available.
+
+        Parameters
+        ----------
+        out : ndarray, shape=(num_channels, samples_per_read), optional
+            Array to write the scaled data into, so that no memory is
+            allocated per block.
+
+        Returns
+        -------
+        data : ndarray, shape=(num_channels, num_samples)
+            Data read from the device. Each channel is a row and each column
+            is a point in time.
+        """
+        # Frames as they arrived on the wire, shape (samples_per_read, total_channels)
+        frames = self._recv_frames(self.samples_per_read)
+        return self._decode(frames, out)
+ 
+
+class _TrignoAccelChannels(object):
+    """
+    Sensor selection and decoding of Trigno accelerometer frames, shared by
+    ``TrignoAccel`` and ``pytrigno_async.AsyncTrignoAccel``.
+
+    An accelerometer frame has ``AXES`` channels (x, y, z) for each of the 16
+    sensors, ordered sensor by sensor.
+    """
+
+    AXES = 3
 
     def set_channel_range(self, channel_range):
         """
-        Sets the number of channels to read from the device.
+        Sets the sensors to read from the device.
 
         Parameters
         ----------
         channel_range : tuple
-            Sensor channels to use (lowchan, highchan).
+            Sensors to use (lowchan, highchan), counted from 0 like
+            ``TrignoEMG.set_channel_range``.
         """
-        # Validate the channel range
         if not isinstance(channel_range, tuple) or len(channel_range) != 2:
             raise ValueError("Channel range must be a tuple of two integers.")
 
@@ -255,61 +420,60 @@ class TrignoEMG(_BaseTrignoDaq):
             raise ValueError("Channel range values must be integers.")
 
         self.channel_range = channel_range
-        self.active_channels = list(range(channel_range[0], channel_range[1] + 1))
-        self.num_channels = channel_range[1] - channel_range[0] + 1
+        self.active_sensors = list(range(channel_range[0], channel_range[1] + 1))
+        self._update_sensor_plan()
 
     def set_active_channels(self, active_channels):
         """
-        Sets the active channels to read from the device.
+        Sets the sensors to read from the device.
 
         Parameters
         ----------
         active_channels : list of int
-            List of active channels(sensors) to read from.
+            List of active sensors, counted from 1 like
+            ``TrignoEMG.set_active_channels``.
         """
-        # Validate active channels
         if not isinstance(active_channels, list) or not active_channels:
             raise ValueError("Active channels must be a non-empty list of integers.")
 
         if not all(isinstance(ch, int) for ch in active_channels):
             raise ValueError("Active channels must only contain integers.")
-        
-        self.active_channels = [ch - 1 for ch in active_channels]
-        self.num_channels = len(active_channels)
 
-    def read(self):
-        """
-        Request a sample of data from the device.
+        self.active_sensors = [ch - 1 for ch in active_channels]
+        self._update_sensor_plan()
 
-        This is a blocking method, meaning it returns only once the requested
-        number of samples are available.
+    def _update_sensor_plan(self):
+        sensors = self.active_sensors
+        total_sensors = self.total_channels // self.AXES
+        if not all(0 <= s < total_sensors for s in sensors):
+            raise ValueError("Active sensors must be within 1 and {}.".format(total_sensors))
 
-        Returns
-        -------
-        data : ndarray, shape=(num_channels, num_samples)
-            Data read from the device. Each channel is a row and each column
-            is a point in time.
+        self.num_sensors = len(sensors)
+        self.num_channels = self.num_sensors * self.AXES
+
+        # A contiguous range of sensors is decoded through a view
+        self._sensor_slice = None
+        if sensors == list(range(sensors[0], sensors[-1] + 1)):
+            self._sensor_slice = slice(sensors[0], sensors[-1] + 1)
+
+    def _decode(self, frames, out=None):
         """
-        # Read full data from device
-        data = super(TrignoEMG, self).read(self.samples_per_read)
-        # Select only active channels
-        active_data = data[self.active_channels, :]
-        # Scale data if necessary
-        return self.scaler * active_data
-    
-    def get_active_channels(self):
+        Split wire frames into per-sensor x/y/z rows, shape (num_sensors, 3,
+        num_samples), allocating the array if ``out`` is None.
         """
-        Get the list of active channels currently set.
+        if out is None:
+            out = numpy.empty((self.num_sensors, self.AXES, frames.shape[0]))
+
+        per_sensor = frames.reshape(frames.shape[0], -1, self.AXES)
+        if self._sensor_slice is not None:
+            selected = per_sensor[:, self._sensor_slice, :]
+        else:
+            selected = per_sensor[:, self.active_sensors, :]
+        numpy.copyto(out, selected.transpose(1, 2, 0))
+        return out
 
-        Returns
-        -------
-        active_channels : list of int
-            List of active channel indices currently set.
-        """
-        return self.active_channels
- 
 
-class TrignoAccel(_BaseTrignoDaq):
+class TrignoAccel(_TrignoAccelChannels, _BaseTrignoDaq):
     """
     Delsys Trigno wireless EMG system accelerometer data.
 
@@ -318,11 +482,13 @@ class TrignoAccel(_BaseTrignoDaq):
     Parameters
     ----------
     channel_range : tuple with 2 ints
-        Sensor channels to use, e.g. (lowchan, highchan) obtains data from
-        channels lowchan through highchan. Each sensor has three accelerometer
-        channels.
+        Sensors to use, e.g. (lowchan, highchan) obtains data from sensors
+        lowchan through highchan, counted from 0. Each sensor has three
+        accelerometer channels.
     samples_per_read : int
         Number of samples per channel to read in each read operation.
+    active_channels : list of int, optional
+        List of active sensors, counted from 1, instead of channel_range.
     host : str, optional
         IP address the TCU server is running on. By default, the device is
         assumed to be attached to the local machine.
@@ -333,43 +499,49 @@ class TrignoAccel(_BaseTrignoDaq):
         it is configurable through the TCU graphical user interface.
     timeout : float, optional
         Number of seconds before socket returns a timeout exception.
+    stop_event: threading.Event, optional for handling interrupts while running
+
+    Attributes
+    ----------
+    rate : float
+        Sampling rate in Hz.
     """
-    def __init__(self, channel_range, samples_per_read, host='localhost',
-                 cmd_port=50040, data_port=50042, timeout=10):
+    def __init__(self, channel_range=None, samples_per_read=10, active_channels=None, host='localhost',
+                 cmd_port=50040, data_port=50042, timeout=10, stop_event=None):
         super(TrignoAccel, self).__init__(
             host=host, cmd_port=cmd_port, data_port=data_port,
-            total_channels=48, timeout=timeout)
+            total_channels=48, timeout=timeout, stop_event=stop_event)
 
         self.channel_range = channel_range
         self.samples_per_read = samples_per_read
 
-        self.rate = 148.1
+        if not channel_range and not active_channels:
+            raise ValueError("Either channel_range or active_channels must be specified.")
 
-    def set_channel_range(self, channel_range):
-        """
-        Sets the number of channels to read from the device.
+        if channel_range:
+            self.set_channel_range(channel_range)
+        else:
+            self.set_active_channels(active_channels)
 
-        Parameters
-        ----------
-        channel_range : tuple
-            Sensor channels to use (lowchan, highchan).
-        """
-        self.channel_range = channel_range
-        self.num_channels = channel_range[1] - channel_range[0] + 1
+        self.rate = 148.1
 
-    def read(self):
+    def read(self, out=None):
         """
         Request a sample of data from the device.
 
         This is a blocking method, meaning it returns only once the requested
         number of samples are available.
 
+        Parameters
+        ----------
+        out : ndarray, shape=(num_sensors, 3, samples_per_read), optional
+            Array to write the data into.
+
         Returns
         -------
-        data : ndarray, shape=(num_channels, num_samples)
-            Data read from the device. Each channel is a row and each column
-            is a point in time.
+        data : ndarray, shape=(num_sensors, 3, num_samples)
+            Acceleration (g) of each sensor along x, y and z. The last axis
+            is time.
         """
-        data = super(TrignoAccel, self).read(self.samples_per_read)
-        data = data[self.channel_range[0]:self.channel_range[1]+1, :]
-        return data
\ No newline at end of file
+        frames = self._recv_frames(self.samples_per_read)
+        return self._decode(frames, out)
@@ -0,0 +1,357 @@
+"""
+asyncio client for the Delsys Trigno Control Utility (TCU).
+
+The blocking classes in pytrigno use one socket per stream with a timeout, and
+``_send_cmd`` waits on the command socket on the same thread that streams the
+data. Here all sockets are non-blocking and driven by one event loop, so EMG,
+accelerometer and command traffic can be multiplexed without a thread per
+socket:
+
+    async def main():
+        command = AsyncTrignoCommand()
+        emg = AsyncTrignoEMG(active_channels=[1, 2, 3, 4], samples_per_read=125, command=command)
+        accel = AsyncTrignoAccel(active_channels=[1, 2, 3, 4], samples_per_read=9, command=command)
+        await emg.connect()
+        await accel.connect()
+        await command.send('START')
+        async for block in emg:
+            ...
+
+The TCU starts and stops all data ports at once, so devices that share an
+``AsyncTrignoCommand`` should send START/STOP through it once.
+"""
+import abc
+import asyncio
+import socket
+import numpy
+
+from pytrigno import _BaseTrignoDaq, _TrignoEMGChannels, _TrignoAccelChannels, _emg_scaler
+
+
+class AsyncTrignoCommand(object):
+    """
+    Command connection to the TCU, which can be shared by several data streams.
+
+    Commands are serialized with a lock, so a START from one task can not read
+    the reply to a STOP from another.
+
+    Parameters
+    ----------
+    host : str, optional
+        IP address the TCU server is running on.
+    cmd_port : int, optional
+        Port of TCU command messages.
+    timeout : float, optional
+        Number of seconds to wait for the connection and for each reply.
+    """
+
+    def __init__(self, host='localhost', cmd_port=50040, timeout=10):
+        self.host = host
+        self.cmd_port = cmd_port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self):
+        """Open the command connection and consume the server's banner."""
+        if self.connected:
+            return
+        self._lock = asyncio.Lock()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.cmd_port), self.timeout)
+        # Initially reading a small packet to clear buffer
+        await asyncio.wait_for(self._reader.read(1024), self.timeout)
+
+    async def send(self, command):
+        """
+        Send a command and wait for its reply.
+
+        Returns
+        -------
+        response : bytes
+            Reply of the TCU. A warning is printed if it is not OK, like
+            ``_BaseTrignoDaq._send_cmd``.
+        """
+        async with self._lock:
+            self._writer.write(_BaseTrignoDaq._cmd(command))
+            await self._writer.drain()
+            try:
+                response = await asyncio.wait_for(self._reader.read(128), self.timeout)
+            except asyncio.TimeoutError:
+                raise IOError("No reply to command {!r}.".format(command))
+        _BaseTrignoDaq._validate(response)
+        return response
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        self._reader = self._writer = None
+
+
+class _AsyncBaseTrignoDaq(object, metaclass=abc.ABCMeta):
+    """
+    Non-blocking counterpart of ``pytrigno._BaseTrignoDaq``.
+
+    Parameters
+    ----------
+    host : str
+        IP address the TCU server is running on.
+    cmd_port : int
+        Port of TCU command messages.
+    data_port : int
+        Port of TCU data access.
+    total_channels : int
+        Total number of channels supported by the device.
+    timeout : float
+        Number of seconds to wait for a block before the device is considered
+        disconnected.
+    command : AsyncTrignoCommand, optional
+        Command connection to share with other devices. A new one is created
+        if None, and closed together with this device.
+    """
+
+    BYTES_PER_CHANNEL = _BaseTrignoDaq.BYTES_PER_CHANNEL
+
+    def __init__(self, host, cmd_port, data_port, total_channels, timeout, command=None):
+        self.host = host
+        self.cmd_port = cmd_port
+        self.data_port = data_port
+        self.total_channels = total_channels
+        self.timeout = timeout
+
+        self._own_command = command is None
+        self.command = command if command is not None else AsyncTrignoCommand(host, cmd_port, timeout)
+
+        self._min_recv_size = self.total_channels * self.BYTES_PER_CHANNEL
+        self._buffer = bytearray()
+        self._buffer_view = memoryview(self._buffer)
+        self._data_socket = None
+
+    async def connect(self):
+        """Open the command connection (if not shared and open already) and the data socket."""
+        await self.command.connect()
+
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (self.host, self.data_port)), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            sock.close()
+            print(f"Error initializing sockets: {e}")
+            raise
+        self._data_socket = sock
+
+    async def start(self):
+        """
+        Tell the device to begin streaming data. With a shared command
+        connection this starts every data port of the TCU.
+        """
+        await self.command.send('START')
+
+    async def stop(self):
+        """Tell the device to stop streaming data."""
+        await self.command.send('STOP')
+
+    async def _recv_frames(self, num_samples):
+        """
+        Fill the receive buffer with ``num_samples`` frames from the data
+        socket, yielding to the event loop while waiting.
+
+        Returns
+        -------
+        frames : ndarray, shape=(num_samples, total_channels)
+            Zero-copy little-endian float32 view of the receive buffer, which
+            is overwritten by the next read.
+        """
+        l_des = num_samples * self._min_recv_size
+        if len(self._buffer) < l_des:
+            self._buffer = bytearray(l_des)
+            self._buffer_view = memoryview(self._buffer)
+
+        loop = asyncio.get_running_loop()
+        view = self._buffer_view[:l_des]
+        l = 0
+        while l < l_des:
+            try:
+                n = await asyncio.wait_for(loop.sock_recv_into(self._data_socket, view[l:]), self.timeout)
+            except asyncio.TimeoutError:
+                raise IOError("Device disconnected.")
+            if n == 0:
+                raise IOError("Device disconnected.")
+            l += n
+
+        frames = numpy.frombuffer(self._buffer, dtype='<f4',
+                                  count=l_des // self.BYTES_PER_CHANNEL)
+        return frames.reshape(-1, self.total_channels)
+
+    @abc.abstractmethod
+    async def read_block(self, out=None):
+        """
+        Read and decode one block of ``samples_per_read`` samples.
+
+        Implemented by the subclasses, which decode the frames from
+        ``_recv_frames`` with the ``_decode`` of their channel mixin.
+        """
+
+    async def blocks(self, stop_event=None):
+        """
+        Async iterator of decoded blocks, until stop_event (threading.Event or
+        asyncio.Event) is set or the device disconnects.
+        """
+        while stop_event is None or not stop_event.is_set():
+            yield await self.read_block()
+
+    def __aiter__(self):
+        return self.blocks()
+
+    async def close(self):
+        """Close the data socket, and the command connection if it is not shared."""
+        if self._data_socket is not None:
+            self._data_socket.close()
+            self._data_socket = None
+        if self._own_command:
+            await self.command.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncTrignoEMG(_TrignoEMGChannels, _AsyncBaseTrignoDaq):
+    """
+    Delsys Trigno wireless EMG system EMG data, read with asyncio.
+
+    Channel selection and units are the same as ``pytrigno.TrignoEMG``.
+
+    Parameters
+    ----------
+    channel_range : tuple with 2 ints
+        Sensor channels to use (lowchan, highchan).
+    active_channels : list of int
+        List of active channels indices to read from.
+    samples_per_read : int
+        Number of samples per channel to read in each read operation.
+    units : {'V', 'mV', 'normalized'}, optional
+        Units in which to return data.
+    host : str, optional
+        IP address the TCU server is running on.
+    cmd_port : int, optional
+        Port of TCU command messages.
+    data_port : int, optional
+        Port of TCU EMG data access.
+    timeout : float, optional
+        Number of seconds to wait for a block.
+    command : AsyncTrignoCommand, optional
+        Command connection shared with other devices.
+    """
+
+    def __init__(self, channel_range=None, active_channels=None, samples_per_read=2000, units='V',
+                 host='localhost', cmd_port=50040, data_port=50041, timeout=10, command=None):
+        super(AsyncTrignoEMG, self).__init__(
+            host=host, cmd_port=cmd_port, data_port=data_port,
+            total_channels=16, timeout=timeout, command=command)
+
+        self.channel_range = channel_range
+        self.samples_per_read = samples_per_read
+
+        if not channel_range and not active_channels:
+            raise ValueError("Either channel_range or active_channels must be specified.")
+
+        if channel_range:
+            self.set_channel_range(channel_range)
+        elif active_channels:
+            self.set_active_channels(active_channels)
+
+        self.rate = 2000
+        self.scaler = _emg_scaler(units)
+
+    async def read_block(self, out=None):
+        """
+        Read one block from the device without blocking the event loop.
+
+        Parameters
+        ----------
+        out : ndarray, shape=(num_channels, samples_per_read), optional
+            Array to write the scaled data into.
+
+        Returns
+        -------
+        data : ndarray, shape=(num_channels, samples_per_read)
+            Data read from the device. Each channel is a row and each column
+            is a point in time.
+        """
+        frames = await self._recv_frames(self.samples_per_read)
+        return self._decode(frames, out)
+
+
+class AsyncTrignoAccel(_TrignoAccelChannels, _AsyncBaseTrignoDaq):
+    """
+    Delsys Trigno wireless EMG system accelerometer data, read with asyncio.
+
+    Sensor selection and decoding are the same as ``pytrigno.TrignoAccel``.
+
+    Parameters
+    ----------
+    channel_range : tuple with 2 ints
+        Sensors to use (lowchan, highchan), counted from 0.
+    samples_per_read : int
+        Number of samples per channel to read in each read operation.
+    active_channels : list of int, optional
+        List of active sensors, counted from 1, instead of channel_range.
+    host : str, optional
+        IP address the TCU server is running on.
+    cmd_port : int, optional
+        Port of TCU command messages.
+    data_port : int, optional
+        Port of TCU accelerometer data access.
+    timeout : float, optional
+        Number of seconds to wait for a block.
+    command : AsyncTrignoCommand, optional
+        Command connection shared with other devices.
+    """
+
+    def __init__(self, channel_range=None, samples_per_read=10, active_channels=None, host='localhost',
+                 cmd_port=50040, data_port=50042, timeout=10, command=None):
+        super(AsyncTrignoAccel, self).__init__(
+            host=host, cmd_port=cmd_port, data_port=data_port,
+            total_channels=48, timeout=timeout, command=command)
+
+        self.channel_range = channel_range
+        self.samples_per_read = samples_per_read
+
+        if not channel_range and not active_channels:
+            raise ValueError("Either channel_range or active_channels must be specified.")
+
+        if channel_range:
+            self.set_channel_range(channel_range)
+        else:
+            self.set_active_channels(active_channels)
+
+        self.rate = 148.1
+
+    async def read_block(self, out=None):
+        """
+        Read one block from the device without blocking the event loop.
+
+        Returns
+        -------
+        data : ndarray, shape=(num_sensors, 3, samples_per_read)
+            Acceleration (g) of each sensor along x, y and z. The last axis
+            is time.
+        """
+        frames = await self._recv_frames(self.samples_per_read)
+        return self._decode(frames, out)
@@ -0,0 +1,225 @@
+"""
+Binary session recordings: raw TrignoEMG blocks, preprocessed blocks and setpoints, appended as float32 while the
+control loop runs, and opened later with np.memmap without reading or parsing the data.
+
+A session is a directory:
+    header.json       Streams with their channel count and rate, config snapshot, start time
+    <stream>.f32      Samples in time order, float32, one row of num_channels values per sample (like the TCU frames)
+    <stream>.idx      One int64 pair per written block: sample number of its first sample, byte offset in .f32
+
+Both data files are only appended to, so a recording cut short by a crash can still be read up to the last
+complete block.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+import config
+
+HEADER_FILE = 'header.json'
+FORMAT_VERSION = 1
+_STOP = object()
+
+
+def config_snapshot(module=config):
+    """
+    The upper case values of the config module that can be stored as JSON.
+    """
+    snapshot = {}
+    for key, value in vars(module).items():
+        if key.isupper():
+            try:
+                json.dumps(value)
+            except TypeError:
+                value = repr(value)
+            snapshot[key] = value
+    return snapshot
+
+
+class SessionRecorder:
+    """
+    Records blocks of several streams to a session directory. write() only copies the block to float32 and queues
+    it, the files are written on a background thread.
+
+    Parameters:
+    - path: Session directory. Created if needed, and must not already hold a recording.
+    - streams: Dict of stream name to (num_channels, rate), e.g. {'raw': (2, 2000)}.
+    - metadata: Optional dict stored in the header, e.g. the subject or the task.
+    """
+    def __init__(self, path, streams, metadata=None):
+        if os.path.exists(os.path.join(path, HEADER_FILE)):
+            raise ValueError("There is already a recording in {}.".format(path))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.streams = {name: {'channels': int(channels), 'rate': float(rate)}
+                        for name, (channels, rate) in streams.items()}
+        self.samples = {name: 0 for name in self.streams}
+        self._files = {}
+        for name in self.streams:
+            self._files[name] = (open(os.path.join(path, name + '.f32'), 'ab'),
+                                 open(os.path.join(path, name + '.idx'), 'ab'))
+
+        self.header = {
+            'version': FORMAT_VERSION,
+            'dtype': '<f4',
+            'start_time': time.time(),
+            'streams': self.streams,
+            'config': config_snapshot(),
+            'metadata': metadata or {},
+        }
+        self._write_header()
+
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+
+    def _write_header(self):
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as f:
+            json.dump(self.header, f, indent=2)
+
+    def write(self, stream, block):
+        """
+        Queues a block of shape (num_channels, samples) of stream for writing. A 1-D array is one sample.
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(-1, 1)
+        if block.shape[0] != self.streams[stream]['channels']:
+            raise ValueError("Stream '{}' has {} channels, got a block with {}.".format(
+                stream, self.streams[stream]['channels'], block.shape[0]))
+        # Sample-major float32 copy, the caller may reuse its array for the next block
+        self._queue.put((stream, np.ascontiguousarray(block.T, dtype='<f4')))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            stream, frames = item
+            data_file, index_file = self._files[stream]
+            try:
+                index_file.write(np.array([self.samples[stream], data_file.tell()], dtype='<i8').tobytes())
+                data_file.write(frames.tobytes())
+            except OSError as e:
+                print("Error writing recording:", e)
+                self.error = e
+                continue
+            self.samples[stream] += frames.shape[0]
+            if self._queue.empty():
+                for data_file, index_file in self._files.values():
+                    data_file.flush()
+                    index_file.flush()
+
+    def close(self, timeout=None):
+        """
+        Writes the queued blocks, closes the files and stores the sample counts in the header.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        for data_file, index_file in self._files.values():
+            data_file.close()
+            index_file.close()
+        self.header['end_time'] = time.time()
+        self.header['samples'] = dict(self.samples)
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SessionReader:
+    """
+    Opens a session directory written by SessionRecorder. The data is memory-mapped, so opening is instant and
+    only the samples that are used are read from disk.
+
+    Parameters:
+    - path: Session directory.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        self.streams = self.header['streams']
+        self.config = self.header['config']
+        self._frames = {}
+        self._index = {}
+
+    def rate(self, stream):
+        return self.streams[stream]['rate']
+
+    def channels(self, stream):
+        return self.streams[stream]['channels']
+
+    def frames(self, stream):
+        """
+        Read-only memmap of shape (samples, num_channels). The sample count comes from the file size, so a block
+        that was being written when the recording stopped is left out.
+        """
+        if stream not in self._frames:
+            filename = os.path.join(self.path, stream + '.f32')
+            channels = self.channels(stream)
+            samples = os.path.getsize(filename) // (4 * channels)
+            if samples == 0:
+                self._frames[stream] = np.empty((0, channels), dtype='<f4')
+            else:
+                self._frames[stream] = np.memmap(filename, dtype='<f4', mode='r', shape=(samples, channels))
+        return self._frames[stream]
+
+    def data(self, stream):
+        """
+        Zero-copy view of shape (num_channels, samples), the layout used everywhere else in the project.
+        """
+        return self.frames(stream).T
+
+    def index(self, stream):
+        """
+        Array of shape (blocks, 2) with the sample number and byte offset of the start of each block.
+        """
+        if stream not in self._index:
+            filename = os.path.join(self.path, stream + '.idx')
+            blocks = os.path.getsize(filename) // 16
+            if blocks == 0:
+                self._index[stream] = np.empty((0, 2), dtype='<i8')
+            else:
+                self._index[stream] = np.memmap(filename, dtype='<i8', mode='r', shape=(blocks, 2))
+        return self._index[stream]
+
+    def num_blocks(self, stream):
+        return self.index(stream).shape[0]
+
+    def block(self, stream, i):
+        """
+        View of block number i of stream, shape (num_channels, samples), as it was given to SessionRecorder.write.
+        """
+        index = self.index(stream)
+        start = int(index[i, 0])
+        end = int(index[i + 1, 0]) if i + 1 < index.shape[0] else self.frames(stream).shape[0]
+        return self.data(stream)[:, start:end]
+
+    def blocks(self, stream):
+        """
+        Iterates over the blocks of stream in the order they were recorded.
+        """
+        for i in range(self.num_blocks(stream)):
+            yield self.block(stream, i)
+
+    def block_at(self, stream, sample):
+        """
+        Number of the block that holds sample number sample.
+        """
+        return int(np.searchsorted(self.index(stream)[:, 0], sample, side='right')) - 1
+
+    def samples(self, stream, start, stop):
+        """
+        View of samples start to stop of stream, shape (num_channels, stop - start).
+        """
+        return self.data(stream)[:, start:stop]
@@ -0,0 +1,173 @@
+"""
+Runs recorded raw EMG through the same processing as the live control loop in main3:
+preprocess_raw_data_directly -> myoprocessor_controll_directly -> prosthesis_signals, one block at a time and with
+the filter and ThreadSafeState states carried from block to block. The chain is built from config like main3 does,
+so EXACT_RESAMPLING adds the resampler, and CONFIG_WATCH runs the blocks through a CompiledPipeline compiled from
+config (the file is not watched during a replay). Files are processed in parallel in a process pool, as fast as
+the CPU allows instead of in real time.
+
+Recordings can be session directories from recorder.SessionRecorder (the recorded raw blocks are replayed as they
+were read) or CSV exports like test_data/raw_data_cocontraction.csv. The CSV exports count time in samples, so
+their rate is given with --rate (the Trigno rate by default), and they are cut into blocks of the same duration as
+the blocks main3 reads. Both hold the raw data after RAW_SIGNAL_GAIN, as returned by emg_in.read_raw_data.
+
+Example:
+    python replay.py test_data/raw_data_cocontraction.csv test_data/emg_raw1.csv --setpoints-dir replay_out
+
+Use `-h` or `--help` for options.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import config
+from classes import ThreadSafeQueue, ThreadSafeState
+from compiled_pipeline import CompiledPipeline
+from emg_signal_processing import emg_preprocessing, myoprocessor, to_prosthesis
+from mc_hand_startup.load_data import load_csv
+from recorder import HEADER_FILE, SessionReader
+
+TRIGNO_EMG_RATE = 2000
+# main3 reads config.SENSOR_FREQ samples per block from the Trigno, so a block lasts this long
+BLOCK_SECONDS = config.SENSOR_FREQ / TRIGNO_EMG_RATE
+SATURATION = 5  # prosthesis_signals saturates the setpoints at +-5
+
+
+def raw_blocks(path, channels=None, rate=None):
+    """
+    The raw blocks of a recording, shape (channels, samples), in the order they were recorded.
+
+    Parameters:
+    - path: Session directory or CSV file.
+    - channels: Channels to use, counted from 1. Defaults to the first len(config.ACTIVE_CHANNELS).
+    - rate: Sampling rate of a CSV file in Hz. Defaults to TRIGNO_EMG_RATE. The block size follows from it, so the
+      blocks last BLOCK_SECONDS. Session directories store their rate and blocks.
+
+    Returns:
+    - blocks: Generator of the blocks.
+    - rate: Sampling rate of the recording in Hz.
+    """
+    if channels is None:
+        channels = list(range(1, len(config.ACTIVE_CHANNELS) + 1))
+    rows = [ch - 1 for ch in channels]
+
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, HEADER_FILE)):
+        reader = SessionReader(path)
+        return (block[rows] for block in reader.blocks('raw')), reader.rate('raw')
+
+    rate = TRIGNO_EMG_RATE if rate is None else rate
+    signals = np.nan_to_num(load_csv(path).signals[rows])
+    block_size = max(int(round(rate * BLOCK_SECONDS)), 1)
+    num_blocks = signals.shape[1] // block_size
+    return (signals[:, i * block_size:(i + 1) * block_size] for i in range(num_blocks)), rate
+
+
+def replay_file(path, channels=None, setpoints_dir=None, rate=None):
+    """
+    Replays one recording through the control loop.
+
+    Returns:
+    - Dict of summary metrics: blocks, duration, number of hand/wrist switches, time in hand and wrist control,
+      ratio of setpoint samples at saturation and how much faster than real time the replay ran.
+    """
+    start = time.perf_counter()
+    blocks, rate = raw_blocks(path, channels, rate)
+
+    # Fresh states for every file, like a new run of main3
+    num_channels = len(channels) if channels is not None else len(config.ACTIVE_CHANNELS)
+    preprocessed_emg_queue = ThreadSafeQueue(window_size=1)
+    hand_or_wrist = ThreadSafeState()
+    cocontraction = ThreadSafeState()
+    compiled = None
+    if config.CONFIG_WATCH:
+        compiled = CompiledPipeline(num_channels, hand_or_wrist, cocontraction, raw_rate=rate)
+    else:
+        envelope_filter, emg_resampler = emg_preprocessing.make_envelope_chain(num_channels, rate)
+
+    setpoints = []
+    wrist_states = []
+    raw_samples = 0
+    num_blocks = 0
+    for raw_data in blocks:
+        num_blocks += 1
+        raw_samples += raw_data.shape[1]
+        if compiled is not None:
+            _, block_setpoints, wrist_control = compiled.process(raw_data, return_states=True)
+            setpoints.append(block_setpoints)
+            wrist_states.append(wrist_control)
+            continue
+        preprocessed_data = emg_preprocessing.preprocess_raw_data_directly(raw_data, preprocessed_emg_queue, envelope_filter=envelope_filter, resampler=emg_resampler)
+        hand_controll, wrist_controll, wrist_control = myoprocessor.myoprocessor_controll_directly(
+            preprocessed_data, hand_or_wrist, cocontraction, return_states=True)
+        setpoints.append(to_prosthesis.prosthesis_signals(hand_controll, wrist_controll))
+        wrist_states.append(wrist_control)
+
+    setpoints = np.concatenate(setpoints, axis=1) if setpoints else np.zeros((2, 0))
+    wrist_states = np.concatenate(wrist_states) if wrist_states else np.zeros(0, dtype=bool)
+    elapsed = time.perf_counter() - start
+
+    if setpoints_dir is not None:
+        os.makedirs(setpoints_dir, exist_ok=True)
+        name = os.path.basename(os.path.normpath(path))
+        np.save(os.path.join(setpoints_dir, name + '.setpoints.npy'), setpoints)
+
+    # The processed rate is set by the downsampling of each block, so the time in each state is taken as a share of
+    # the recording time
+    duration = raw_samples / rate
+    wrist_share = float(np.mean(wrist_states)) if wrist_states.size else 0.0
+    initial = np.concatenate(([False], wrist_states[:-1]))  # Hand control at the start
+    return {
+        'file': path,
+        'blocks': num_blocks,
+        'duration_s': duration,
+        'switches': int(np.count_nonzero(wrist_states != initial)),
+        'time_hand_s': duration * (1 - wrist_share) if wrist_states.size else 0.0,
+        'time_wrist_s': duration * wrist_share,
+        'saturation_ratio': float(np.mean(np.any(np.abs(setpoints) >= SATURATION, axis=0))) if setpoints.size else 0.0,
+        'processing_time_s': elapsed,
+        'realtime_factor': duration / elapsed if elapsed > 0 else None,
+    }
+
+
+def replay(paths, channels=None, setpoints_dir=None, workers=None, rate=None):
+    """
+    Replays many recordings in a process pool. Returns the summary of each file, in the order of paths.
+    """
+    if workers == 1 or len(paths) == 1:
+        return [replay_file(path, channels, setpoints_dir, rate) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(replay_file, path, channels, setpoints_dir, rate) for path in paths]
+        return [future.result() for future in futures]
+
+
+def format_summary(results):
+    lines = ["{:<40}{:>8}{:>10}{:>10}{:>10}{:>10}{:>11}{:>12}".format(
+        'file', 'blocks', 'time [s]', 'switches', 'hand [s]', 'wrist [s]', 'saturated', 'x realtime')]
+    for r in results:
+        lines.append("{:<40}{:>8}{:>10.1f}{:>10}{:>10.1f}{:>10.1f}{:>11.3f}{:>12.0f}".format(
+            os.path.basename(os.path.normpath(r['file']))[:39], r['blocks'], r['duration_s'], r['switches'],
+            r['time_hand_s'], r['time_wrist_s'], r['saturation_ratio'], r['realtime_factor'] or 0))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="Session directories or CSV files with raw EMG.")
+    parser.add_argument('--channels', nargs='+', type=int, default=None,
+                        help="Channels of the recordings to use, counted from 1. Default is the first len(ACTIVE_CHANNELS).")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Sampling rate of the CSV files in Hz. Default is the Trigno rate, {} Hz.".format(TRIGNO_EMG_RATE))
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes. Default is one per CPU.")
+    parser.add_argument('--setpoints-dir', default=None, help="Save the setpoints of each file here as .npy.")
+    parser.add_argument('--output', default=None, help="Write the summary metrics to this JSON file.")
+    args = parser.parse_args()
+
+    results = replay(args.paths, channels=args.channels, setpoints_dir=args.setpoints_dir, workers=args.workers, rate=args.rate)
+    print(format_summary(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
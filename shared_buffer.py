@@ -0,0 +1,197 @@
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+# Layout of the header at the start of the shared memory block, as int64 values
+_WRITE_SEQ = 0      # Total number of samples written
+_SEQLOCK = 1        # Odd while the writer is writing, even otherwise
+_NUM_CHANNELS = 2
+_CAPACITY = 3
+_DTYPE = 4          # Type character of the data, e.g. ord('d') for float64
+_HEADER_SIZE = 8
+
+
+def _attach_shared_memory(name):
+    try:
+        # Python 3.13+, don't let the resource tracker of this process unlink memory it does not own
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Older Pythons always track it. Processes started by multiprocessing share the tracker of the creator,
+        # so the memory is still only unlinked once.
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedRingBuffer:
+    """
+    Ring buffer of shape (num_channels, capacity) in shared memory, so that one process can write the EMG stream and
+    other processes (plotting, logging, control) can read it without any pickling or Manager proxies.
+
+    The buffer has one writer. Readers attach by name and copy out the samples written since their last read. A
+    seqlock makes the copy consistent: the writer makes the seqlock counter odd while it writes, and a reader retries
+    if the counter was odd or changed while it copied.
+
+    Parameters:
+    - num_channels: Number of channels (rows).
+    - capacity: Number of samples kept per channel.
+    - dtype: Data type of the samples.
+    - name: Name of the shared memory block. A unique name is generated if None.
+    """
+    def __init__(self, num_channels, capacity, dtype=np.float64, name=None):
+        dtype = np.dtype(dtype)
+        size = _HEADER_SIZE * 8 + num_channels * capacity * dtype.itemsize
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._owner = True
+        self._setup(num_channels, capacity, dtype)
+        self._header[:] = 0
+        self._header[_NUM_CHANNELS] = num_channels
+        self._header[_CAPACITY] = capacity
+        self._header[_DTYPE] = ord(dtype.char)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a buffer created by another process, by the name of its shared memory block.
+        """
+        self = cls.__new__(cls)
+        self._shm = _attach_shared_memory(name)
+        self._owner = False
+        header = np.ndarray((_HEADER_SIZE,), dtype=np.int64, buffer=self._shm.buf)
+        self._setup(int(header[_NUM_CHANNELS]), int(header[_CAPACITY]), np.dtype(chr(header[_DTYPE])))
+        return self
+
+    def _setup(self, num_channels, capacity, dtype):
+        self.num_channels = num_channels
+        self.capacity = capacity
+        self.dtype = dtype
+        self._header = np.ndarray((_HEADER_SIZE,), dtype=np.int64, buffer=self._shm.buf)
+        self.buffer = np.ndarray((num_channels, capacity), dtype=dtype, buffer=self._shm.buf, offset=_HEADER_SIZE * 8)
+        self._closed = False
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def write_seq(self):
+        return int(self._header[_WRITE_SEQ])
+
+    def write(self, block):
+        """
+        Appends a block of shape (num_channels, samples). A 1-D array is one sample of every channel.
+        Only one process may write to the buffer.
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(self.num_channels, 1)
+        n = block.shape[1]
+        kept = block[:, -self.capacity:] if n > self.capacity else block
+        write_seq = int(self._header[_WRITE_SEQ])
+
+        self._header[_SEQLOCK] += 1
+        start = (write_seq + n - kept.shape[1]) % self.capacity
+        first = min(kept.shape[1], self.capacity - start)
+        self.buffer[:, start:start + first] = kept[:, :first]
+        self.buffer[:, :kept.shape[1] - first] = kept[:, first:]
+        self._header[_WRITE_SEQ] = write_seq + n
+        self._header[_SEQLOCK] += 1
+
+    def _copy(self, start_seq, end_seq, out):
+        start = start_seq % self.capacity
+        n = end_seq - start_seq
+        first = min(n, self.capacity - start)
+        out[:, :first] = self.buffer[:, start:start + first]
+        out[:, first:n] = self.buffer[:, :n - first]
+
+    def read_since(self, seq, max_samples=None, retries=100):
+        """
+        Returns a consistent copy of the samples written since sequence number seq.
+
+        Parameters:
+        - seq: Sequence number of the first sample wanted.
+        - max_samples: Optional limit on the number of samples returned.
+        - retries: How many times to retry the copy if the writer was writing at the same time.
+
+        Returns:
+        - block: Array of shape (num_channels, end_seq - start_seq).
+        - start_seq: Sequence number of the first returned sample. Larger than seq if samples were overwritten.
+        - end_seq: Sequence number after the last returned sample, the seq to pass in the next call.
+        """
+        for _ in range(retries):
+            lock = int(self._header[_SEQLOCK])
+            if lock % 2:
+                time.sleep(0)
+                continue
+            end_seq = int(self._header[_WRITE_SEQ])
+            start_seq = max(seq, end_seq - self.capacity, 0)
+            if max_samples is not None:
+                end_seq = min(end_seq, start_seq + max_samples)
+            block = np.empty((self.num_channels, end_seq - start_seq), dtype=self.dtype)
+            self._copy(start_seq, end_seq, block)
+            if int(self._header[_SEQLOCK]) == lock:
+                return block, start_seq, end_seq
+        raise TimeoutError("Could not get a consistent read of the shared ring buffer.")
+
+    def latest(self, num_samples):
+        """
+        Returns a copy of the last num_samples samples in time order, zero padded at the start if fewer are written.
+        """
+        out = np.zeros((self.num_channels, num_samples), dtype=self.dtype)
+        block, start_seq, end_seq = self.read_since(self.write_seq - min(num_samples, self.capacity))
+        out[:, num_samples - block.shape[1]:] = block
+        return out
+
+    def wait(self, seq, timeout=None, poll_interval=0.001):
+        """
+        Polls until a sample with sequence number seq or later is written, or the timeout runs out.
+        Returns the current write sequence number.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_seq <= seq and (deadline is None or time.monotonic() < deadline):
+            time.sleep(poll_interval)
+        return self.write_seq
+
+    def cursor(self, from_start=False):
+        """
+        Creates a read cursor for a new consumer, see classes.RingBufferCursor.
+        """
+        from classes import RingBufferCursor
+        return RingBufferCursor(self, 0 if from_start else self.write_seq)
+
+    def close(self):
+        """
+        Detach from the shared memory. The process that created the buffer also frees it.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        # The arrays must be released before the memory can be closed
+        del self._header, self.buffer
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def cleanup_on(self, stop_event, writers=()):
+        """
+        Close the buffer when stop_event (threading or multiprocessing Event) is set and the writers have finished.
+        Closing unmaps the memory, so a write after it would crash the process: every thread (or process) that
+        writes to the buffer should be in writers, and is joined before the buffer is closed.
+        Returns the daemon thread that waits for the event.
+        """
+        def wait_and_close():
+            stop_event.wait()
+            for writer in writers:
+                writer.join()
+            self.close()
+        thread = threading.Thread(target=wait_and_close, daemon=True)
+        thread.start()
+        return thread
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
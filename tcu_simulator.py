@@ -0,0 +1,332 @@
+"""
+Local stand-in for the Delsys Trigno Control Utility (TCU), so the acquisition and control pipeline can be run and
+load-tested without the hardware.
+
+The simulator accepts connections on the command port, sends the TCU banner and answers START/STOP (terminated by
+\\r\\n\\r\\n) with OK. While started it streams little-endian float32 frames of 16 channels on the EMG data port,
+taken from test_data/*.csv recordings or from a synthetic source.
+
+Pacing can be real-time, N x real-time or as fast as possible. The real TCU delivers the data at an "iffy rate"
+(see the Trigno.read docstring in main.py): packets of about 26 samples, and clumps of 80-107 samples at irregular
+intervals. --burst-interval and --burst-jitter reproduce that by holding the samples back and sending them in bursts.
+
+Examples:
+    python tcu_simulator.py --csv test_data/raw_data_cocontraction.csv
+    python tcu_simulator.py --synthetic sine --speed 0 --benchmark 200
+
+Use `-h` or `--help` for options.
+"""
+
+import argparse
+import random
+import socket
+import threading
+import time
+import numpy as np
+import config
+from mc_hand_startup.load_data import load_csv
+
+TOTAL_CHANNELS = 16
+BANNER = b'Delsys Trigno System Digital Protocol Version 3.6.0 \r\n\r\n'
+CMD_TERM = b'\r\n\r\n'
+
+
+def load_csv_signals(path):
+    """
+    Reads the signal columns of a recording in test_data, see mc_hand_startup.load_data.load_csv.
+
+    Returns:
+    - Array of shape (channels, samples) with one row for each signal column. Missing values are zero.
+    """
+    return np.nan_to_num(load_csv(path).signals)
+
+
+class CsvSource:
+    """
+    Plays back recordings in a loop. The recorded channels fill the first sensor slots, the rest are zero.
+
+    Parameters:
+    - paths: List of CSV files, played one after the other.
+    - scale: Factor applied to the recorded values, e.g. 1/RAW_SIGNAL_GAIN to get back to volts.
+    """
+    def __init__(self, paths, scale=1.0):
+        recordings = [load_csv_signals(path) * scale for path in paths]
+        num_channels = max(r.shape[0] for r in recordings)
+        if num_channels > TOTAL_CHANNELS:
+            raise ValueError("Recordings have more than {} channels.".format(TOTAL_CHANNELS))
+        # Frames as they go on the wire, shape (samples, 16)
+        self.frames = np.zeros((sum(r.shape[1] for r in recordings), TOTAL_CHANNELS), dtype='<f4')
+        start = 0
+        for r in recordings:
+            self.frames[start:start + r.shape[1], :r.shape[0]] = r.T
+            start += r.shape[1]
+        self._position = 0
+
+    def next_frames(self, n):
+        idx = (self._position + np.arange(n)) % self.frames.shape[0]
+        self._position = (self._position + n) % self.frames.shape[0]
+        return self.frames[idx]
+
+
+class SyntheticSource:
+    """
+    Generated signals on every channel.
+
+    Parameters:
+    - kind: 'noise' (Gaussian noise with slow bursts of activity, roughly like EMG), 'sine' (a different frequency on
+      each channel) or 'ramp' (the sample counter, handy for checking that no samples are lost).
+    - amplitude: Peak amplitude in volts.
+    - rate: Sampling rate in Hz.
+    - seed: Seed of the random generator.
+    """
+    def __init__(self, kind='noise', amplitude=0.001, rate=2000, seed=0):
+        if kind not in ('noise', 'sine', 'ramp'):
+            raise ValueError("Invalid synthetic source. Should be 'noise', 'sine' or 'ramp'.")
+        self.kind = kind
+        self.amplitude = amplitude
+        self.rate = rate
+        self._rng = np.random.default_rng(seed)
+        self._position = 0
+
+    def next_frames(self, n):
+        t = (self._position + np.arange(n)) / self.rate
+        channels = np.arange(TOTAL_CHANNELS)
+        if self.kind == 'ramp':
+            frames = np.repeat((self._position + np.arange(n))[:, None], TOTAL_CHANNELS, axis=1)
+        elif self.kind == 'sine':
+            frames = self.amplitude * np.sin(2 * np.pi * (1 + channels) * t[:, None])
+        else:
+            activity = 0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * t[:, None] + channels)
+            frames = self.amplitude * activity * self._rng.standard_normal((n, TOTAL_CHANNELS))
+        self._position += n
+        return frames.astype('<f4')
+
+
+class TCUSimulator:
+    """
+    TCP server speaking the TCU command protocol and streaming EMG frames to every connected data client.
+
+    Parameters:
+    - source: CsvSource or SyntheticSource.
+    - host: Address to listen on.
+    - cmd_port: Command port.
+    - data_port: EMG data port.
+    - rate: Sampling rate in Hz.
+    - speed: Pacing relative to real time, e.g. 1 for real time, 10 for 10 x real time. 0 sends as fast as possible.
+    - packet_samples: Samples per packet sent on the data socket.
+    - burst_interval: If set, samples are held back and sent in bursts about this many seconds apart.
+    - burst_jitter: Relative random variation of the burst interval, between 0 and 1.
+    - seed: Seed of the burst timing.
+    """
+    def __init__(self, source, host='localhost', cmd_port=config.COMMAND_PORT, data_port=config.EMG_PORT, rate=2000,
+                 speed=1.0, packet_samples=26, burst_interval=None, burst_jitter=0.0, seed=0):
+        self.source = source
+        self.host = host
+        self.cmd_port = cmd_port
+        self.data_port = data_port
+        self.rate = rate
+        self.speed = speed
+        self.packet_samples = packet_samples
+        self.burst_interval = burst_interval
+        self.burst_jitter = burst_jitter
+        self.samples_sent = 0
+
+        self.streaming = threading.Event()
+        self.stop_event = threading.Event()
+        self._random = random.Random(seed)
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._threads = []
+        self._servers = []
+
+    def start(self):
+        """
+        Opens the ports and starts serving on daemon threads.
+        """
+        cmd_server = self._listen(self.cmd_port)
+        data_server = self._listen(self.data_port)
+        for target, args in ((self._accept, (cmd_server, self._serve_commands)),
+                             (self._accept, (data_server, self._add_data_client)),
+                             (self._stream, ())):
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self.stop_event.set()
+        self.streaming.clear()
+        for server in self._servers:
+            server.close()
+        with self._clients_lock:
+            for client in self._clients:
+                client.close()
+            self._clients.clear()
+
+    def _listen(self, port):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, port))
+        server.listen()
+        server.settimeout(0.2)
+        self._servers.append(server)
+        return server
+
+    def _accept(self, server, handler):
+        while not self.stop_event.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            handler(conn)
+
+    def _serve_commands(self, conn):
+        def serve():
+            with conn:
+                conn.sendall(BANNER)
+                pending = b''
+                while not self.stop_event.is_set():
+                    try:
+                        data = conn.recv(1024)
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    pending += data
+                    while CMD_TERM in pending:
+                        command, pending = pending.split(CMD_TERM, 1)
+                        conn.sendall(self._handle_command(command.decode('ascii', 'replace').strip()))
+        threading.Thread(target=serve, daemon=True).start()
+
+    def _handle_command(self, command):
+        if command.upper() == 'START':
+            self.streaming.set()
+        elif command.upper() == 'STOP':
+            self.streaming.clear()
+        else:
+            return b'INVALID COMMAND' + CMD_TERM
+        return b'OK' + CMD_TERM
+
+    def _add_data_client(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._clients_lock:
+            self._clients.append(conn)
+
+    def _send(self, payload):
+        with self._clients_lock:
+            for client in list(self._clients):
+                try:
+                    client.sendall(payload)
+                except OSError:
+                    client.close()
+                    self._clients.remove(client)
+
+    def _next_burst(self):
+        jitter = self._random.uniform(-self.burst_jitter, self.burst_jitter)
+        return self.burst_interval * (1 + jitter)
+
+    def _stream(self):
+        while not self.stop_event.is_set():
+            if not self.streaming.wait(0.1):
+                continue
+            # Sample count and clock at START, every packet is due at start + samples / (rate * speed)
+            start_time = time.perf_counter()
+            start_samples = self.samples_sent
+            next_burst = start_time + self._next_burst() if self.burst_interval else None
+            held = []
+
+            while self.streaming.is_set() and not self.stop_event.is_set():
+                frames = self.source.next_frames(self.packet_samples)
+                self.samples_sent += self.packet_samples
+                if self.speed > 0:
+                    due = start_time + (self.samples_sent - start_samples) / (self.rate * self.speed)
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                if next_burst is None:
+                    self._send(frames.tobytes())
+                    continue
+                held.append(frames.tobytes())
+                if time.perf_counter() >= next_burst:
+                    self._send(b''.join(held))
+                    held.clear()
+                    next_burst += self._next_burst()
+
+
+def run_benchmark(simulator, num_blocks, samples_per_read):
+    """
+    Reads num_blocks blocks with pytrigno.TrignoEMG from the simulator and prints the throughput and read times.
+    """
+    import pytrigno
+
+    dev = pytrigno.TrignoEMG(channel_range=(0, TOTAL_CHANNELS - 1), samples_per_read=samples_per_read,
+                             host=simulator.host, cmd_port=simulator.cmd_port, data_port=simulator.data_port)
+    # The data socket must be connected before START, like with the real TCU
+    time.sleep(0.1)
+    dev.start()
+    out = np.empty((dev.num_channels, samples_per_read))
+    read_times = np.empty(num_blocks)
+    start = time.perf_counter()
+    for i in range(num_blocks):
+        t = time.perf_counter()
+        dev.read(out=out)
+        read_times[i] = time.perf_counter() - t
+    elapsed = time.perf_counter() - start
+    dev.stop()
+
+    samples = num_blocks * samples_per_read
+    print("Read {} blocks of {} samples in {:.3f} s: {:.0f} samples/s ({:.2f} x real time)".format(
+        num_blocks, samples_per_read, elapsed, samples / elapsed, samples / elapsed / simulator.rate))
+    print("Read time per block [ms]: median {:.3f}, p99 {:.3f}, max {:.3f}".format(
+        *(1000 * np.percentile(read_times, [50, 99, 100]))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument('--csv', nargs='+', help="Recordings in test_data to play back in a loop.")
+    source_group.add_argument('--synthetic', choices=['noise', 'sine', 'ramp'], default='noise',
+                              help="Synthetic source, used if no --csv is given. Default is noise.")
+    parser.add_argument('--scale', type=float, default=1 / config.RAW_SIGNAL_GAIN,
+                        help="Factor applied to the CSV values. Default undoes config.RAW_SIGNAL_GAIN.")
+    parser.add_argument('--host', default='localhost', help="Address to listen on. Default is localhost.")
+    parser.add_argument('--cmd-port', type=int, default=config.COMMAND_PORT)
+    parser.add_argument('--data-port', type=int, default=config.EMG_PORT)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="N x real time. 0 streams as fast as possible. Default is 1.")
+    parser.add_argument('--packet-samples', type=int, default=26, help="Samples per packet. Default is 26.")
+    parser.add_argument('--burst-interval', type=float, default=None,
+                        help="Send the data in bursts about this many seconds apart, e.g. 0.05.")
+    parser.add_argument('--burst-jitter', type=float, default=0.0,
+                        help="Relative random variation of the burst interval, between 0 and 1.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--benchmark', type=int, default=None, metavar='BLOCKS',
+                        help="Read this many blocks with pytrigno.TrignoEMG and report the throughput, then exit.")
+    parser.add_argument('--samples-per-read', type=int, default=config.SENSOR_FREQ)
+    args = parser.parse_args()
+
+    if args.csv:
+        source = CsvSource(args.csv, scale=args.scale)
+    else:
+        source = SyntheticSource(args.synthetic, seed=args.seed)
+
+    simulator = TCUSimulator(source, host=args.host, cmd_port=args.cmd_port, data_port=args.data_port,
+                             speed=args.speed, packet_samples=args.packet_samples, burst_interval=args.burst_interval,
+                             burst_jitter=args.burst_jitter, seed=args.seed)
+    simulator.start()
+    print("TCU simulator listening on {}:{} (commands) and {}:{} (EMG data)".format(
+        args.host, args.cmd_port, args.host, args.data_port))
+
+    try:
+        if args.benchmark:
+            run_benchmark(simulator, args.benchmark, args.samples_per_read)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
@@ -0,0 +1,146 @@
+from collections import namedtuple
+import threading
+import numpy as np
+
+
+SyncBlock = namedtuple('SyncBlock', ['emg', 'accel', 'start_index', 'accel_held'])
+SyncBlock.__doc__ = """
+One block of EMG with the accelerometer resampled onto the same samples.
+
+- emg: EMG array of shape (num_channels, samples), as returned by TrignoEMG.read.
+- accel: Acceleration array of shape (num_sensors, 3, samples), at the EMG sample times.
+- start_index: EMG sample index of the first column since the start of the acquisition.
+- accel_held: Number of samples (at the end of the block) past the newest accelerometer sample, where the last
+  accelerometer value is held instead of interpolated.
+"""
+
+
+class StreamingInterpolator:
+    """
+    Linear interpolation of a stream sampled at source_rate onto the sample index of a stream at target_rate.
+
+    Blocks are pushed as they arrive, and sample() returns the values at any range of target sample indices.
+    Target samples after the newest source sample hold its value, so the target stream never has to wait for the
+    source. Only the source samples still needed for the next target samples are kept.
+
+    Parameters:
+    - shape: Shape of one source sample, e.g. (num_sensors, 3). Blocks have time as the last axis.
+    - source_rate: Sampling rate of the pushed stream in Hz.
+    - target_rate: Sampling rate of the stream it is resampled to in Hz.
+    """
+    def __init__(self, shape, source_rate, target_rate):
+        self.shape = tuple(shape)
+        self.step = target_rate / source_rate  # Target samples between two source samples
+        self.source_count = 0
+        self._times = np.empty(0)
+        self._values = np.empty(self.shape + (0,))
+
+    def push(self, block):
+        """
+        Append a block of source samples of shape shape + (samples,).
+        """
+        n = block.shape[-1]
+        times = (self.source_count + np.arange(n)) * self.step
+        self._times = np.concatenate((self._times, times))
+        self._values = np.concatenate((self._values, block), axis=-1)
+        self.source_count += n
+
+    def sample(self, start_index, num_samples, out=None):
+        """
+        Values at the target sample indices start_index ... start_index + num_samples - 1.
+
+        Returns:
+        - out: Array of shape shape + (num_samples,). Zeros if nothing has been pushed yet.
+        - held: Number of target samples after the newest source sample.
+        """
+        if out is None:
+            out = np.empty(self.shape + (num_samples,))
+        t = start_index + np.arange(num_samples)
+
+        if self._times.size == 0:
+            out[...] = 0
+            return out, num_samples
+        held = int(np.count_nonzero(t > self._times[-1]))
+        if self._times.size == 1:
+            out[...] = self._values[..., :1]
+            return out, held
+
+        # Index of the source sample before each target sample, and the weight of the one after it
+        i = np.clip(np.searchsorted(self._times, t, side='right') - 1, 0, self._times.size - 2)
+        w = np.clip((t - self._times[i]) / self.step, 0.0, 1.0)
+        np.multiply(self._values[..., i], 1.0 - w, out=out)
+        out += self._values[..., i + 1] * w
+
+        # Drop the source samples that are older than the one before the next target sample
+        keep = max(np.searchsorted(self._times, start_index + num_samples, side='right') - 1, 0)
+        if keep:
+            self._times = self._times[keep:]
+            self._values = self._values[..., keep:]
+        return out, held
+
+
+class TrignoSyncAcquisition:
+    """
+    Reads the EMG and accelerometer data ports of the Trigno at the same time and returns synchronized blocks.
+
+    The accelerometer (148.1 Hz) is read on a background thread and resampled onto the EMG sample index (2000 Hz) with
+    a StreamingInterpolator. read() only waits for the EMG, like TrignoEMG.read, so the EMG path gets no extra latency.
+    Both streams are assumed to start at the same time, when the TCU is given START.
+
+    Parameters:
+    - emg: pytrigno.TrignoEMG device.
+    - accel: pytrigno.TrignoAccel device. Use a small samples_per_read so the accelerometer data is fresh.
+    - stop_event: threading.Event that stops the accelerometer thread when set.
+    """
+    def __init__(self, emg, accel, stop_event=None):
+        self.emg = emg
+        self.accel = accel
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.interpolator = StreamingInterpolator((accel.num_sensors, accel.AXES), accel.rate, emg.rate)
+        self.emg_index = 0
+        self.accel_error = None
+        self._lock = threading.Lock()
+        self._accel_thread = None
+
+    def start(self):
+        """
+        Start streaming (one START starts every data port of the TCU) and the accelerometer thread.
+        """
+        self.emg.start()
+        self._accel_thread = threading.Thread(target=self._read_accel, name='trigno_accel', daemon=True)
+        self._accel_thread.start()
+
+    def _read_accel(self):
+        while not self.stop_event.is_set():
+            try:
+                block = self.accel.read()
+            except IOError as e:
+                print("Error reading accelerometer data:", e)
+                self.accel_error = e
+                return
+            with self._lock:
+                self.interpolator.push(block)
+
+    def read(self):
+        """
+        Read one EMG block and the accelerometer at the same samples.
+
+        Returns:
+        - SyncBlock with the EMG, the resampled accelerometer and the sample index of the block.
+        """
+        emg = self.emg.read()
+        n = emg.shape[1]
+        with self._lock:
+            accel, held = self.interpolator.sample(self.emg_index, n)
+        block = SyncBlock(emg=emg, accel=accel, start_index=self.emg_index, accel_held=held)
+        self.emg_index += n
+        return block
+
+    def stop(self, timeout=1.0):
+        """
+        Stop streaming and wait for the accelerometer thread.
+        """
+        self.stop_event.set()
+        self.emg.stop()
+        if self._accel_thread is not None:
+            self._accel_thread.join(timeout)